@@ -1,5 +1,8 @@
 import datetime
 import re
+import time
+from subprocess import run
+from contextlib import contextmanager
 from pathlib import Path
 from random import randint
 from uuid import uuid4
@@ -10,18 +13,46 @@ from playwright_stealth import stealth_sync
 from rich.progress import Progress, SpinnerColumn, TextColumn
 
 from eredesscraper.meta import user_agent_list
+from eredesscraper.tracing import add_span
 from eredesscraper.utils import get_screen_resolution, map_month_matrix_names, pw_nav_year_back
 
 ENTRYPOINT = "https://balcaodigital.e-redes.pt/consumptions/history"
 
+# the browser of Playwright is installed (or found up to date) once per process, before its first launch
+_browser_installed = False
+
+
+def install_browser():
+    """
+    Installs the WebKit browser of Playwright and its system dependencies, once per process.
+    """
+    global _browser_installed
+
+    if _browser_installed:
+        return
+
+    assert run(["playwright", "install", "--with-deps", "webkit"],
+               capture_output=True).returncode == 0, "Failed to install Playwright dependencies."
+    _browser_installed = True
+
 
 class ScraperFlowError(Exception):
     pass
 
 
+class CaptchaError(ScraperFlowError):
+    """E-REDES asked for a captcha ("Validação de Segurança"): too many logins into the account."""
+
+
+class LoginError(ScraperFlowError):
+    """E-REDES rejected the credentials."""
+
+
 class EredesScraper:
     def __init__(self, nif, password, cpe_code, quiet: bool, headless: bool = True, uuid: uuid4 = uuid4()):
         self.dwnl_file = None
+        # wall time of each phase of the run, in seconds
+        self.timings = {}
         self.session_id = uuid
         self.browser = None
         self.context = None
@@ -89,139 +120,215 @@ class EredesScraper:
         self.context.close()
         self.browser.close()
 
-    def readings(self, month: int, year: int):
-        with Progress(
-                SpinnerColumn(),
-                TextColumn("[progress.description]{task.description}"),
-                transient=True,
-                disable=self.__quiet
-        ) as progress:
+    def _progress(self) -> Progress:
+        return Progress(
+            SpinnerColumn(),
+            TextColumn("[progress.description]{task.description}"),
+            transient=True,
+            disable=self.__quiet
+        )
 
-            date = datetime.datetime(year, month, 1)
+    def _time(self, phase: str, started: float):
+        # a session logging in once for several downloads adds up the time of their phases
+        elapsed = time.perf_counter() - started
+        self.timings[phase] = self.timings.get(phase, 0) + elapsed
+        add_span(f"agent.{phase}", elapsed)
 
-            current_date = datetime.datetime.now()
+    @staticmethod
+    def _check_date(month: int, year: int):
+        assert datetime.datetime(year, month, 1) <= datetime.datetime.now(), "Selected date is in the future"
 
-            assert date <= datetime.datetime.now(), "Selected date is in the future"
+    def _login(self, progress: Progress):
+        t1 = progress.add_task(description=" 🔐 Logging in...", total=None)
+        started = time.perf_counter()
 
-            t1 = progress.add_task(description=" 🔐 Logging in...", total=None)
+        self.page.goto(ENTRYPOINT)
 
-            self.page.goto(ENTRYPOINT)
+        self.page.get_by_text("Particular").click()
 
-            self.page.get_by_text("Particular").click()
+        self.page.get_by_label("NIF").fill(f"{self.__nif}")
 
-            self.page.get_by_label("NIF").fill(f"{self.__nif}")
+        self.page.get_by_label("Password").fill(f"{self.__password}")
 
-            self.page.get_by_label("Password").fill(f"{self.__password}")
+        self.page.get_by_role("button", name="Entrar").click()
+        # self.page.get_by_label("Password").press("Enter")
+        # self.page.get_by_text("Entrar").click()
 
-            self.page.get_by_role("button", name="Entrar").click()
-            # self.page.get_by_label("Password").press("Enter")
-            # self.page.get_by_text("Entrar").click()
+        # try:
+        #     self.page.get_by_text("Leituras, contadores,").click()
+        #     # self.page.get_by_role("heading", name="Os meus locais").click()                
+        # except ScraperFlowError:
+        #     self.page.screenshot(path=f"{Path.cwd()}/ers_login_error.png")
+        #     with open(f"{Path.cwd()}/ers_login_error.html", "w") as f:
+        #         f.write(self.page.content())
+        #     if self.page.locator(has_text="Dados inválidos").is_visible():
+        #         raise ScraperFlowError("🔐 Invalid Credentials!\nCheck your NIF and "
+        #                                "Password with `ers config show`.\nA screenshot was saved in the current "
+        #                                "directory for debugging purposes.")
 
-            # try:
-            #     self.page.get_by_text("Leituras, contadores,").click()
-            #     # self.page.get_by_role("heading", name="Os meus locais").click()                
-            # except ScraperFlowError:
-            #     self.page.screenshot(path=f"{Path.cwd()}/ers_login_error.png")
-            #     with open(f"{Path.cwd()}/ers_login_error.html", "w") as f:
-            #         f.write(self.page.content())
-            #     if self.page.locator(has_text="Dados inválidos").is_visible():
-            #         raise ScraperFlowError("🔐 Invalid Credentials!\nCheck your NIF and "
-            #                                "Password with `ers config show`.\nA screenshot was saved in the current "
-            #                                "directory for debugging purposes.")
+        if self.page.get_by_text("Dados inválidos").is_visible():
+            raise LoginError("🔐 Invalid Credentials! Check your NIF and Password with `ers config show`.")
 
-            try:
-                captcha = self.page.locator("h1").filter(has_text="Validação de Segurança")
+        try:
+            captcha = self.page.locator("h1").filter(has_text="Validação de Segurança")
 
-                if captcha.is_visible():
-                    print("🔐 Captcha detected. Try again later")
-                    raise ScraperFlowError(
-                        "🔐 Captcha detected. A screenshot was saved in the current directory for debugging purposes"
-                        "\nPlease try again later.")
-            except ScraperFlowError:
-                self.page.screenshot(path=f"{Path.cwd()}/ers_captcha_error.png")
-                raise ScraperFlowError(
+            if captcha.is_visible():
+                print("🔐 Captcha detected. Try again later")
+                raise CaptchaError(
                     "🔐 Captcha detected. A screenshot was saved in the current directory for debugging purposes"
                     "\nPlease try again later.")
+        except ScraperFlowError:
+            self.page.screenshot(path=f"{Path.cwd()}/ers_captcha_error.png")
+            raise CaptchaError(
+                "🔐 Captcha detected. A screenshot was saved in the current directory for debugging purposes"
+                "\nPlease try again later.")
+
+        self._time("login", started)
+        progress.remove_task(t1)
+
+    def _find_cpe(self, progress: Progress, cpe_code: str):
+        t2 = progress.add_task(description=" 💡 Finding your CPE...", total=None)
+        started = time.perf_counter()
+
+        # self.page.get_by_text("Produção, consumos e potências").click()
 
-            progress.remove_task(t1)
-            t2 = progress.add_task(description=" 💡 Finding your CPE...", total=None)
+        # self.page.get_by_text("Consultar histórico").click()
 
-            # self.page.get_by_text("Produção, consumos e potências").click()
+        # self.page.locator("p").filter(has_text=re.compile(self.__cpe_code)).click()
 
-            # self.page.get_by_text("Consultar histórico").click()
+        try:
+            self.page.locator("p").filter(has_text=re.compile(r"^" + cpe_code + "$")).click(timeout=120000)
+        except ScraperFlowError:
+            self.page.screenshot(path=f"{Path.cwd()}/ers_cpe_error.png")
+            raise ScraperFlowError("💥 Failed to find the CPE code. A screenshot was "
+                                   "saved in the current directory for debugging purposes")
 
-            # self.page.locator("p").filter(has_text=re.compile(self.__cpe_code)).click()
+        self._time("cpe", started)
+        progress.remove_task(t2)
 
-            try:
-                self.page.locator("p").filter(has_text=re.compile(r"^" + self.__cpe_code + "$")).click(timeout=120000)
-            except ScraperFlowError:
-                self.page.screenshot(path=f"{Path.cwd()}/ers_cpe_error.png")
-                raise ScraperFlowError("💥 Failed to find the CPE code. A screenshot was "
-                                       "saved in the current directory for debugging purposes")
+    def _download(self, progress: Progress, month: int, year: int, file_id: str) -> Path:
+        t3 = progress.add_task(description=" 📊 Downloading your data...", total=None)
+        started = time.perf_counter()
 
-            progress.remove_task(t2)
-            t3 = progress.add_task(description=" 📊 Downloading your data...", total=None)
+        date = datetime.datetime(year, month, 1)
 
-            if date.strftime("%Y-%m") != current_date.strftime("%Y-%m"):
+        current_date = datetime.datetime.now()
 
-                month_str = map_month_matrix_names(date)
+        if date.strftime("%Y-%m") != current_date.strftime("%Y-%m"):
 
-                self.page.get_by_role("textbox", name="Select month").click()
+            month_str = map_month_matrix_names(date)
 
-                if date.year != current_date.now().year:
+            self.page.get_by_role("textbox", name="Select month").click()
 
-                    self.page.get_by_role("button", name=f"{current_date.year}").click()
+            if date.year != current_date.now().year:
 
-                    target_year = self.page.get_by_text(f"{date.year}", exact=True)
+                self.page.get_by_role("button", name=f"{current_date.year}").click()
 
-                    if not target_year.is_visible():
-                        self.page = pw_nav_year_back(date=date, pw_page=self.page)
+                target_year = self.page.get_by_text(f"{date.year}", exact=True)
 
-                    target_year = self.page.get_by_text(f"{date.year}", exact=True)
+                if not target_year.is_visible():
+                    self.page = pw_nav_year_back(date=date, pw_page=self.page)
 
-                    is_disabled = bool(target_year.get_attribute("aria-disabled"))
+                target_year = self.page.get_by_text(f"{date.year}", exact=True)
 
-                    if is_disabled:
-                        raise ScraperFlowError("There is no available data for the selected year")
-                    else:
-                        target_year.click()
+                is_disabled = bool(target_year.get_attribute("aria-disabled"))
 
-                if self.page.get_by_role("gridcell", name=f"{month_str}").is_disabled():
-                    self.page.screenshot(path=f"{Path.cwd()}/ers_month_error.png")
-                    raise ScraperFlowError("Selected month is not available. A screenshot was saved in the current "
-                                           "directory for debugging purposes")
+                if is_disabled:
+                    raise ScraperFlowError("There is no available data for the selected year")
+                else:
+                    target_year.click()
 
-                self.page.get_by_role("gridcell", name=f"{month_str}").click()
+            if self.page.get_by_role("gridcell", name=f"{month_str}").is_disabled():
+                self.page.screenshot(path=f"{Path.cwd()}/ers_month_error.png")
+                raise ScraperFlowError("Selected month is not available. A screenshot was saved in the current "
+                                       "directory for debugging purposes")
 
-            try:
-                with self.page.expect_event("download") as download_info:
+            self.page.get_by_role("gridcell", name=f"{month_str}").click()
 
-                    # self.page.get_by_text("Exportar excel").click()
-                    self.page.locator("a").filter(has_text="Exportar excel").click()
+        dwnl_file = Path(self.tmp) / f"{year}_{month}_{file_id}_readings.xlsx"
 
-                    download = download_info.value
+        try:
+            with self.page.expect_event("download") as download_info:
 
-                download.save_as(f"{self.tmp}/{year}_{month}_{self.session_id.__str__().split('-')[0]}_readings.xlsx")
+                # self.page.get_by_text("Exportar excel").click()
+                self.page.locator("a").filter(has_text="Exportar excel").click()
 
-            except ScraperFlowError:
-                self.page.screenshot(path=f"{Path.cwd()}/ers_download_error.png")
-                raise ScraperFlowError("Failed to find the 'Exportar excel' element")
+                download = download_info.value
 
-            self.dwnl_file = Path(self.tmp) / f"{year}_{month}_{self.session_id.__str__().split('-')[0]}_readings.xlsx"
+            download.save_as(dwnl_file.__str__())
 
-            assert self.dwnl_file.exists(), "Failed to download the file"
+        except ScraperFlowError:
+            self.page.screenshot(path=f"{Path.cwd()}/ers_download_error.png")
+            raise ScraperFlowError("Failed to find the 'Exportar excel' element")
 
+        assert dwnl_file.exists(), "Failed to download the file"
+        self._time("download", started)
         progress.remove_task(t3)
+
+        return dwnl_file
+
+    def readings(self, month: int, year: int):
+        self._check_date(month, year)
+
+        with self._progress() as progress:
+            self._login(progress)
+            self._find_cpe(progress, self.__cpe_code)
+            self.dwnl_file = self._download(progress, month, year, self.session_id.__str__().split('-')[0])
+
         if not self.__quiet:
             typer.echo(f"📁\tDownloaded file: {self.dwnl_file}")
 
         return self.dwnl_file
 
-    def run(self, month, year):
+    def iter_readings(self, periods: list):
+        """
+        Logs in once and downloads the readings of several months and CPEs of the account.
+
+        Args:
+            periods (list): The (key, CPE, month, year) of each download. The key names its downloaded file.
+
+        Yields:
+            tuple: The key and the path to the downloaded file (or the exception that failed the download), as soon
+            as each download is finished.
+
+        Raises:
+            CaptchaError: If E-REDES asked for a captcha.
+            LoginError: If E-REDES rejected the credentials.
+        """
+        with self._progress() as progress:
+            self._login(progress)
+            # the page of the history of the first CPE is shown after the login
+            fresh = True
+
+            for key, cpe_code, month, year in periods:
+                try:
+                    self._check_date(month, year)
+                    if not fresh:
+                        # back to the list of the CPEs of the account, still logged in
+                        self.page.goto(ENTRYPOINT)
+                    fresh = False
+                    self._find_cpe(progress, cpe_code)
+                    dwnl_file = self._download(progress, month, year, key.split('-')[0])
+                except (AssertionError, ScraperFlowError) as e:
+                    if isinstance(e, (CaptchaError, LoginError)):
+                        raise
+                    yield key, e
+                    continue
+
+                if not self.__quiet:
+                    typer.echo(f"📁\tDownloaded file: {dwnl_file}")
+
+                yield key, dwnl_file
+
+    @contextmanager
+    def _browser(self):
         ua = user_agent_list[randint(0, len(user_agent_list) - 1)]
         # get system screen resolution
 
+        install_browser()
+
         with sync_playwright() as p:
+            started = time.perf_counter()
             self.browser = p.webkit.launch(headless=self.headless, downloads_path=self.tmp)
             self.context = self.browser.new_context(
                 # user_agent=ua,
@@ -231,5 +338,18 @@ class EredesScraper:
             self.context.set_default_timeout(self.__implicit_wait * 1000)
             self.page = self.context.new_page()
             stealth_sync(self.page)
-            self.readings(month, year)
+            self._time("browser", started)
+            yield
             self.teardown()
+
+    def run(self, month, year):
+        with self._browser():
+            self.readings(month, year)
+
+    def download_many(self, periods: list):
+        """
+        Runs the browser once for several downloads, yielding each one as soon as it is finished (see
+        ``iter_readings``).
+        """
+        with self._browser():
+            yield from self.iter_readings(periods)
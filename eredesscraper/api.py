@@ -1,79 +1,370 @@
+import asyncio
+import base64
 import io
 import json
+import shutil
+import tempfile
+import threading
+from contextlib import asynccontextmanager
 from datetime import datetime
+from functools import partial
 from pathlib import Path
-from uuid import uuid4
+from typing import Optional
+from uuid import UUID, uuid4
 from importlib.resources import files
 
 import requests
 import yaml
-from fastapi import BackgroundTasks, FastAPI, HTTPException, UploadFile, File, Depends
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Request, Query, WebSocket, \
+    WebSocketDisconnect
 from fastapi.openapi.utils import get_openapi
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from typer import get_app_dir
 
+from eredesscraper import metrics
 from eredesscraper._version import get_version
-from eredesscraper.backend import DuckDB
-from eredesscraper.meta import supported_workflows, supported_databases
+from eredesscraper.backend import DuckDB, DuckDBWriter, active_statuses
+from eredesscraper.blobstore import BlobStore
+from eredesscraper.events import TaskEvents, status_event
+from eredesscraper.meta import supported_workflows
 from eredesscraper.models import WorkflowRequestRecord, TaskstatusRecord, RunWorkflowRequest, ConfigSetRequest, \
-    ConfigLoadRequest, Config, WorkflowAsyncResponse, WorkflowResponse
-from eredesscraper.utils import parse_config, flatten_config, struct_config, infer_type, file2blob
+    ConfigLoadRequest, Config, WorkflowAsyncResponse, WorkflowResponse, TaskSummary, TaskListResponse, Retention, \
+    Workers, JobRecord, JobLease, JobLeaseRequest, Limits, Breaker, BreakerRecord, ScheduleEntry, RunBatchRequest, \
+    BatchChild, BatchTaskRecord, BatchResponse, BatchStatusResponse
+from eredesscraper.breaker import CircuitBreaker, CircuitOpen, admit, breaker_failure, logged_in
+from eredesscraper.ratelimit import RateLimiter, RateLimited, config_account
+from eredesscraper.scheduler import Scheduler
+from eredesscraper.singleflight import SingleFlight, flight_key
+from eredesscraper.sinks import available_sinks
+from eredesscraper.utils import parse_config, flatten_config, struct_config, infer_type, batch_months, \
+    save_config, config_version
+from eredesscraper.workers import WorkerPool
 from eredesscraper.workflows import switchboard
 
 appdir = get_app_dir(app_name="ers")
 config_path = Path(appdir) / "cache" / "config.yml"
 openapi_spec = files("eredesscraper").joinpath("openapi.json")
 openapi_url = Path(str(openapi_spec))
+# child tasks of a batch: 10 years of a CPE, run in a single browser session
+max_batch_tasks = 120
+profile_description = ("Profile the run: its CPU profile and peak memory are written next to its output, and linked "
+                       "from its task status")
+
+
+def config_section(name: str, model):
+    try:
+        section = parse_config(config_path).get(name)
+    except (AssertionError, FileNotFoundError):
+        return None
+
+    return model(**section) if section else None
+
+
+def retention_policy() -> Retention | None:
+    return config_section('retention', Retention)
+
+
+def run_maintenance(ddb: DuckDB, blobs: BlobStore, stop: threading.Event):
+    """
+    Applies the retention policy of the loaded config file periodically, until ``stop`` is set.
+    """
+    while True:
+        policy = retention_policy()
+
+        if policy is not None:
+            cursor = ddb.cursor()
+            try:
+                cursor.compact(max_age_days=policy.max_age_days,
+                               max_tasks=policy.max_tasks,
+                               max_file_bytes=policy.max_file_mb * 1024 * 1024 if policy.max_file_mb else None,
+                               blobs=blobs)
+            except Exception as e:
+                print(f"💥\tFailed to apply the retention policy: {e}")
+            finally:
+                cursor.close()
+
+        if stop.wait((policy.interval_hours if policy else Retention().interval_hours) * 3600):
+            break
+
+
+def queued_jobs(ddb: DuckDB) -> int:
+    cursor = ddb.cursor()
+    try:
+        return cursor.count_queued_jobs()
+    finally:
+        cursor.close()
+
+
+def state_db_bytes(ddb: DuckDB) -> int:
+    path = Path(ddb.db_path)
+    return sum(p.stat().st_size for p in (path, path.with_name(f"{path.name}.wal")) if p.exists())
+
+
+def task_active(ddb: DuckDB, task_id: str) -> bool:
+    cursor = ddb.cursor()
+    try:
+        record = cursor.get_taskstatus(task_id).fetchone()
+    finally:
+        cursor.close()
+
+    return record is not None and record[1] in active_statuses
+
+
+def run_scheduled(app: FastAPI, entry: ScheduleEntry) -> str:
+    """
+    Queues the workflow of a schedule entry, like ``/run_async``.
+    """
+    cursor = app.state.ddb.cursor()
+    try:
+        flight, _ = enqueue_workflow(RunWorkflowRequest(workflow=entry.workflow, db=entry.db, delta=entry.delta),
+                                     cursor, app.state.writer, app.state.workers, app.state.flights,
+                                     app.state.limiter)
+    finally:
+        cursor.close()
+
+    return flight.task_id
+
+
+def start_scheduler(app: FastAPI) -> Scheduler | None:
+    """
+    Starts the scheduler of the ``schedule`` section of the loaded config file, if any.
+    """
+    try:
+        config = parse_config(config_path)
+        entries = [ScheduleEntry(**entry) for entry in config.get("schedule") or []]
+        if not entries:
+            return None
+        scheduler = Scheduler(entries, cpe=str(config["eredes"]["cpe"]), enqueue=partial(run_scheduled, app),
+                              is_active=partial(task_active, app.state.ddb))
+    except (AssertionError, FileNotFoundError):
+        return None
+    except ValueError as e:
+        print(f"💥	Invalid schedule, no workflow is scheduled: {e}")
+        return None
+
+    return scheduler.start()
+
+
+def reload_settings(app: FastAPI):
+    """
+    Applies the settings of the loaded config file to the running server: the limits, the circuit breaker, the
+    leases of the worker pool and the schedule. The number of worker processes still applies on restart.
+    """
+    state = app.state
+    if getattr(state, "workers", None) is None:
+        # the server is not started
+        return
+
+    with state.reload_lock:
+        state.limiter.update(config_section('limits', Limits))
+        state.breaker.settings = config_section('breaker', Breaker) or Breaker()
+
+        workers = config_section('workers', Workers) or Workers()
+        state.workers.lease_seconds, state.workers.max_attempts = workers.lease_seconds, workers.max_attempts
+
+        previous = state.scheduler
+        if previous is not None:
+            previous.stop()
+        state.scheduler = start_scheduler(app)
+        if previous is not None and state.scheduler is not None:
+            # a run still in progress is not started again
+            state.scheduler.last_task = previous.last_task
+
+
+def watch_config(app: FastAPI, stop: threading.Event, interval: float = 5):
+    """
+    Reloads the settings of the server whenever the loaded config file changes, until ``stop`` is set.
+    """
+    version = config_version(config_path)
+
+    while not stop.wait(interval):
+        current = config_version(config_path)
+        if current == version:
+            continue
+
+        version = current
+        try:
+            reload_settings(app)
+        except Exception as e:
+            print(f"💥\tFailed to reload the config file: {e}")
+
+
+def publish_taskstatus(events: TaskEvents, flights: SingleFlight, operation: str, record):
+    if isinstance(record, TaskstatusRecord):
+        events.publish(record)
+        flights.resolve(record)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # one connection for the whole process. Requests read through their own cursor over it, and every write goes
+    # through the single writer thread
+    app.state.ddb = DuckDB()
+    app.state.events = TaskEvents()
+    app.state.flights = SingleFlight()
+    app.state.writer = DuckDBWriter(app.state.ddb, on_write=partial(publish_taskstatus, app.state.events,
+                                                                    app.state.flights)).start()
+    app.state.blobs = BlobStore()
+
+    stop_maintenance = threading.Event()
+    maintenance = threading.Thread(target=run_maintenance, args=(app.state.ddb, app.state.blobs, stop_maintenance),
+                                   name="ers-maintenance", daemon=True)
+    maintenance.start()
+
+    # settings of the limits, the breaker, the leases and the schedule are reloaded when the config file changes
+    app.state.reload_lock = threading.Lock()
+    app.state.limiter = RateLimiter(config_section('limits', Limits))
+    app.state.breaker = CircuitBreaker(app.state.ddb, app.state.writer, config_section('breaker', Breaker))
+    workers = config_section('workers', Workers) or Workers()
+    app.state.workers = WorkerPool(app.state.ddb, app.state.writer, app.state.blobs, config_path.resolve(),
+                                   processes=workers.processes, lease_seconds=workers.lease_seconds,
+                                   max_attempts=workers.max_attempts, limiter=app.state.limiter,
+                                   breaker=app.state.breaker).start()
+
+    app.state.scheduler = start_scheduler(app)
+
+    watcher = threading.Thread(target=watch_config, args=(app, stop_maintenance), name="ers-config-watcher",
+                               daemon=True)
+    watcher.start()
+
+    # read when the metrics are collected
+    metrics.queue_depth.set_function(partial(queued_jobs, app.state.ddb))
+    metrics.scrapes_running.set_function(app.state.limiter.running)
+    metrics.state_size.set_function(partial(state_db_bytes, app.state.ddb))
+
+    yield
+
+    for gauge in (metrics.queue_depth, metrics.scrapes_running, metrics.state_size):
+        gauge.set_function(None)
+
+    stop_maintenance.set()
+    maintenance.join()
+    watcher.join()
+    if app.state.scheduler is not None:
+        app.state.scheduler.stop()
+    app.state.workers.stop()
+    app.state.writer.stop()
+    app.state.ddb.close()
+
 
 app = FastAPI(
     title="E-REDES Scraper API",
     description="An API to interact with the E-REDES Scraper application",
-    version=get_version()
+    version=get_version(),
+    lifespan=lifespan
 )
 
+app.add_middleware(metrics.RequestMetrics)
 
-def get_db():
-    ddb = DuckDB()
 
-    return ddb
+def get_db(request: Request):
+    ddb = request.app.state.ddb.cursor()
 
+    try:
+        yield ddb
+    finally:
+        ddb.close()
 
-def run_workflow_task(task_id: uuid4, config_path: Path, name: str, db: list, month: int, year: int, delta: bool,
-                      keep: bool, ddb: DuckDB = None):
-    ts = TaskstatusRecord(task_id=task_id,
-                          status="running",
-                          file=None,
-                          created=None,
-                          updated=datetime.now())
 
-    ddb.update_taskstatus(ts)
+def get_writer(request: Request) -> DuckDBWriter:
+    return request.app.state.writer
+
+
+def get_blobs(request: Request) -> BlobStore:
+    return request.app.state.blobs
+
+
+def get_workers(request: Request) -> WorkerPool:
+    return request.app.state.workers
+
+
+def get_flights(request: Request) -> SingleFlight:
+    return request.app.state.flights
+
+
+def get_limiter(request: Request) -> RateLimiter:
+    return request.app.state.limiter
+
+
+def get_breaker(request: Request) -> CircuitBreaker:
+    return request.app.state.breaker
+
+
+def too_many_requests(e: RateLimited) -> HTTPException:
+    # an open circuit breaker pauses the account, whatever the rate of the requests
+    return HTTPException(status_code=503 if isinstance(e, CircuitOpen) else 429, detail=str(e),
+                         headers={"Retry-After": e.retry_after_header})
+
+
+def request_flight_key(request: RunWorkflowRequest) -> str:
+    return flight_key(request, cpe=str(parse_config(config_path)['eredes']['cpe']))
+
+
+def check_range(request: RunWorkflowRequest):
+    """
+    Checks the range of months of a ``backfill`` request, before a task is started for it.
+
+    Raises:
+        HTTPException: 422 if the range is missing or invalid.
+    """
+    if request.workflow != "backfill":
+        return
+
+    if request.start is None:
+        raise HTTPException(status_code=422, detail="Specify the first month (start) for the backfill workflow")
 
     try:
-        result = switchboard(
-            config_path=config_path,
-            name=name,
-            db=db,
-            month=month,
-            year=year,
-            delta=delta,
-            keep=keep,
-            quiet=True,
-            uuid=task_id
+        batch_months(start=request.start, end=request.end)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
-        )
 
-        ts.status = "completed"
-        ts.file = file2blob(result.source_data) if result.source_data else None
-        ts.updated = datetime.now()
+def byte_range(header: str, size: int) -> tuple | None:
+    """
+    Parses a single-range ``Range`` request header.
 
-        ddb.update_taskstatus(ts)
+    Args:
+        header (str): The header value, e.g. ``bytes=0-1023``, ``bytes=1024-`` or ``bytes=-512``.
+        size (int): The size of the file, in bytes.
 
-    except Exception as e:
+    Returns:
+        tuple | None: The (first, last) byte positions (inclusive), or None if the header is not a single byte range.
 
-        ts.status = f"failed: {str(e)}"
-        ts.updated = datetime.now()
+    Raises:
+        ValueError: If the range cannot be satisfied.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec or "-" not in spec:
+        return None
 
-        ddb.update_taskstatus(ts)
+    first, _, last = (part.strip() for part in spec.partition("-"))
+
+    try:
+        if first:
+            first, last = int(first), min(int(last), size - 1) if last else size - 1
+        elif last:
+            first, last = max(size - int(last), 0), size - 1
+        else:
+            return None
+    except ValueError:
+        return None
+
+    if first > last or first >= size:
+        raise ValueError("Range not satisfiable")
+
+    return first, last
+
+
+def encode_cursor(created: datetime, task_id: UUID) -> str:
+    return base64.urlsafe_b64encode(f"{created.isoformat()}|{task_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        created, task_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created), UUID(task_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 
 @app.get("/version", summary="Show the current version")
@@ -81,35 +372,82 @@ def get_version_api():
     return {"version": get_version()}
 
 
+@app.get("/metrics", summary="Operational metrics of the API server (OpenMetrics)")
+def get_metrics():
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/info", summary="Get information about the available workflows and databases")
 def get_info():
-    return {"workflows": supported_workflows, "databases": supported_databases}
+    return {"workflows": supported_workflows, "databases": list(available_sinks())}
 
 
-@app.post("/run", summary="Run the scraper workflow")
-def run_workflow(request: RunWorkflowRequest, ddb=Depends(get_db), response_model=WorkflowResponse):
+@app.post("/run", summary="Run the scraper workflow",
+          responses={429: {"description": "Too many scrapes for the account: retry after `Retry-After` seconds"},
+                     503: {"description": "The scrapes of the account are paused by its circuit breaker: retry "
+                                          "after `Retry-After` seconds"}})
+def run_workflow(request: RunWorkflowRequest, ddb=Depends(get_db), writer=Depends(get_writer),
+                 blobs=Depends(get_blobs), flights=Depends(get_flights), limiter=Depends(get_limiter),
+                 breaker=Depends(get_breaker), profile: bool = Query(False, description=profile_description),
+                 response_model=WorkflowResponse):
     if not config_path.exists():
         raise HTTPException(status_code=404, detail="Config file not found. Please load it first.")
 
-    task_id = uuid4().__str__()
+    check_range(request)
 
-    wf = WorkflowRequestRecord(task_id=task_id,
-                               workflow=request.workflow,
-                               db=request.db or [],
-                               month=request.month,
-                               year=request.year,
-                               delta=request.delta,
-                               download=request.download)
+    key = request_flight_key(request)
+    admissions = []
 
-    ddb.insert_workflow_request(wf)
+    def start(task_id: str):
+        admissions.append(admit(config_account(config_path), breaker, limiter))
 
-    ts = TaskstatusRecord(task_id=task_id,
-                          status="running",
-                          file=None,
-                          created=datetime.now(),
-                          updated=None)
+        writer.insert_workflow_request(WorkflowRequestRecord(task_id=task_id,
+                                                             workflow=request.workflow,
+                                                             db=request.db or [],
+                                                             month=request.month,
+                                                             year=request.year,
+                                                             delta=request.delta,
+                                                             download=request.download))
+
+        writer.insert_taskstatus(TaskstatusRecord(task_id=task_id,
+                                                  status="running",
+                                                  file=None,
+                                                  created=datetime.now(),
+                                                  updated=None)).result()
+
+    try:
+        flight, started = flights.attach(key, uuid4().__str__(), start, find=partial(ddb.find_queued_task, key))
+    except RateLimited as e:
+        raise too_many_requests(e)
+    except Exception:
+        for admission in admissions:
+            admission.cancel()
+        raise
+
+    if not started:
+        # an identical request is in flight: share its result
+        ts = flight.future.result()
+
+        if ts.status.startswith("failed"):
+            raise HTTPException(status_code=500, detail=ts.status.removeprefix("failed: "))
+
+        file_path = blobs.path(ts.file_hash) if ts.file_hash and blobs.exists(ts.file_hash) else None
 
-    ddb.insert_taskstatus(ts)
+        if file_path and request.download:
+            return FileResponse(file_path, media_type="application/octet-stream",
+                                filename=f"{flight.task_id.split('-')[0]}_readings.xlsx")
+
+        return response_model(
+            task_id=flight.task_id,
+            workflow=request.workflow,
+            databases=request.db or [],
+            source_data=file_path,
+            staging_area=file_path.parent if file_path else None,
+            status=ts.status,
+            timestamp=datetime.now(),
+        )
+
+    task_id = flight.task_id
 
     try:
         result = switchboard(
@@ -121,27 +459,44 @@ def run_workflow(request: RunWorkflowRequest, ddb=Depends(get_db), response_mode
             delta=request.delta,
             keep=True if request.download else False,
             quiet=True,
-            uuid=task_id
+            uuid=task_id,
+            cache=not request.no_cache,
+            start=request.start,
+            end=request.end,
+            profile=profile
         )
+        file_hash = blobs.put(result.source_data) if result.source_data else None
     except Exception as e:
+        admissions[0].finish(breaker_failure(e), error=str(e))
+        metrics.observe_task("failed", breaker_failure(e))
+
         ts = TaskstatusRecord(task_id=task_id,
                               status=f"failed: {str(e)}",
                               file=None,
                               created=None,
                               updated=datetime.now())
 
-        ddb.update_taskstatus(ts)
+        writer.update_taskstatus(ts)
 
         raise HTTPException(status_code=500, detail=str(e))
 
-    ts.status = "completed"
-    ts.created = None
-    ts.updated = datetime.now()
-    ts.file = file2blob(result.source_data) if result.source_data else None
+    stats = metrics.session_stats(result)
+    if logged_in(stats):
+        admissions[0].finish()
+    else:
+        # served from the result cache: no login was attempted
+        admissions[0].cancel()
+    metrics.observe_task(result.status, stats=stats)
 
-    ddb.update_taskstatus(ts)
+    ts = TaskstatusRecord(task_id=task_id,
+                          status=result.status,
+                          file=None,
+                          created=None,
+                          updated=datetime.now(),
+                          file_hash=file_hash,
+                          profile=str(result.profile) if result.profile else None)
 
-    ddb.__del__()
+    writer.update_taskstatus(ts).result()
 
     if result.source_data and request.download:
         return FileResponse(result.source_data, media_type="application/octet-stream",
@@ -150,7 +505,7 @@ def run_workflow(request: RunWorkflowRequest, ddb=Depends(get_db), response_mode
         return response_model(
             task_id=task_id,
             workflow=request.workflow,
-            databases=request.db,
+            databases=request.db or [],
             source_data=result.source_data,
             staging_area=result.staging_area,
             status=ts.status,
@@ -158,56 +513,255 @@ def run_workflow(request: RunWorkflowRequest, ddb=Depends(get_db), response_mode
         )
 
 
-@app.post("/run_async", summary="Run the scraper workflow asynchronously")
-def run_workflow_async(background_tasks: BackgroundTasks, request: RunWorkflowRequest, ddb=Depends(get_db), response_model=WorkflowAsyncResponse):
+def enqueue_workflow(request: RunWorkflowRequest, ddb: DuckDB, writer: DuckDBWriter, workers: WorkerPool,
+                     flights: SingleFlight, limiter: RateLimiter, profile: bool = False) -> tuple:
+    """
+    Queues a workflow for the workers, or attaches to the identical workflow already in flight.
+
+    Args:
+        request (RunWorkflowRequest): The workflow request.
+        ddb (DuckDB): The cursor of the calling thread.
+        writer (DuckDBWriter): The writer of the state database.
+        workers (WorkerPool): The worker pool, notified of the new job.
+        flights (SingleFlight): The workflows in flight.
+        limiter (RateLimiter): The admission control of the job queue.
+        profile (bool, optional): Profile the task. Defaults to False.
+
+    Returns:
+        tuple: The ``Flight`` of the task, and True if the task was queued by this call, False if it was attached to.
+
+    Raises:
+        RateLimited: If the job queue is full.
+    """
+    key = request_flight_key(request)
+
+    def start(task_id: UUID):
+        limiter.check_queue(ddb.count_queued_jobs())
+
+        writer.insert_workflow_request(WorkflowRequestRecord(task_id=task_id,
+                                                             workflow=request.workflow,
+                                                             db=request.db or [],
+                                                             month=request.month,
+                                                             year=request.year,
+                                                             delta=request.delta,
+                                                             download=request.download))
+
+        ts = TaskstatusRecord(task_id=task_id,
+                              status="queued",
+                              file=None,
+                              created=datetime.now(),
+                              updated=None)
+
+        writer.insert_taskstatus(ts).result()
+
+        try:
+            writer.insert_job(JobRecord(task_id=task_id, flight_key=key, no_cache=request.no_cache,
+                                        range_start=request.start, range_end=request.end,
+                                        profile=profile)).result()
+        except Exception as e:
+            ts.status = f"failed: {str(e)}"
+            ts.created = None
+            ts.updated = datetime.now()
+
+            writer.update_taskstatus(ts)
+            raise
+
+        workers.notify()
+
+    return flights.attach(key, uuid4(), start, find=partial(ddb.find_queued_task, key))
+
+
+@app.post("/run_async", summary="Run the scraper workflow asynchronously",
+          responses={429: {"description": "The job queue is full: retry after `Retry-After` seconds"}})
+def run_workflow_async(request: RunWorkflowRequest, ddb=Depends(get_db), writer=Depends(get_writer),
+                       workers=Depends(get_workers), flights=Depends(get_flights), limiter=Depends(get_limiter),
+                       profile: bool = Query(False, description=profile_description),
+                       response_model=WorkflowAsyncResponse):
     if not config_path.exists():
         raise HTTPException(status_code=404, detail="Config file not found. Please load it first.")
 
+    check_range(request)
+
+    try:
+        flight, started = enqueue_workflow(request, ddb, writer, workers, flights, limiter, profile=profile)
+    except RateLimited as e:
+        raise too_many_requests(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if not started:
+        record = ddb.get_taskstatus(flight.task_id).fetchone()
+        return response_model(**{"task_id": flight.task_id, "status": record[1] if record else "queued",
+                                 "detail": "Attached to the identical workflow already in flight"})
+
+    return response_model(**{"task_id": flight.task_id, "status": "queued", "detail": "Workflow queued successfully"})
+
+
+def enqueue_batch(request: RunBatchRequest, ddb: DuckDB, writer: DuckDBWriter, workers: WorkerPool,
+                  limiter: RateLimiter) -> tuple:
+    """
+    Queues a batch: a parent task, and a child task per month and CPE, all run by a single job.
+
+    The config file holds a single E-REDES account, so the whole batch is run in one browser session by a single
+    worker, logging in once.
+
+    Args:
+        request (RunBatchRequest): The batch request.
+        ddb (DuckDB): The cursor of the calling thread.
+        writer (DuckDBWriter): The writer of the state database.
+        workers (WorkerPool): The worker pool, notified of the new job.
+        limiter (RateLimiter): The admission control of the job queue.
+
+    Returns:
+        tuple: The ID of the parent task, and the ``BatchChild`` of each child task.
+
+    Raises:
+        ValueError: If the months are invalid.
+        RateLimited: If the job queue is full.
+    """
+    periods = batch_months(request.months, request.start, request.end)
+    cpes = list(dict.fromkeys(request.cpes or [str(parse_config(config_path)['eredes']['cpe'])]))
+
+    if len(periods) * len(cpes) > max_batch_tasks:
+        raise ValueError(f"Too many child tasks ({len(periods) * len(cpes)}), the maximum is {max_batch_tasks}")
+
+    limiter.check_queue(ddb.count_queued_jobs())
+
     task_id = uuid4()
+    children = [BatchChild(task_id=uuid4(), cpe=cpe, month=month, year=year) for cpe in cpes for year, month in periods]
+    now = datetime.now()
+
+    writer.insert_workflow_request(WorkflowRequestRecord(task_id=task_id, workflow="batch", db=request.db or [],
+                                                         month=None, year=None, delta=request.delta,
+                                                         download=request.download))
+    writer.insert_taskstatus(TaskstatusRecord(task_id=task_id, status="queued", file=None, created=now, updated=None))
+
+    for position, child in enumerate(children):
+        writer.insert_workflow_request(WorkflowRequestRecord(task_id=child.task_id, workflow="select",
+                                                             db=request.db or [], month=child.month, year=child.year,
+                                                             delta=request.delta, download=request.download))
+        writer.insert_taskstatus(TaskstatusRecord(task_id=child.task_id, status="queued", file=None, created=now,
+                                                  updated=None))
+        writer.insert_batch_task(BatchTaskRecord(batch_id=task_id, task_id=child.task_id, cpe=child.cpe,
+                                                 position=position))
+
+    # the job is queued last: a worker leasing it finds every child task
+    writer.insert_job(JobRecord(task_id=task_id, no_cache=request.no_cache)).result()
+    workers.notify()
+
+    return task_id, children
+
+
+@app.post("/run_batch", summary="Load many months and CPEs in one request", response_model=BatchResponse,
+          responses={429: {"description": "The job queue is full: retry after `Retry-After` seconds"}})
+def run_batch(request: RunBatchRequest, ddb=Depends(get_db), writer=Depends(get_writer),
+              workers=Depends(get_workers), limiter=Depends(get_limiter)):
+    if not config_path.exists():
+        raise HTTPException(status_code=404, detail="Config file not found. Please load it first.")
 
-    wf = WorkflowRequestRecord(task_id=task_id,
-                               workflow=request.workflow,
-                               db=request.db or [],
-                               month=request.month,
-                               year=request.year,
-                               delta=request.delta,
-                               download=request.download)
+    try:
+        task_id, children = enqueue_batch(request, ddb, writer, workers, limiter)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except RateLimited as e:
+        raise too_many_requests(e)
 
-    ddb.insert_workflow_request(wf)
+    return BatchResponse(task_id=task_id, status="queued", detail=f"Batch of {len(children)} tasks queued successfully",
+                         children=children)
 
-    ts = TaskstatusRecord(task_id=task_id,
-                          status="queued",
-                          file=None,
-                          created=datetime.now(),
-                          updated=None)
 
-    ddb.insert_taskstatus(ts)
+@app.get("/batch/{task_id}", summary="Get the aggregate progress of a batch", response_model=BatchStatusResponse)
+def get_batch(task_id: str, ddb=Depends(get_db)):
+    record = ddb.get_taskstatus(task_id).fetchone()
+    children = ddb.get_batch_children(task_id) if record is not None else []
+
+    if not children:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    progress = {"queued": 0, "running": 0, "completed": 0, "failed": 0}
+    for child in children:
+        state = "failed" if child.status.startswith("failed") else child.status.split(" ")[0]
+        progress[state] = progress.get(state, 0) + 1
+
+    return BatchStatusResponse(task_id=record[0], status=record[1], total=len(children), progress=progress,
+                               children=children)
 
+
+@app.post("/jobs/lease", summary="Lease a queued task to a remote worker", response_model=JobLease,
+          responses={204: {"description": "No task is queued, or no scrape is admitted before `Retry-After` "
+                                          "seconds"}})
+def lease_job(request: JobLeaseRequest, ddb=Depends(get_db), workers=Depends(get_workers)):
     try:
-        background_tasks.add_task(
-            run_workflow_task,
-            task_id=task_id,
-            config_path=config_path.resolve(),
-            name=request.workflow,
-            db=request.db or [],
-            month=request.month,
-            year=request.year,
-            delta=request.delta,
-            keep=True if request.download else False,
-            ddb=ddb
-        )
+        job = workers.lease(ddb, request.worker)
+    except RateLimited as e:
+        return Response(status_code=204, headers={"Retry-After": e.retry_after_header})
 
-        return response_model(**{"task_id": task_id, "status": ts.status, "detail": "Workflow queued successfully"})
+    if job is None:
+        return Response(status_code=204)
 
+    return JobLease(job=job, lease_seconds=workers.lease_seconds)
 
-    except Exception as e:
-        ts.status = f"failed: {str(e)}"
-        ts.created = None
-        ts.updated = datetime.now()
 
-        ddb.update_taskstatus(ts)
+@app.post("/jobs/{task_id}/heartbeat", summary="Renew the lease of a task",
+          responses={409: {"description": "The worker no longer holds the lease"}})
+def heartbeat_job(task_id: UUID, request: JobLeaseRequest, ddb=Depends(get_db), workers=Depends(get_workers)):
+    if not workers.heartbeat(ddb, task_id, request.worker):
+        raise HTTPException(status_code=409, detail="The lease expired")
 
-        raise HTTPException(status_code=500, detail=str(e))
+    return {"task_id": task_id, "lease_seconds": workers.lease_seconds}
+
+
+@app.post("/jobs/{task_id}/complete", summary="Report the result of a leased task",
+          responses={409: {"description": "The worker no longer holds the lease"}})
+def complete_job(task_id: UUID, worker: str = Form(...), status: str = Form(...),
+                 failure: Optional[str] = Form(None, description="`captcha` or `login` if the task failed to log in"),
+                 stats: Optional[str] = Form(None, description="The measurements of the workflow, as JSON"),
+                 file: Optional[UploadFile] = File(None),
+                 files: list[UploadFile] = File([], description="The files of the child tasks of a batch, named "
+                                                                "after their task ID"),
+                 ddb=Depends(get_db), workers=Depends(get_workers)):
+    try:
+        stats = json.loads(stats) if stats else None
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid stats")
+
+    children = (stats or {}).get("children") or {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        file_path = None
+
+        if file is not None:
+            file_path = Path(tmp) / "upload"
+            with open(file_path, "wb") as f:
+                shutil.copyfileobj(file.file, f, workers.blobs.chunk_size)
+
+        for child in children.values():
+            # the paths reported by the worker are on its own host
+            child["source_data"] = None
+
+        for i, upload in enumerate(files or []):
+            if upload.filename not in children:
+                raise HTTPException(status_code=422, detail=f"Unknown child task: {upload.filename}")
+
+            children[upload.filename]["source_data"] = Path(tmp) / f"upload-{i}"
+            with open(children[upload.filename]["source_data"], "wb") as f:
+                shutil.copyfileobj(upload.file, f, workers.blobs.chunk_size)
+
+        if not workers.complete(ddb, task_id, worker, status, file_path, failure, stats):
+            raise HTTPException(status_code=409, detail="The lease expired")
+
+    return {"task_id": task_id, "status": status}
+
+
+@app.get("/breaker", summary="Show the circuit breaker of the account of the config file",
+         response_model=BreakerRecord)
+def get_breaker_state(breaker=Depends(get_breaker)):
+    account = config_account(config_path)
+
+    if account is None:
+        raise HTTPException(status_code=404, detail="No config file found. Please load a config file first.")
+
+    return breaker.state(account)
 
 
 @app.get("/status/{task_id}", summary="Get the status of a task", response_model=TaskstatusRecord)
@@ -219,15 +773,141 @@ def get_status(task_id: str, ddb=Depends(get_db)):
 
     ts = TaskstatusRecord(task_id=record[0],
                           status=record[1],
-                          file="File found. Download file with the `download` API method" if record[2] else None,
+                          file="File found. Download file with the `download` API method"
+                          if record[2] or record[5] else None,
                           created=record[3],
-                          updated=record[4])
+                          updated=record[4],
+                          file_hash=record[5],
+                          profile=record[6])
 
     return dict(ts.model_dump())
 
 
+def sse(event: dict) -> str:
+    return f"event: status\ndata: {json.dumps(event)}\n\n"
+
+
+@app.get("/status/{task_id}/stream", summary="Stream the status transitions of a task (Server-Sent Events)")
+async def stream_status(task_id: str, request: Request):
+    events: TaskEvents = request.app.state.events
+    # subscribe before reading the current status, so no transition is missed in between
+    subscription = events.subscribe({task_id})
+
+    ddb = request.app.state.ddb.cursor()
+    try:
+        record = ddb.get_taskstatus(task_id).fetchone()
+    finally:
+        ddb.close()
+
+    if record is None:
+        events.unsubscribe(subscription)
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    current = status_event(TaskstatusRecord(task_id=record[0], status=record[1], file=None, created=record[3],
+                                            updated=record[4]))
+
+    async def stream():
+        try:
+            yield sse(current)
+            if current["finished"]:
+                return
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                yield sse(event)
+                if event["finished"]:
+                    return
+        finally:
+            events.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.websocket("/ws/status")
+async def status_websocket(websocket: WebSocket):
+    """
+    Pushes the status transitions of many tasks over a single WebSocket.
+
+    The client sends ``{"subscribe": [<task_id>, ...]}`` or ``{"unsubscribe": [<task_id>, ...]}`` messages.
+    The current status of each subscribed task is sent right away, then every transition as it happens.
+    """
+    await websocket.accept()
+
+    events: TaskEvents = websocket.app.state.events
+    subscription = events.subscribe(set())
+
+    async def receive():
+        while True:
+            message = await websocket.receive_json()
+
+            if not isinstance(message, dict):
+                continue
+
+            for task_id in message.get("unsubscribe") or []:
+                subscription.task_ids.discard(str(task_id))
+
+            subscribed = [str(task_id) for task_id in message.get("subscribe") or []]
+            subscription.task_ids.update(subscribed)
+
+            ddb = websocket.app.state.ddb.cursor()
+            try:
+                for task_id in subscribed:
+                    record = ddb.get_taskstatus(task_id).fetchone()
+                    if record is None:
+                        await websocket.send_json({"task_id": task_id, "error": "Task not found"})
+                        subscription.task_ids.discard(task_id)
+                        continue
+                    await websocket.send_json(status_event(TaskstatusRecord(task_id=record[0], status=record[1],
+                                                                            file=None, created=record[3],
+                                                                            updated=record[4])))
+            finally:
+                ddb.close()
+
+    receiver = asyncio.create_task(receive())
+
+    try:
+        while not receiver.done():
+            getter = asyncio.ensure_future(subscription.queue.get())
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+
+            if getter in done:
+                await websocket.send_json(getter.result())
+            else:
+                getter.cancel()
+
+        receiver.result()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        events.unsubscribe(subscription)
+
+
+@app.get("/tasks", summary="List the tasks, most recent first", response_model=TaskListResponse)
+def list_tasks(status: Optional[str] = Query(None, description="Only list the tasks whose status starts with this "
+                                                               "value (e.g. `queued`, `running`, `failed`)"),
+               since: Optional[datetime] = Query(None, description="Only list the tasks created at or after this time"),
+               cursor: Optional[str] = Query(None, description="The `next_cursor` returned by the previous page"),
+               limit: int = Query(50, ge=1, le=500, description="The maximum number of tasks to return"),
+               ddb=Depends(get_db)):
+    rows = ddb.list_tasks(status=status, since=since, before=decode_cursor(cursor) if cursor else None,
+                          limit=limit + 1)
+
+    fields = list(TaskSummary.model_fields)
+    tasks = [TaskSummary(**dict(zip(fields, row))) for row in rows[:limit]]
+    next_cursor = encode_cursor(tasks[-1].created, tasks[-1].task_id) if len(rows) > limit else None
+
+    return TaskListResponse(tasks=tasks, next_cursor=next_cursor)
+
+
 @app.get("/download/{task_id}", summary="Get the file extracted from async run")
-def get_file(task_id: str, ddb=Depends(get_db)):
+def get_file(task_id: str, request: Request, ddb=Depends(get_db), blobs=Depends(get_blobs)):
     record = ddb.get_taskstatus(task_id).fetchone()
 
     if record is None:
@@ -237,23 +917,64 @@ def get_file(task_id: str, ddb=Depends(get_db)):
                           status=record[1],
                           file=record[2],
                           created=record[3],
-                          updated=record[4])
+                          updated=record[4],
+                          file_hash=record[5])
     filename = f"{ts.created.strftime('%Y-%m-%d')}_{ts.task_id.hex.split('-')[0]}_readings.xlsx"
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+
+    if ts.file_hash is None:
+        if ts.file is None:
+            raise HTTPException(status_code=404, detail="No file found for this task")
+
+        # files stored by older versions
+        return StreamingResponse(io.BytesIO(ts.file), media_type="application/octet-stream", headers=headers)
+
+    if not blobs.exists(ts.file_hash):
+        raise HTTPException(status_code=404, detail="The file of this task is no longer available")
 
-    return StreamingResponse(io.BytesIO(ts.file), media_type="application/octet-stream",
-                             headers={"Content-Disposition": f"attachment; filename={filename}"})
+    path = blobs.path(ts.file_hash)
+    size = path.stat().st_size
+    headers.update({"ETag": f'"{ts.file_hash}"', "Accept-Ranges": "bytes"})
+
+    if request.headers.get("if-none-match") in (headers["ETag"], "*"):
+        return Response(status_code=304, headers={"ETag": headers["ETag"]})
+
+    try:
+        span = byte_range(request.headers.get("range", ""), size)
+    except ValueError:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+
+    if span is None or request.headers.get("if-range", headers["ETag"]) != headers["ETag"]:
+        return FileResponse(path, media_type="application/octet-stream", headers=headers)
+
+    first, last = span
+
+    def read_range():
+        with open(path, "rb") as f:
+            f.seek(first)
+            remaining = last - first + 1
+            while remaining > 0:
+                chunk = f.read(min(remaining, blobs.chunk_size))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    headers.update({"Content-Range": f"bytes {first}-{last}/{size}", "Content-Length": str(last - first + 1)})
+
+    return StreamingResponse(read_range(), status_code=206, media_type="application/octet-stream", headers=headers)
 
 
 @app.post("/config/load", summary="Loads a YAML string as a config file into the program")
-def load_config(request: ConfigLoadRequest):
+def load_config(request: ConfigLoadRequest, http_request: Request):
     try:
 
         tmp_config = yaml.safe_load(request.config)
 
         assert Config(**tmp_config), "Config file schema is not valid"
 
-        with open(config_path, "w") as f:
-            yaml.dump(tmp_config, f)
+        save_config(tmp_config, config_path)
+        reload_settings(http_request.app)
 
         return {"detail": "Config file loaded successfully"}
 
@@ -262,12 +983,8 @@ def load_config(request: ConfigLoadRequest):
 
 
 @app.post("/config/remote", summary="Loads a remote config file from a URL into the program")
-async def load_config_from_url(url: str):
+async def load_config_from_url(url: str, request: Request):
     try:
-        Path.mkdir(Path(appdir) / "cache", parents=True, exist_ok=True)
-
-        cache = Path(appdir) / "cache"
-
         response = requests.get(url)
 
         if response.status_code == 200:
@@ -279,8 +996,8 @@ async def load_config_from_url(url: str):
             except Exception as e:
                 raise HTTPException(status_code=400, detail=str(e))
 
-            with open(cache / "config.yml", "w") as f:
-                yaml.dump(tmp_config, f)
+            save_config(tmp_config, config_path)
+            reload_settings(request.app)
 
             return {"detail": "Config file loaded successfully from URL"}
         else:
@@ -292,17 +1009,13 @@ async def load_config_from_url(url: str):
 
 
 @app.post("/config/upload", summary="Uploads a config file into the program")
-async def upload_config(file: UploadFile = File(...)):
+async def upload_config(request: Request, file: UploadFile = File(...)):
     try:
-        Path.mkdir(Path(appdir) / "cache", parents=True, exist_ok=True)
-
-        cache = Path(appdir) / "cache"
-
         contents = await file.read()
         tmp_config = yaml.safe_load(contents)
 
-        with open(cache / "config.yml", "w") as f:
-            yaml.dump(tmp_config, f)
+        save_config(tmp_config, config_path)
+        reload_settings(request.app)
 
         return {"detail": "Config file uploaded successfully"}
 
@@ -320,7 +1033,7 @@ def show_config():
 
 
 @app.post("/config/set", summary="Set a configuration value")
-def set_config(request: ConfigSetRequest):
+def set_config(request: ConfigSetRequest, http_request: Request):
     value = infer_type(request.value)
 
     try:
@@ -333,8 +1046,8 @@ def set_config(request: ConfigSetRequest):
 
     config[request.key] = value
 
-    with open(config_path, "w") as f:
-        yaml.dump(struct_config(config), f)
+    save_config(struct_config(config), config_path)
+    reload_settings(http_request.app)
 
     return {"detail": f"Key {request.key} set to {value}"}
 
@@ -1,11 +1,26 @@
+import os
+import queue
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from importlib.resources import files
 from pathlib import Path
 
 import duckdb
 
-from eredesscraper.models import TaskstatusRecord, WorkflowRequestRecord
+from eredesscraper.meta import checkpoints_path, db_path
+from eredesscraper.models import TaskstatusRecord, WorkflowRequestRecord, JobRecord, BreakerRecord, BatchChild, \
+    BatchChildStatus, BatchTaskRecord, CheckpointRecord
 
-db_path = Path.home() / ".ers" / "ers.db"
+# statuses of the tasks that are not finished yet
+active_statuses = ("queued", "running")
+
+# database files whose schema was already initialized by this process
+_initialized = set()
+_initialized_lock = threading.Lock()
 
 
 class DuckDB:
@@ -22,6 +37,9 @@ class DuckDB:
     Methods:
         __init__: Initializes a DuckDB object.
         __del__: Closes the connection when the object is destroyed.
+        init_schema: Runs the initialization script, once per database file and process.
+        cursor: Returns a DuckDB object holding a new cursor over the same connection.
+        close: Closes the connection.
         query: Executes the given SQL query on the database connection.
         insert: Inserts a new row into the specified table with the given data.
         update: Updates records in the specified table based on the given set and where clauses.
@@ -29,32 +47,41 @@ class DuckDB:
         insert_taskstatus: Inserts a task status record into the 'taskstatus' table.
         update_taskstatus: Updates the task status record in the database.
         get_taskstatus: Retrieves the task status from the database based on the given task ID.
+        list_tasks: Lists the tasks, most recent first, with keyset pagination.
+        insert_job: Queues a job for the worker pool.
+        claim_job: Leases the oldest queued job to a worker.
+        heartbeat_job: Renews the lease of a job.
+        finish_job: Removes a finished job from the queue.
+        requeue_expired_jobs: Requeues the jobs whose lease expired.
+        find_queued_task: Finds the queued (or leased) task of a request key.
+        insert_batch_task: Adds a child task to a batch.
+        get_batch_children: Retrieves the child tasks of a batch.
+        count_queued_jobs: Counts the jobs waiting for a worker.
+        get_breaker: Retrieves the circuit breaker of an account.
+        put_breaker: Stores the circuit breaker of an account.
+        compact: Deletes the expired tasks and files, according to a retention policy.
+        rewrite: Rewrites the database file to give the space of deleted rows back to the file system.
         destroy: Closes the connection and deletes the database file.
     """
 
-    def __init__(self, db_path: str = db_path.absolute().as_posix()):
+    def __init__(self, db_path: str = db_path.absolute().as_posix(), conn: duckdb.DuckDBPyConnection = None):
         """
         Initializes a DuckDB object.
 
         Args:
             db_path (str): The path to the DuckDB database file.
+            conn (duckdb.DuckDBPyConnection, optional): An open connection (or cursor) to the database file.
+                Defaults to None, which opens a new connection.
 
         Returns:
             None
         """
         self.db_path = db_path
-        self.conn = duckdb.connect(db_path)
-
-        self.init_script = files("eredesscraper").joinpath("ddb_init.sql").read_text()
-
-        self.conn.execute(self.init_script)
-
-        wf = self.conn.execute(
-            "SELECT * FROM information_schema.tables WHERE table_name = 'workflowrequests'").fetchone()
-        ts = self.conn.execute("SELECT * FROM information_schema.tables WHERE table_name = 'taskstatus'").fetchone()
+        if conn is None and db_path != ":memory:":
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = conn if conn is not None else duckdb.connect(db_path)
 
-        assert wf is not None, "Database initialization failed"
-        assert ts is not None, "Database initialization failed"
+        self.init_schema()
 
     def __del__(self):
         """
@@ -63,7 +90,59 @@ class DuckDB:
         This method is automatically called when the object is garbage collected.
         It ensures that the connection to the database is properly closed.
         """
-        self.conn.close()
+        self.close()
+
+    def init_schema(self):
+        """
+        Runs the initialization script and checks the tables were created.
+
+        The script only runs for the first connection of the process to each database file, so opening
+        cursors or new connections afterwards does not pay for the DDL again.
+
+        Returns:
+            None
+        """
+        with _initialized_lock:
+            if self.db_path in _initialized:
+                return
+
+            init_script = files("eredesscraper").joinpath("ddb_init.sql").read_text()
+
+            self.conn.execute(init_script)
+
+            wf = self.conn.execute(
+                "SELECT * FROM information_schema.tables WHERE table_name = 'workflowrequests'").fetchone()
+            ts = self.conn.execute(
+                "SELECT * FROM information_schema.tables WHERE table_name = 'taskstatus'").fetchone()
+
+            assert wf is not None, "Database initialization failed"
+            assert ts is not None, "Database initialization failed"
+
+            if self.db_path != ":memory:":
+                _initialized.add(self.db_path)
+
+    def cursor(self):
+        """
+        Returns a DuckDB object holding a new cursor over this connection.
+
+        Cursors share the database instance of the connection, so they are cheap to create. Use one cursor per
+        request or thread: a single cursor must not be used by several threads at once.
+
+        Returns:
+            DuckDB: The DuckDB object holding the cursor.
+        """
+        return DuckDB(self.db_path, conn=self.conn.cursor())
+
+    def close(self):
+        """
+        Closes the connection (or cursor).
+
+        Returns:
+            None
+        """
+        conn, self.conn = getattr(self, "conn", None), None
+        if conn is not None:
+            conn.close()
 
     def query(self, query: str, values: list = None):
         """
@@ -124,7 +203,8 @@ class DuckDB:
             bool: True if the record was successfully inserted, False otherwise.
         """
 
-        record = {k: v for k, v in record.model_dump().items() if v is not None}
+        # the options of the request are stored with its job, and the children of a batch in `batchtasks`
+        record = {k: v for k, v in record.model_dump(exclude={"no_cache", "start", "end", "profile", "children"}).items() if v is not None}
 
         self.insert("workflowrequests", record)
         return True
@@ -177,9 +257,366 @@ class DuckDB:
         Returns:
             result: The task status retrieved from the database.
         """
-        result = self.query(f"SELECT * FROM taskstatus WHERE task_id = ?", [task_id])
+        result = self.query("SELECT task_id, status, file, created, updated, file_hash, profile FROM taskstatus "
+                            "WHERE task_id = ?", [task_id])
         return result
 
+    def list_tasks(self, status: str = None, since: datetime = None, before: tuple = None, limit: int = 50) -> list:
+        """
+        Lists the tasks, most recent first, with keyset pagination. File contents are never read.
+
+        Args:
+            status (str, optional): Only list the tasks whose status starts with this value (e.g. ``failed``).
+            since (datetime, optional): Only list the tasks created at or after this time.
+            before (tuple, optional): The (created, task_id) key of the last task of the previous page.
+            limit (int, optional): The maximum number of tasks. Defaults to 50.
+
+        Returns:
+            list: The rows (task_id, workflow, db, month, year, status, file_hash, created, updated).
+        """
+        where, values = [], []
+
+        if status:
+            where.append("starts_with(t.status, ?)")
+            values.append(status)
+        if since:
+            where.append("w.created >= ?")
+            values.append(since)
+        if before:
+            where.append("(w.created < ? OR (w.created = ? AND w.task_id < ?))")
+            values.extend([before[0], before[0], before[1]])
+
+        sql = ("SELECT w.task_id, w.workflow, w.db, w.month, w.year, t.status, t.file_hash, w.created, t.updated "
+               "FROM workflowrequests w JOIN taskstatus t ON t.task_id = w.task_id "
+               f"{'WHERE ' + ' AND '.join(where) if where else ''} "
+               "ORDER BY w.created DESC, w.task_id DESC LIMIT ?")
+
+        return self.query(sql, values + [limit]).fetchall()
+
+    def insert_job(self, record: JobRecord):
+        """
+        Queues a job for the worker pool.
+
+        Args:
+            record (JobRecord): The job to queue.
+
+        Returns:
+            bool: True if the job was successfully queued.
+        """
+        record = {k: v for k, v in record.model_dump().items() if v is not None}
+
+        self.insert("jobs", record)
+        return True
+
+    def claim_job(self, worker: str, lease_seconds: float) -> WorkflowRequestRecord | None:
+        """
+        Leases the oldest queued job to a worker.
+
+        The job is claimed by a single conditional update, so two workers cannot lease the same job. The worker
+        must renew the lease with ``heartbeat_job`` before it expires, or the job is requeued.
+
+        Args:
+            worker (str): The name of the worker.
+            lease_seconds (float): The duration of the lease, in seconds.
+
+        Returns:
+            WorkflowRequestRecord | None: The request of the leased task, or None if no job is queued.
+        """
+        leased = self.query("UPDATE jobs SET state = 'leased', worker = ?, lease_expires = ?, "
+                            "attempts = attempts + 1 "
+                            "WHERE state = 'queued' AND task_id = (SELECT task_id FROM jobs WHERE state = 'queued' "
+                            "ORDER BY created, task_id LIMIT 1) RETURNING task_id",
+                            [worker, datetime.now() + timedelta(seconds=lease_seconds)]).fetchone()
+
+        if leased is None:
+            return None
+
+        row = self.query("SELECT w.task_id, w.workflow, w.db, w.month, w.year, w.delta, w.download, j.no_cache, "
+                         "j.range_start, j.range_end, j.profile FROM workflowrequests w "
+                         "JOIN jobs j ON j.task_id = w.task_id "
+                         "WHERE w.task_id = ?",
+                         [leased[0]]).fetchone()
+
+        job = WorkflowRequestRecord(**dict(zip(WorkflowRequestRecord.model_fields, row)))
+
+        if job.workflow == "batch":
+            job.children = [BatchChild(**child.model_dump(exclude={"status", "file_hash"}))
+                            for child in self.get_batch_children(job.task_id)]
+
+        return job
+
+    def heartbeat_job(self, task_id: str, worker: str, lease_seconds: float) -> bool:
+        """
+        Renews the lease of a job.
+
+        Args:
+            task_id (str): The ID of the task run by the job.
+            worker (str): The name of the worker holding the lease.
+            lease_seconds (float): The new duration of the lease, in seconds.
+
+        Returns:
+            bool: True if the lease was renewed, False if the worker no longer holds it.
+        """
+        return self.query("UPDATE jobs SET lease_expires = ? WHERE task_id = ? AND worker = ? AND state = 'leased' "
+                          "RETURNING task_id",
+                          [datetime.now() + timedelta(seconds=lease_seconds), str(task_id), worker]
+                          ).fetchone() is not None
+
+    def finish_job(self, task_id: str, worker: str) -> bool:
+        """
+        Removes a finished job from the queue.
+
+        Args:
+            task_id (str): The ID of the task run by the job.
+            worker (str): The name of the worker holding the lease.
+
+        Returns:
+            bool: True if the job was removed, False if the worker no longer holds its lease (the result of the
+            worker must then be discarded).
+        """
+        return self.query("DELETE FROM jobs WHERE task_id = ? AND worker = ? AND state = 'leased' RETURNING task_id",
+                          [str(task_id), worker]).fetchone() is not None
+
+    def requeue_expired_jobs(self, max_attempts: int) -> tuple:
+        """
+        Requeues the jobs whose lease expired, e.g. because their worker crashed or the server restarted.
+
+        Jobs that were already leased ``max_attempts`` times are removed from the queue instead.
+
+        Args:
+            max_attempts (int): The maximum number of times a job is leased.
+
+        Returns:
+            tuple: The IDs of the requeued tasks and of the abandoned tasks.
+        """
+        now = datetime.now()
+
+        requeued = self.query("UPDATE jobs SET state = 'queued', worker = NULL, lease_expires = NULL "
+                              "WHERE state = 'leased' AND lease_expires < ? AND attempts < ? RETURNING task_id",
+                              [now, max_attempts]).fetchall()
+        abandoned = self.query("DELETE FROM jobs WHERE state = 'leased' AND lease_expires < ? RETURNING task_id",
+                               [now]).fetchall()
+
+        return [row[0] for row in requeued], [row[0] for row in abandoned]
+
+    def find_queued_task(self, flight_key: str) -> str | None:
+        """
+        Finds the task queued for a request key, that is not finished yet.
+
+        Args:
+            flight_key (str): The key of the request (see ``singleflight.flight_key``).
+
+        Returns:
+            str | None: The ID of the task, or None.
+        """
+        row = self.query("SELECT task_id FROM jobs WHERE flight_key = ? ORDER BY created LIMIT 1",
+                         [flight_key]).fetchone()
+
+        return str(row[0]) if row else None
+
+    def insert_batch_task(self, record: BatchTaskRecord):
+        """
+        Adds a child task to a batch.
+
+        Args:
+            record (BatchTaskRecord): The child task.
+
+        Returns:
+            bool: True if the operation is successful.
+        """
+        self.insert("batchtasks", record.model_dump())
+        return True
+
+    def get_batch_children(self, batch_id: str) -> list:
+        """
+        Retrieves the child tasks of a batch, in the order of the batch.
+
+        Args:
+            batch_id (str): The ID of the parent task of the batch.
+
+        Returns:
+            list: The ``BatchChildStatus`` of each child task. Empty if the task is not a batch.
+        """
+        rows = self.query("SELECT b.task_id, b.cpe, w.month, w.year, t.status, t.file_hash FROM batchtasks b "
+                          "JOIN workflowrequests w ON w.task_id = b.task_id "
+                          "JOIN taskstatus t ON t.task_id = b.task_id "
+                          "WHERE b.batch_id = ? ORDER BY b.position", [str(batch_id)]).fetchall()
+
+        return [BatchChildStatus(**dict(zip(BatchChildStatus.model_fields, row))) for row in rows]
+
+    def count_queued_jobs(self) -> int:
+        """
+        Counts the jobs waiting for a worker.
+
+        Returns:
+            int: The number of queued jobs.
+        """
+        return self.query("SELECT count(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
+
+    def get_breaker(self, account: str) -> BreakerRecord | None:
+        """
+        Retrieves the circuit breaker of an account.
+
+        Args:
+            account (str): The account (NIF).
+
+        Returns:
+            BreakerRecord | None: The breaker, or None if the account never failed.
+        """
+        row = self.query(f"SELECT {', '.join(BreakerRecord.model_fields)} FROM breakers WHERE account = ?",
+                         [account]).fetchone()
+
+        return BreakerRecord(**dict(zip(BreakerRecord.model_fields, row))) if row else None
+
+    def put_breaker(self, record: BreakerRecord):
+        """
+        Stores the circuit breaker of an account, replacing its previous state.
+
+        Args:
+            record (BreakerRecord): The breaker.
+
+        Returns:
+            bool: True if the operation is successful.
+        """
+        self.query("DELETE FROM breakers WHERE account = ?", [record.account])
+        self.insert("breakers", record.model_dump())
+        return True
+
+    def compact(self, max_age_days: int = None, max_tasks: int = None, max_file_bytes: int = None, blobs=None,
+                batch_size: int = 500, grace: float = 3600) -> dict:
+        """
+        Applies a retention policy. Tasks that are still queued or running are never deleted.
+
+        - Finished tasks created more than ``max_age_days`` ago are deleted.
+        - Only the ``max_tasks`` most recent tasks are kept.
+        - The files of the most recent tasks are kept up to ``max_file_bytes``; older tasks keep their status row
+          but lose their file.
+
+        Rows are deleted in batches of ``batch_size``, files no longer referenced by any task are deleted from the
+        file store, and the database is checkpointed.
+
+        Args:
+            max_age_days (int, optional): The maximum age of a task, in days.
+            max_tasks (int, optional): The maximum number of tasks to keep.
+            max_file_bytes (int, optional): The size budget of the stored files, in bytes.
+            blobs (BlobStore, optional): The file store holding the task files.
+            batch_size (int, optional): The number of rows deleted or updated per statement. Defaults to 500.
+            grace (float, optional): Unreferenced stored files younger than this, in seconds, are kept as they may
+                belong to a task that is finishing. Defaults to 3600.
+
+        Returns:
+            dict: The number of ``tasks`` deleted, and of ``files`` and ``bytes`` freed.
+        """
+        stats = {"tasks": 0, "files": 0, "bytes": 0}
+        finished = f"coalesce(t.status, '') NOT IN ({', '.join('?' for _ in active_statuses)})"
+        tasks = "FROM workflowrequests w LEFT JOIN taskstatus t ON t.task_id = w.task_id"
+
+        expired = set()
+
+        if max_age_days is not None:
+            expired.update(row[0] for row in self.query(
+                f"SELECT w.task_id {tasks} WHERE {finished} AND w.created < ?",
+                [*active_statuses, datetime.now() - timedelta(days=max_age_days)]).fetchall())
+
+        if max_tasks is not None:
+            expired.update(row[0] for row in self.query(
+                f"SELECT task_id FROM (SELECT w.task_id, {finished} AS finished, "
+                f"row_number() OVER (ORDER BY w.created DESC, w.task_id DESC) AS n {tasks}) "
+                f"WHERE finished AND n > ?",
+                [*active_statuses, max_tasks]).fetchall())
+
+        expired = list(expired)
+
+        for i in range(0, len(expired), batch_size):
+            ids = expired[i:i + batch_size]
+            placeholders = ", ".join("?" for _ in ids)
+            # the status rows reference the requests: they must be deleted (and committed) first
+            self.query(f"DELETE FROM batchtasks WHERE task_id IN ({placeholders}) OR batch_id IN ({placeholders})",
+                       ids + ids)
+            self.query(f"DELETE FROM taskstatus WHERE task_id IN ({placeholders})", ids)
+            self.query(f"DELETE FROM workflowrequests WHERE task_id IN ({placeholders})", ids)
+            stats["tasks"] += len(ids)
+
+        if max_file_bytes is not None:
+            rows = self.query(f"SELECT t.task_id, t.file_hash, octet_length(t.file) {tasks} "
+                              f"WHERE t.file_hash IS NOT NULL OR t.file IS NOT NULL "
+                              f"ORDER BY w.created DESC, w.task_id DESC").fetchall()
+
+            total, kept, dropped = 0, set(), []
+            for task_id, file_hash, blob_size in rows:
+                if file_hash is not None and file_hash not in kept:
+                    size = blobs.size(file_hash) if blobs is not None and blobs.exists(file_hash) else 0
+                else:
+                    size = 0
+                size += blob_size or 0
+
+                if total + size <= max_file_bytes:
+                    total += size
+                    kept.add(file_hash)
+                else:
+                    dropped.append(task_id)
+                    stats["bytes"] += blob_size or 0
+
+            for i in range(0, len(dropped), batch_size):
+                ids = dropped[i:i + batch_size]
+                self.query(f"UPDATE taskstatus SET file = NULL, file_hash = NULL "
+                           f"WHERE task_id IN ({', '.join('?' for _ in ids)})", ids)
+
+        if blobs is not None:
+            referenced = {row[0] for row in self.query(
+                "SELECT DISTINCT file_hash FROM taskstatus WHERE file_hash IS NOT NULL").fetchall()}
+
+            for digest, path in blobs:
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                if digest not in referenced and time.time() - stat.st_mtime > grace and blobs.delete(digest):
+                    stats["files"] += 1
+                    stats["bytes"] += stat.st_size
+
+        self.query("CHECKPOINT")
+
+        return stats
+
+    def rewrite(self):
+        """
+        Rewrites the database into a new file, which is then moved over the current one.
+
+        DuckDB reuses the space of deleted rows but does not shrink the database file, so after a large
+        compaction the file is rewritten to give the space back to the file system. This requires the only
+        connection to the database: it must not run while the API server is using it.
+
+        Returns:
+            bool: True if the operation is successful.
+        """
+        target = Path(self.db_path)
+        tmp = target.with_name(f".{target.name}.compact")
+        tmp.unlink(missing_ok=True)
+
+        source = self.query("SELECT current_database()").fetchone()[0]
+        next_id = self.query("SELECT coalesce(max(id), 0) + 1 FROM workflowrequests").fetchone()[0]
+
+        self.query(f"ATTACH '{tmp.as_posix()}' AS ers_compact")
+        try:
+            self.query("USE ers_compact")
+            self.query(f"CREATE SEQUENCE id_seq START WITH {next_id}")
+            self.query(files("eredesscraper").joinpath("ddb_init.sql").read_text())
+            self.query(f"INSERT INTO ers_compact.workflowrequests BY NAME SELECT * FROM {source}.workflowrequests")
+            self.query(f"INSERT INTO ers_compact.taskstatus BY NAME SELECT * FROM {source}.taskstatus")
+            self.query(f"INSERT INTO ers_compact.jobs BY NAME SELECT * FROM {source}.jobs")
+            self.query(f"INSERT INTO ers_compact.breakers BY NAME SELECT * FROM {source}.breakers")
+            self.query(f"INSERT INTO ers_compact.batchtasks BY NAME SELECT * FROM {source}.batchtasks")
+        finally:
+            self.query(f"USE {source}")
+            self.query("DETACH ers_compact")
+
+        self.close()
+        os.replace(tmp, target)
+        self.conn = duckdb.connect(self.db_path)
+
+        return True
+
     def destroy(self):
         """
         Closes the connection and deletes the database file.
@@ -187,6 +624,330 @@ class DuckDB:
         Returns:
             bool: True if the operation is successful, False otherwise.
         """
-        self.conn.close()
-        db_path.unlink(missing_ok=True)
+        self.close()
+        with _initialized_lock:
+            _initialized.discard(self.db_path)
+        Path(self.db_path).unlink(missing_ok=True)
+        return True
+
+
+class DuckDBWriter:
+    """
+    Serializes the writes to the state database through a single writer thread.
+
+    DuckDB allows a single writer per database file, so instead of several threads writing through their own
+    cursor and contending for it, the write operations are put on an in-memory queue. The writer thread takes
+    them in submission order and commits them in short transactions of up to ``max_batch`` operations, waiting
+    at most ``max_delay`` seconds for a batch to fill up. Each operation returns a ``Future`` resolving to the
+    result of the corresponding ``DuckDB`` method.
+
+    Args:
+        ddb (DuckDB): The connection the writer opens its cursor from.
+        max_batch (int): The maximum number of operations committed in one transaction.
+        max_delay (float): The maximum time, in seconds, an operation waits for its batch to fill up.
+        on_write (Callable, optional): Called from the writer thread with the operation name and the record of
+            every committed operation (e.g. to notify the clients following a task).
+
+    Methods:
+        start: Starts the writer thread.
+        stop: Commits the queued operations and stops the writer thread.
+        submit: Queues a write operation.
+        insert_workflow_request: Queues the insertion of a workflow request record.
+        insert_taskstatus: Queues the insertion of a task status record.
+        update_taskstatus: Queues the update of a task status record.
+        insert_job: Queues the insertion of a job.
+        put_breaker: Queues the update of the circuit breaker of an account.
+        insert_batch_task: Queues the insertion of a child task of a batch.
+    """
+    _stop = object()
+
+    # DuckDB methods that can be queued
+    operations = ("insert_workflow_request", "insert_taskstatus", "update_taskstatus", "insert_job", "put_breaker",
+                  "insert_batch_task")
+
+    def __init__(self, ddb: DuckDB, max_batch: int = 64, max_delay: float = 0.005, on_write: Callable = None):
+        self.ddb = ddb
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.on_write = on_write
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts the writer thread.
+
+        Returns:
+            DuckDBWriter: The writer itself.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, args=(self.ddb.cursor(),), name="ers-ddb-writer",
+                                            daemon=True)
+            self._thread.start()
+
+        return self
+
+    def stop(self, timeout: float = None):
+        """
+        Commits the operations already queued and stops the writer thread.
+
+        Args:
+            timeout (float, optional): The maximum time to wait for the thread, in seconds.
+
+        Returns:
+            None
+        """
+        if self._thread is not None:
+            self._queue.put(self._stop)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, operation: str, record) -> Future:
+        """
+        Queues a write operation.
+
+        Args:
+            operation (str): The name of the ``DuckDB`` method to call (one of ``DuckDBWriter.operations``).
+            record: The record passed to the method.
+
+        Returns:
+            Future: Resolves to the result of the operation, or to its exception.
+        """
+        if operation not in self.operations:
+            raise ValueError(f"Unsupported operation: {operation}")
+        if self._thread is None:
+            raise RuntimeError("The writer is not running")
+
+        future = Future()
+        # the record may be changed by the caller while queued
+        self._queue.put((operation, record.model_copy(), future))
+
+        return future
+
+    def insert_workflow_request(self, record: WorkflowRequestRecord) -> Future:
+        return self.submit("insert_workflow_request", record)
+
+    def insert_taskstatus(self, record: TaskstatusRecord) -> Future:
+        return self.submit("insert_taskstatus", record)
+
+    def update_taskstatus(self, record: TaskstatusRecord) -> Future:
+        return self.submit("update_taskstatus", record)
+
+    def insert_job(self, record: JobRecord) -> Future:
+        return self.submit("insert_job", record)
+
+    def put_breaker(self, record: BreakerRecord) -> Future:
+        return self.submit("put_breaker", record)
+
+    def insert_batch_task(self, record: BatchTaskRecord) -> Future:
+        return self.submit("insert_batch_task", record)
+
+    def _run(self, cursor: DuckDB):
+        stopping = False
+
+        while not stopping:
+            item = self._queue.get()
+            if item is self._stop:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is self._stop:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._commit(cursor, batch)
+
+        cursor.close()
+
+    def _commit(self, cursor: DuckDB, batch: list):
+        try:
+            cursor.conn.begin()
+            results = [getattr(cursor, operation)(record) for operation, record, _ in batch]
+            cursor.conn.commit()
+        except Exception:
+            cursor.conn.rollback()
+        else:
+            for (operation, record, future), result in zip(batch, results):
+                future.set_result(result)
+                self._notify(operation, record)
+            return
+
+        # a failing operation must not fail the rest of its batch: replay them one by one
+        for operation, record, future in batch:
+            try:
+                future.set_result(getattr(cursor, operation)(record))
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                self._notify(operation, record)
+
+    def _notify(self, operation: str, record):
+        if self.on_write is None:
+            return
+        try:
+            self.on_write(operation, record)
+        except Exception:
+            pass
+
+
+class CheckpointStore:
+    """
+    The checkpoints of the ``backfill`` workflow: the months of each CPE already loaded into a set of databases,
+    and the months that failed. It also keeps the watermarks of the ``sync`` workflow: the latest reading of each CPE
+    loaded into a set of databases.
+
+    The checkpoints are kept in their own DuckDB file rather than in the state database, since the workflows also
+    run in the worker processes of the API server, which holds the state database. DuckDB lets a single process
+    open the file, so the file is only opened for each read or write: the workflows running in other processes wait
+    for the lock (retrying with backoff, up to ``lock_timeout`` seconds) instead of failing.
+
+    Args:
+        path (Path): The path to the checkpoints file. Defaults to ``~/.ers/checkpoints.db``.
+        lock_timeout (float): How long to wait for another process to release the file, in seconds. Defaults to 60.
+
+    Methods:
+        get: Retrieves the checkpoints of a CPE.
+        put: Stores the checkpoint of a month.
+        get_watermark: Retrieves the watermark of a CPE.
+        put_watermark: Stores the watermark of a CPE.
+        close: Closes the store.
+    """
+
+    def __init__(self, path: Path = checkpoints_path, lock_timeout: float = 60):
+        self.path = Path(path)
+        self.lock_timeout = lock_timeout
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self._connect() as conn:
+            # no key: DuckDB rejects repeated updates of indexed rows
+            conn.execute("CREATE TABLE IF NOT EXISTS checkpoints (cpe VARCHAR NOT NULL, sinks VARCHAR NOT NULL, "
+                         "year INTEGER NOT NULL, month INTEGER NOT NULL, state VARCHAR, attempts INTEGER, "
+                         "error VARCHAR, updated TIMESTAMP)")
+            conn.execute("CREATE TABLE IF NOT EXISTS watermarks (cpe VARCHAR NOT NULL, sinks VARCHAR NOT NULL, "
+                         "last_reading TIMESTAMP, updated TIMESTAMP)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # the file is only held during each read or write
+        pass
+
+    @contextmanager
+    def _connect(self):
+        deadline = time.monotonic() + self.lock_timeout
+        delay = 0.05
+
+        while True:
+            try:
+                conn = duckdb.connect(self.path.as_posix())
+                break
+            except duckdb.IOException as e:
+                if time.monotonic() + delay > deadline:
+                    raise RuntimeError(f"The backfill checkpoints are in use by another process: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, 1)
+
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def get(self, cpe: str, sinks: str) -> dict:
+        """
+        Retrieves the checkpoints of a CPE.
+
+        Args:
+            cpe (str): The CPE.
+            sinks (str): The databases, sorted and comma-separated (see ``CheckpointRecord``).
+
+        Returns:
+            dict: The ``CheckpointRecord`` of each (year, month) tried.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT {', '.join(CheckpointRecord.model_fields)} FROM checkpoints "
+                                "WHERE cpe = ? AND sinks = ?", [cpe, sinks]).fetchall()
+
+        records = [CheckpointRecord(**dict(zip(CheckpointRecord.model_fields, row))) for row in rows]
+        return {(record.year, record.month): record for record in records}
+
+    def put(self, record: CheckpointRecord):
+        """
+        Stores the checkpoint of a month, replacing the previous one.
+
+        Args:
+            record (CheckpointRecord): The checkpoint.
+
+        Returns:
+            bool: True if the operation is successful.
+        """
+        record = record.model_copy(update={"updated": record.updated or datetime.now()})
+
+        with self._connect() as conn:
+            conn.begin()
+            try:
+                conn.execute("DELETE FROM checkpoints WHERE cpe = ? AND sinks = ? AND year = ? AND month = ?",
+                             [record.cpe, record.sinks, record.year, record.month])
+                conn.execute(f"INSERT INTO checkpoints ({', '.join(CheckpointRecord.model_fields)}) "
+                             f"VALUES ({', '.join('?' for _ in CheckpointRecord.model_fields)})",
+                             list(record.model_dump().values()))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+        return True
+
+    def get_watermark(self, cpe: str, sinks: str) -> datetime | None:
+        """
+        Retrieves the watermark of a CPE: the latest reading loaded into a set of databases by the ``sync`` workflow.
+
+        Args:
+            cpe (str): The CPE.
+            sinks (str): The databases, sorted and comma-separated.
+
+        Returns:
+            datetime | None: The timestamp of the reading (UTC), or None if the CPE was never synced.
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT last_reading FROM watermarks WHERE cpe = ? AND sinks = ?",
+                               [cpe, sinks]).fetchone()
+        return row[0].replace(tzinfo=timezone.utc) if row and row[0] is not None else None
+
+    def put_watermark(self, cpe: str, sinks: str, last_reading: datetime):
+        """
+        Stores the watermark of a CPE, replacing the previous one.
+
+        Args:
+            cpe (str): The CPE.
+            sinks (str): The databases, sorted and comma-separated.
+            last_reading (datetime): The timestamp of the latest reading loaded.
+
+        Returns:
+            bool: True if the operation is successful.
+        """
+        if last_reading.tzinfo is not None:
+            last_reading = last_reading.astimezone(timezone.utc).replace(tzinfo=None)
+
+        with self._connect() as conn:
+            conn.begin()
+            try:
+                conn.execute("DELETE FROM watermarks WHERE cpe = ? AND sinks = ?", [cpe, sinks])
+                conn.execute("INSERT INTO watermarks VALUES (?, ?, ?, ?)", [cpe, sinks, last_reading, datetime.now()])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
         return True
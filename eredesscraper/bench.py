@@ -0,0 +1,282 @@
+import gzip
+import math
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import openpyxl
+from influxdb_client import WritePrecision
+from influxdb_client.client.write.dataframe_serializer import data_frame_to_list_of_points
+from influxdb_client.client.write_api import PointSettings
+
+from eredesscraper._version import get_version
+from eredesscraper.db_clients import InfluxDB
+from eredesscraper.sinks import InfluxDBSink, ReadingsBatch
+
+# names of the months in the exports of E-REDES
+_month_names = ["janeiro", "fevereiro", "março", "abril", "maio", "junho", "julho", "agosto", "setembro", "outubro",
+                "novembro", "dezembro"]
+
+# percentiles of the latencies reported per stage
+PERCENTILES = (50, 90, 99)
+
+
+def generate_export(path: Path, cpe: str, year: int, month: int, seed: int = 0) -> Path:
+    """
+    Writes a synthetic E-REDES readings export: the 8 header rows, then the Date, Time and Value (and state) of each
+    15-minute reading of the month, as in the files downloaded from the E-REDES portal (see ``tests/example.xlsx``).
+
+    Args:
+        path (Path): The XLSX file to write.
+        cpe (str): The CPE of the readings.
+        year (int): The year of the readings.
+        month (int): The month of the readings.
+        seed (int, optional): The seed of the random consumption values. Defaults to 0.
+
+    Returns:
+        Path: The path to the file.
+    """
+    rng = random.Random(f"{seed}|{cpe}|{year}|{month}")
+    start = datetime(year, month, 1)
+    end = datetime(year + month // 12, month % 12 + 1, 1)
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Leituras")
+
+    for row in (["Dados Globais"], [], ["CPE", cpe], ["Funções", "Consumo registado"], [None, "Estado"],
+                ["Mês/Ano", f"{_month_names[month - 1]} {year}"], ["Intervalo:", "15 min"], [],
+                ["Data", "Hora", "Consumo registado (kW)", "Estado"]):
+        ws.append(row)
+
+    # the readings of a month run from 00:15 of its first day up to 00:00 of the next month
+    when = start + timedelta(minutes=15)
+    while when <= end:
+        # a daily load curve with some noise
+        base = 0.25 + 0.2 * (7 <= when.hour < 23) + 0.6 * (19 <= when.hour < 22)
+        ws.append([when.strftime("%Y/%m/%d"), when.strftime("%H:%M"), f"{base + rng.random() * 0.3:.3f}", "Real"])
+        when += timedelta(minutes=15)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    wb.save(path)
+    return path
+
+
+def generate_exports(directory: Path, months: int = 12, cpes: int = 1, end: tuple = (2023, 12),
+                     seed: int = 0) -> list:
+    """
+    Writes the synthetic exports of a number of months and CPEs (see ``generate_export``).
+
+    Args:
+        directory (Path): The folder to write the files into.
+        months (int, optional): The number of months, up to ``end``. Defaults to 12.
+        cpes (int, optional): The number of CPEs. Defaults to 1.
+        end (tuple, optional): The (year, month) of the last month. Defaults to December 2023.
+        seed (int, optional): The seed of the random consumption values. Defaults to 0.
+
+    Returns:
+        list: The (CPE, year, month, path) of each file.
+    """
+    year, month = end
+    periods = []
+    for _ in range(months):
+        periods.append((year, month))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+
+    exports = []
+    for i in range(cpes):
+        cpe = f"PT{i + 1:016d}BM"
+        for year, month in sorted(periods):
+            path = Path(directory) / f"{cpe}_{year}{month:02d}.xlsx"
+            exports.append((cpe, year, month, generate_export(path, cpe, year, month, seed)))
+
+    return exports
+
+
+class FakeInfluxDB:
+    """
+    A local stand-in for the write API of InfluxDB 2 (``POST /api/v2/write``), counting the points it receives.
+
+    It runs in a thread of the calling process, so the benchmarks measure the serialization and the HTTP round trips
+    of the InfluxDB sink without a database.
+
+    Attributes:
+        url (str): The URL of the server, e.g. ``http://127.0.0.1:54321``.
+        points (int): The points received so far.
+        requests (int): The write requests received so far.
+    """
+
+    def __init__(self):
+        fake = self
+        self.points = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+
+                if not self.path.startswith("/api/v2/write"):
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+
+                with fake._lock:
+                    fake.requests += 1
+                    fake.points += sum(1 for line in body.splitlines() if line.strip())
+
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.host, self.port = self._server.server_address[:2]
+        self.url = f"http://{self.host}:{self.port}"
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="ers-fake-influxdb", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+def percentile(values: list, q: float) -> float:
+    """
+    Returns the ``q`` percentile of a list of values (nearest rank).
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def peak_rss() -> int | None:
+    """
+    Returns the peak resident set size of the process, in bytes, or None where it is not available (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageTimer:
+    """
+    The latencies and the rows processed by a stage of the benchmark, one measurement per file.
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.rows = 0
+
+    def measure(self, function, *args, **kwargs):
+        started = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.latencies.append(time.perf_counter() - started)
+        return result
+
+    def report(self) -> dict:
+        seconds = sum(self.latencies)
+        return {"files": len(self.latencies),
+                "rows": self.rows,
+                "seconds": round(seconds, 6),
+                "rows_per_s": round(self.rows / seconds, 1) if seconds else 0.0,
+                "latency_ms": {**{f"p{q}": round(percentile(self.latencies, q) * 1000, 3) for q in PERCENTILES},
+                               "max": round(max(self.latencies, default=0) * 1000, 3)}}
+
+
+def serialize(frame) -> list:
+    # the line protocol written by ``InfluxDB.write``
+    return data_frame_to_list_of_points(frame, PointSettings(), WritePrecision.S, data_frame_measurement_name="kW",
+                                        data_frame_tag_columns=["cpe"])
+
+
+def run_bench(directory: Path = None, months: int = 12, cpes: int = 1, influxdb: bool = True, seed: int = 0) -> dict:
+    """
+    Benchmarks the data path of the workflows on synthetic E-REDES exports (see ``generate_exports``), one stage at a
+    time:
+
+    - ``parse``: parses each file into a ``ReadingsBatch``.
+    - ``delta``: keeps the readings newer than a watermark in the middle of the month, as a daily delta run does.
+    - ``serialize``: serializes the readings into the InfluxDB line protocol.
+    - ``influxdb``: writes the readings through the InfluxDB sink into a local ``FakeInfluxDB``.
+
+    Args:
+        directory (Path, optional): The folder to write the files into. Defaults to a temporary folder, removed
+            afterwards.
+        months (int, optional): The number of months per CPE. Defaults to 12.
+        cpes (int, optional): The number of CPEs. Defaults to 1.
+        influxdb (bool, optional): Also run the ``influxdb`` stage. Defaults to True.
+        seed (int, optional): The seed of the random consumption values. Defaults to 0.
+
+    Returns:
+        dict: The environment, the rows/s and latency percentiles of each stage, and the peak RSS of the process,
+        as plain JSON-serializable values.
+    """
+    if directory is None:
+        with tempfile.TemporaryDirectory(prefix="ers-bench-") as tmp:
+            return run_bench(Path(tmp), months=months, cpes=cpes, influxdb=influxdb, seed=seed)
+
+    started = time.perf_counter()
+    exports = generate_exports(Path(directory), months=months, cpes=cpes, seed=seed)
+    generated = time.perf_counter() - started
+
+    stages = {name: StageTimer() for name in ("parse", "delta", "serialize") + (("influxdb",) if influxdb else ())}
+    batches = []
+
+    for cpe, year, month, path in exports:
+        batch = stages["parse"].measure(ReadingsBatch.from_file, path, cpe_code=cpe)
+        stages["parse"].rows += len(batch)
+        batches.append(batch)
+
+    for batch in batches:
+        frame = batch.frame
+        watermark = frame.index[len(frame) // 2]
+        stages["delta"].rows += len(stages["delta"].measure(lambda: frame[frame.index > watermark]))
+
+        stages["serialize"].rows += len(stages["serialize"].measure(serialize, frame))
+
+    if influxdb:
+        with FakeInfluxDB() as fake:
+            sink = InfluxDBSink(InfluxDB(token="bench", org="bench", bucket="bench", host=f"http://{fake.host}",
+                                         port=fake.port, quiet=True), quiet=True)
+            sink.connect()
+            try:
+                for batch in batches:
+                    stages["influxdb"].rows += stages["influxdb"].measure(sink.write, batch)
+            finally:
+                sink.close()
+
+            if fake.points != stages["influxdb"].rows:
+                raise RuntimeError(f"The fake InfluxDB received {fake.points} points, "
+                                   f"{stages['influxdb'].rows} were written")
+
+    return {"version": get_version(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "files": len(exports),
+            "months": months,
+            "cpes": cpes,
+            "rows": stages["parse"].rows,
+            "generate_seconds": round(generated, 6),
+            "stages": {name: stage.report() for name, stage in stages.items()},
+            "peak_rss_bytes": peak_rss()}
@@ -0,0 +1,126 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from eredesscraper.meta import db_path
+
+blob_path = db_path.parent / "files"
+
+
+class BlobStore:
+    """
+    A content-addressed file store.
+
+    Files are stored under ``<root>/<hash[:2]>/<hash>``, named after the SHA-256 of their content, so storing the
+    same file twice keeps a single copy. Files are stored as-is: the E-REDES exports are already zip-compressed
+    (XLSX), and keeping the raw bytes lets the API serve them with ``sendfile`` and byte ranges.
+
+    Args:
+        root (Path): The directory holding the files.
+
+    Methods:
+        __iter__: Iterates over the (hash, path) of the stored files.
+        put: Stores a file and returns its hash.
+        path: Returns the path of a stored file.
+        exists: Checks if a file is stored.
+        size: Returns the size of a stored file.
+        delete: Deletes a stored file.
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(self, root: Path = blob_path):
+        self.root = Path(root)
+
+    def __iter__(self):
+        if not self.root.is_dir():
+            return
+        for path in self.root.glob("??/*"):
+            if len(path.name) == 64 and path.parent.name == path.name[:2]:
+                yield path.name, path
+
+    def put(self, file_path: Path) -> str:
+        """
+        Stores a file. The file is hashed and copied in chunks, so it is never fully loaded into memory.
+
+        Args:
+            file_path (pathlib.Path): The file to store.
+
+        Returns:
+            str: The SHA-256 hex digest identifying the stored file.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        digest = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".tmp-")
+
+        try:
+            with open(file_path, "rb") as src, os.fdopen(fd, "wb") as dst:
+                while chunk := src.read(self.chunk_size):
+                    digest.update(chunk)
+                    dst.write(chunk)
+
+            target = self.path(digest.hexdigest())
+
+            try:
+                # already stored: refresh it, so a compaction running meanwhile keeps it for its grace period
+                os.utime(target)
+            except FileNotFoundError:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp, target)
+            else:
+                os.unlink(tmp)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+        return digest.hexdigest()
+
+    def path(self, digest: str) -> Path:
+        """
+        Returns the path of a stored file.
+
+        Args:
+            digest (str): The hash of the file.
+
+        Returns:
+            pathlib.Path: The path of the file.
+        """
+        if len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+            raise ValueError(f"Invalid file hash: {digest}")
+
+        return self.root / digest[:2] / digest
+
+    def exists(self, digest: str) -> bool:
+        return self.path(digest).is_file()
+
+    def size(self, digest: str) -> int:
+        return self.path(digest).stat().st_size
+
+    def delete(self, digest: str) -> bool:
+        """
+        Deletes a stored file.
+
+        Args:
+            digest (str): The hash of the file.
+
+        Returns:
+            bool: True if the file was deleted, False if it was not stored.
+        """
+        try:
+            self.path(digest).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+    def destroy(self):
+        """
+        Deletes every stored file.
+
+        Returns:
+            bool: True if the operation is successful.
+        """
+        shutil.rmtree(self.root, ignore_errors=True)
+        return True
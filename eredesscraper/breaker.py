@@ -0,0 +1,274 @@
+import threading
+from collections.abc import Callable
+from datetime import datetime, timedelta
+
+from eredesscraper.agent import CaptchaError, LoginError
+from eredesscraper.backend import DuckDB, DuckDBWriter
+from eredesscraper.models import Breaker, BreakerRecord
+from eredesscraper.ratelimit import Permit, RateLimited, RateLimiter
+
+
+class CircuitOpen(RateLimited):
+    """
+    Raised when the circuit breaker of an account does not admit a scrape.
+    """
+
+
+def breaker_failure(e: BaseException) -> str | None:
+    """
+    Classifies the failure of a scrape for the circuit breaker.
+
+    Args:
+        e (BaseException): The exception raised by the scrape.
+
+    Returns:
+        str | None: ``captcha`` or ``login`` if the failure trips the breaker, None otherwise.
+    """
+    if isinstance(e, CaptchaError):
+        return "captcha"
+    if isinstance(e, LoginError):
+        return "login"
+    return None
+
+
+def logged_in(stats: dict | None) -> bool:
+    """
+    Checks if a workflow logged into E-REDES, from its measurements. A run served from the result cache did not: its
+    outcome tells nothing about the account, so it must not close a half-open breaker.
+
+    Args:
+        stats (dict | None): The measurements of the workflow (see ``metrics.session_stats``). For a batch, the
+            measurements of each child task, under ``children``.
+
+    Returns:
+        bool: True if the workflow (or a child task of the batch) went through the login.
+    """
+    stats = stats or {}
+    return "login" in (stats.get("timings") or {}) or \
+        any(logged_in(child) for child in (stats.get("children") or {}).values())
+
+
+class CircuitBreaker:
+    """
+    A circuit breaker per E-REDES account, pausing the scrapes after captcha or login failures.
+
+    Once E-REDES shows its captcha, every login into the account does the same for a while, so starting browsers
+    only makes it last longer. After ``threshold`` consecutive failures the breaker of the account opens: no scrape
+    is admitted until its cool-down is over. The breaker is then half-open and admits a single probe. If the probe
+    gets through the login, the breaker closes again; if it fails, the breaker opens again with a doubled cool-down
+    (up to ``max_cooldown_minutes``).
+
+    The breakers are kept in the ``breakers`` table of the state database, so they survive a restart of the server.
+
+    Args:
+        ddb (DuckDB): The connection to the state database, the breakers are loaded from.
+        writer (DuckDBWriter): The writer of the breaker records.
+        settings (Breaker, optional): The threshold and cool-downs. Defaults to ``Breaker()``.
+        clock (Callable): Returns the current time. Defaults to ``datetime.now``.
+
+    Methods:
+        state: Returns the breaker of an account.
+        admit: Admits a scrape, or raises ``CircuitOpen``.
+        abort: Withdraws an admission, when no scrape was started after all.
+        record: Records the outcome of a scrape.
+    """
+
+    def __init__(self, ddb: DuckDB, writer: DuckDBWriter, settings: Breaker = None, clock: Callable = datetime.now):
+        self.ddb = ddb
+        self.writer = writer
+        self.settings = settings or Breaker()
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self._probing = set()
+
+    def _get(self, account: str) -> BreakerRecord:
+        if account not in self._breakers:
+            cursor = self.ddb.cursor()
+            try:
+                self._breakers[account] = cursor.get_breaker(account) or BreakerRecord(account=account)
+            finally:
+                cursor.close()
+
+        return self._breakers[account]
+
+    def _save(self, record: BreakerRecord):
+        record.updated = self.clock()
+        self.writer.put_breaker(record)
+
+    def cooldown(self, opens: int) -> timedelta:
+        minutes = self.settings.cooldown_minutes * 2 ** max(opens - 1, 0)
+        return timedelta(minutes=min(minutes, self.settings.max_cooldown_minutes))
+
+    def state(self, account: str) -> BreakerRecord:
+        with self._lock:
+            return self._get(account).model_copy()
+
+    def admit(self, account: str | None) -> bool:
+        """
+        Admits a scrape for an account.
+
+        Args:
+            account (str | None): The account (NIF). None is always admitted.
+
+        Returns:
+            bool: True if the scrape is the probe of a half-open breaker, False otherwise.
+
+        Raises:
+            CircuitOpen: If the breaker is open, or half-open with its probe still running.
+        """
+        if account is None:
+            return False
+
+        with self._lock:
+            breaker = self._get(account)
+
+            if breaker.state == "closed":
+                return False
+
+            now = self.clock()
+            if breaker.state == "open":
+                if now < breaker.retry_at:
+                    raise CircuitOpen(f"The scrapes of the account are paused after a {breaker.last_error} failure",
+                                      (breaker.retry_at - now).total_seconds())
+                breaker.state = "half_open"
+                self._save(breaker)
+
+            if account in self._probing:
+                raise CircuitOpen("A probe is checking if the scrapes of the account can resume",
+                                  self.cooldown(1).total_seconds())
+
+            self._probing.add(account)
+            return True
+
+    def abort(self, account: str | None, probe: bool):
+        """
+        Withdraws an admission, when no scrape was started after all.
+
+        Args:
+            account (str | None): The account (NIF).
+            probe (bool): If the admission was a probe.
+
+        Returns:
+            None
+        """
+        if probe:
+            with self._lock:
+                self._probing.discard(account)
+
+    def record(self, account: str | None, failure: str | None, probe: bool = False, error: str = None):
+        """
+        Records the outcome of a scrape.
+
+        Args:
+            account (str | None): The account (NIF).
+            failure (str | None): ``captcha`` or ``login`` if the scrape tripped the breaker (see
+                ``breaker_failure``), None if it got through the login.
+            probe (bool, optional): If the scrape was the probe of a half-open breaker.
+            error (str, optional): The description of the failure. Defaults to ``failure``.
+
+        Returns:
+            None
+        """
+        if account is None:
+            return
+
+        with self._lock:
+            if probe:
+                self._probing.discard(account)
+
+            breaker = self._get(account)
+
+            if failure is None:
+                if breaker.state == "closed" and breaker.failures:
+                    breaker.failures = 0
+                    self._save(breaker)
+                elif breaker.state != "closed" and probe:
+                    breaker.state, breaker.failures, breaker.opens, breaker.retry_at = "closed", 0, 0, None
+                    self._save(breaker)
+                return
+
+            breaker.failures += 1
+            breaker.last_error = error or failure
+
+            # a scrape admitted before the breaker opened does not extend its cool-down
+            tripped = breaker.state == "half_open" or (breaker.state == "closed" and
+                                                       breaker.failures >= self.settings.threshold)
+            if tripped:
+                breaker.opens += 1
+                breaker.state = "open"
+                breaker.retry_at = self.clock() + self.cooldown(breaker.opens)
+
+            self._save(breaker)
+
+
+class Admission:
+    """
+    A scrape admitted by the circuit breaker and the rate limiter of its account.
+
+    Attributes:
+        account (str | None): The account (NIF) of the scrape.
+        probe (bool): If the scrape is the probe of a half-open breaker.
+    """
+
+    def __init__(self, account: str | None, breaker: CircuitBreaker = None, permit: Permit = None,
+                 probe: bool = False):
+        self.account = account
+        self.breaker = breaker
+        self.permit = permit
+        self.probe = probe
+
+    def finish(self, failure: str = None, error: str = None):
+        """
+        Records the outcome of the scrape and releases its concurrency slot.
+
+        Args:
+            failure (str, optional): The failure tripping the breaker (see ``breaker_failure``). Defaults to None.
+            error (str, optional): The description of the failure.
+
+        Returns:
+            None
+        """
+        if self.permit is not None:
+            self.permit.release()
+        if self.breaker is not None:
+            self.breaker.record(self.account, failure, self.probe, error)
+
+    def cancel(self):
+        """
+        Withdraws the admission, when no scrape was started after all (or its outcome is unknown).
+
+        Returns:
+            None
+        """
+        if self.permit is not None:
+            self.permit.release(refund=True)
+        if self.breaker is not None:
+            self.breaker.abort(self.account, self.probe)
+
+
+def admit(account: str | None, breaker: CircuitBreaker = None, limiter: RateLimiter = None) -> Admission:
+    """
+    Admits a scrape for an account through its circuit breaker, then through the rate limiter.
+
+    Args:
+        account (str | None): The account (NIF).
+        breaker (CircuitBreaker, optional): The circuit breaker. Defaults to None.
+        limiter (RateLimiter, optional): The rate limiter. Defaults to None.
+
+    Returns:
+        Admission: The admission, to finish (or cancel) once the scrape is over.
+
+    Raises:
+        RateLimited: If the scrape is not admitted (``CircuitOpen`` if the breaker is open).
+    """
+    probe = breaker.admit(account) if breaker is not None else False
+
+    try:
+        permit = limiter.acquire(account) if limiter is not None else None
+    except RateLimited:
+        if breaker is not None:
+            breaker.abort(account, probe)
+        raise
+
+    return Admission(account, breaker, permit, probe)
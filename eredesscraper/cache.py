@@ -0,0 +1,250 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+from eredesscraper.backend import db_path
+from eredesscraper.sinks import ReadingsBatch
+
+cache_path = db_path.parent / "cache"
+
+
+class CacheEntry:
+    """
+    The cached result of a workflow: the file retrieved from E-REDES for a CPE and month, and its parsed readings.
+
+    Attributes:
+        cpe (str): The CPE code of the readings.
+        year (int): The year of the readings.
+        month (int): The month of the readings.
+        source (Path): The cached XLSX file.
+        created (float): When the file was retrieved (UNIX time).
+    """
+
+    def __init__(self, path: Path, meta: dict):
+        self.path = path
+        self.cpe = meta["cpe"]
+        self.year = meta["year"]
+        self.month = meta["month"]
+        self.created = meta["created"]
+        self.source = path / meta["source"]
+
+    def __repr__(self):
+        return f"CacheEntry(cpe={self.cpe}, year={self.year}, month={self.month}, source={self.source})"
+
+    def batch(self) -> ReadingsBatch:
+        """
+        Returns the parsed readings. The file is only parsed if its readings were not cached yet.
+
+        Returns:
+            ReadingsBatch: The readings, with the cached file as their source.
+        """
+        readings = self.path / "readings.pkl"
+
+        try:
+            frame = pd.read_pickle(readings)
+        except (FileNotFoundError, EOFError):
+            batch = ReadingsBatch.from_file(self.source, cpe_code=self.cpe)
+            write_atomic(readings, batch.frame.to_pickle)
+            return batch
+
+        return ReadingsBatch(frame, cpe=self.cpe, source=self.source)
+
+
+def write_atomic(path: Path, write):
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+class ResultCache:
+    """
+    A cache of the files retrieved from E-REDES, keyed by (CPE, year, month).
+
+    Readings of a closed month no longer change, so its entry never expires. The entry of a month that is not
+    closed yet (including ``settle_days`` after its end, while late readings still arrive) expires ``ttl`` seconds
+    after it was retrieved. When the cache grows over ``max_bytes``, the least recently used entries are evicted.
+
+    Entries are kept under ``<root>/<cpe>/<year>-<month>/``, with the original file, its parsed readings and a
+    ``meta.json`` whose modification time tracks the last use of the entry.
+
+    Args:
+        root (Path): The cache directory.
+        ttl (float): The lifetime of the entries of open months, in seconds.
+        max_bytes (int, optional): The size budget of the cache, in bytes. Defaults to None (no limit).
+
+    Methods:
+        from_config: Creates the cache from the ``cache`` section of a config.
+        get: Returns the entry of a CPE and month, if cached and fresh.
+        put: Caches the file retrieved for a CPE and month.
+        evict: Evicts the least recently used entries over the size budget.
+        clear: Deletes every entry.
+    """
+
+    settle_days = 2
+
+    def __init__(self, root: Path = cache_path, ttl: float = 3600, max_bytes: int = None):
+        self.root = Path(root)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_config(cls, config: dict) -> "ResultCache | None":
+        """
+        Creates the cache from the ``cache`` section of a config.
+
+        Args:
+            config (dict): The parsed config file.
+
+        Returns:
+            ResultCache | None: The cache, or None if it is disabled.
+        """
+        settings = config.get("cache") or {}
+
+        if not settings.get("enabled", True):
+            return None
+
+        return cls(root=Path(settings.get("path") or cache_path).expanduser(),
+                   ttl=settings.get("ttl_minutes", 60) * 60,
+                   max_bytes=settings["max_mb"] * 1024 * 1024 if settings.get("max_mb") else None)
+
+    def is_closed(self, year: int, month: int, today: date = None) -> bool:
+        """
+        Checks if the readings of a month are final.
+
+        Args:
+            year (int): The year.
+            month (int): The month.
+            today (date, optional): The current date. Defaults to today.
+
+        Returns:
+            bool: True if the month ended more than ``settle_days`` ago.
+        """
+        next_month = date(year + month // 12, month % 12 + 1, 1)
+        return (today or date.today()) >= next_month + timedelta(days=self.settle_days)
+
+    def entry_path(self, cpe: str, year: int, month: int) -> Path:
+        return self.root / "".join(c for c in str(cpe) if c.isalnum()) / f"{int(year):04d}-{int(month):02d}"
+
+    def get(self, cpe: str, year: int, month: int) -> CacheEntry | None:
+        """
+        Returns the entry of a CPE and month, if cached and fresh.
+
+        Args:
+            cpe (str): The CPE code.
+            year (int): The year.
+            month (int): The month.
+
+        Returns:
+            CacheEntry | None: The entry, or None on a cache miss.
+        """
+        path = self.entry_path(cpe, year, month)
+        meta_path = path / "meta.json"
+
+        try:
+            meta = json.loads(meta_path.read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if not self.is_closed(year, month) and time.time() - meta["created"] > self.ttl:
+            return None
+
+        entry = CacheEntry(path, meta)
+        if not entry.source.is_file():
+            return None
+
+        # the modification time of the metadata tracks the last use of the entry
+        os.utime(meta_path)
+
+        return entry
+
+    def put(self, cpe: str, year: int, month: int, source: Path, batch: ReadingsBatch = None) -> CacheEntry:
+        """
+        Caches the file retrieved for a CPE and month, replacing the previous entry.
+
+        Args:
+            cpe (str): The CPE code.
+            year (int): The year.
+            month (int): The month.
+            source (Path): The file retrieved from E-REDES. It is copied into the cache.
+            batch (ReadingsBatch, optional): The parsed readings of the file, if already parsed.
+
+        Returns:
+            CacheEntry: The new entry.
+        """
+        path = self.entry_path(cpe, year, month)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # the entry is built aside and moved in place, so concurrent readers never see a partial entry
+        tmp = Path(tempfile.mkdtemp(dir=path.parent, prefix=".tmp-"))
+        try:
+            meta = {"cpe": cpe, "year": int(year), "month": int(month), "created": time.time(),
+                    "source": Path(source).name}
+            shutil.copyfile(source, tmp / meta["source"])
+            if batch is not None:
+                batch.frame.to_pickle(tmp / "readings.pkl")
+            (tmp / "meta.json").write_text(json.dumps(meta))
+
+            if path.exists():
+                stale = path.with_name(f".stale-{path.name}-{os.getpid()}")
+                os.replace(path, stale)
+                shutil.rmtree(stale, ignore_errors=True)
+            os.replace(tmp, path)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        self.evict()
+
+        return CacheEntry(path, meta)
+
+    def evict(self) -> int:
+        """
+        Evicts the least recently used entries until the cache fits in its size budget.
+
+        Returns:
+            int: The number of entries evicted.
+        """
+        if self.max_bytes is None or not self.root.is_dir():
+            return 0
+
+        entries = []
+        for meta_path in self.root.glob("*/*/meta.json"):
+            try:
+                used = meta_path.stat().st_mtime
+                size = sum(f.stat().st_size for f in meta_path.parent.iterdir() if f.is_file())
+            except FileNotFoundError:
+                continue
+            entries.append((used, size, meta_path.parent))
+
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            evicted += 1
+
+        return evicted
+
+    def clear(self):
+        """
+        Deletes every entry.
+
+        Returns:
+            bool: True if the operation is successful.
+        """
+        shutil.rmtree(self.root, ignore_errors=True)
+        return True
@@ -3,20 +3,27 @@ from pathlib import Path
 from typing import Optional
 
 import typer
-import yaml
+from typer.core import TyperGroup
 
 from eredesscraper._version import get_version
-from eredesscraper.backend import db_path
-from eredesscraper.meta import cli_header, supported_workflows, supported_databases
-from eredesscraper.server import start_api_server
-from eredesscraper.utils import parse_config, validate_config, flatten_config, struct_config, infer_type
-from eredesscraper.workflows import switchboard
+from eredesscraper.meta import cli_header, db_path, supported_workflows, supported_databases
+
+# each command imports the modules it needs (the browser, pandas, the databases, the API server) when it runs, so
+# the CLI starts fast. `tests/test_cli.py` keeps the heavy dependencies out of `import eredesscraper.cli`
 
 appdir = typer.get_app_dir(app_name="ers")
 config_path = Path(appdir) / "cache" / "config.yml"
 
+
+class ERSGroup(TyperGroup):
+    def format_help(self, ctx, formatter):
+        # the header reads the project metadata and the version: only when the help is shown
+        self.help = cli_header()
+        return super().format_help(ctx, formatter)
+
+
 app = typer.Typer(name="ers",
-                  help=cli_header,
+                  cls=ERSGroup,
                   add_completion=False,
                   add_help_option=True,
                   no_args_is_help=True,
@@ -45,9 +52,11 @@ def version(ctx: typer.Context):
 @app.command(help="Get information about the available workflows and databases")
 def info(ctx: typer.Context):
     """Get information about the available workflows and databases"""
+    from eredesscraper.sinks import available_sinks
+
     if not ctx.obj["quiet"]:
         typer.echo(f"Supported workflows: {supported_workflows}")
-        typer.echo(f"Supported databases: {supported_databases}")
+        typer.echo(f"Supported databases: {list(available_sinks())}")
 
 
 @app.command(help="Run the scraper workflow. Can directly load data onto supported databases.")
@@ -79,8 +88,29 @@ def run(workflow: str = typer.Option("current",
         headless: Optional[bool] = typer.Option(True,
                                                 "--headless", "-H",
                                                 help="Disable headless mode"),
+        no_cache: Optional[bool] = typer.Option(False,
+                                                "--no-cache",
+                                                help="Always retrieve the data from E-REDES, bypassing the result "
+                                                     "cache"),
+        start: Optional[str] = typer.Option(None,
+                                            "--start", "-s",
+                                            help="Specify the first month to load (YYYY-MM). "
+                                                 "[Required for `backfill` workflow]",
+                                            show_default=False),
+        end: Optional[str] = typer.Option(None,
+                                          "--end", "-e",
+                                          help="Specify the last month to load (YYYY-MM). Defaults to the current "
+                                               "month. [Optional for `backfill` workflow]",
+                                          show_default=False),
+        profile: Optional[bool] = typer.Option(False,
+                                               "--profile",
+                                               help="Write a CPU profile (pstats) and the peak memory of the run "
+                                                    "to the output folder",
+                                               show_default=False),
         ctx: typer.Context = typer.Option(None, callback=main)):
     """Run a workflow from a config file"""
+    from eredesscraper.workflows import switchboard
+
     config = Path(appdir) / "cache" / "config.yml"
     assert Path(
         config).exists(), f"Config file not found. "
@@ -103,7 +133,11 @@ def run(workflow: str = typer.Option("current",
         keep=keep,
         headless=headless,
         quiet=ctx.obj["quiet"],
-        output=output
+        output=output,
+        cache=not no_cache,
+        start=start,
+        end=end,
+        profile=profile
     )
 
     if not ctx.obj["quiet"]:
@@ -128,6 +162,10 @@ def load(config: str = typer.Argument(resolve_path=True,
                                       readable=True,
                                       help="Path to the config file"),
          ctx: typer.Context = typer.Option(None, callback=main)):
+    import yaml
+
+    from eredesscraper.utils import save_config, validate_config
+
     try:
         config_path = Path(config).resolve()
 
@@ -136,17 +174,13 @@ def load(config: str = typer.Argument(resolve_path=True,
                 typer.echo("💥\tInvalid configuration file. Please check the configuration schema and try again.")
             raise typer.Exit(code=1)
 
-        Path.mkdir(Path(appdir) / "cache", parents=True, exist_ok=True)
-
-        cache = Path(appdir) / "cache"
         if not ctx.obj["quiet"]:
             typer.echo(f"⚙️\tLoading configuration from file: {config_path}")
 
         with open(config_path, "r") as f:
             tmp_config = yaml.safe_load(f)
 
-        with open(cache / "config.yml", "w") as f:
-            yaml.dump(tmp_config, f)
+        save_config(tmp_config, Path(appdir) / "cache" / "config.yml")
         if not ctx.obj["quiet"]:
             typer.echo("✅\tConfig file loaded successfully.")
 
@@ -159,6 +193,10 @@ def load(config: str = typer.Argument(resolve_path=True,
 @config_app.command(help="Show the current configuration")
 def show(ctx: typer.Context = typer.Option(None, callback=main)):
     """Show the current configuration"""
+    import yaml
+
+    from eredesscraper.utils import parse_config
+
     try:
         config = parse_config(Path(appdir) / "cache" / "config.yml")
         if not ctx.obj["quiet"]:
@@ -184,6 +222,8 @@ def set(key: str, value: str, ctx: typer.Context = typer.Option(None, callback=m
 
     Infers the type of the value.
     """
+    from eredesscraper.utils import flatten_config, infer_type, parse_config, save_config, struct_config
+
     value = infer_type(value)
 
     try:
@@ -197,13 +237,78 @@ def set(key: str, value: str, ctx: typer.Context = typer.Option(None, callback=m
 
     config[key] = value
 
-    with open(Path(appdir) / "cache" / "config.yml", "w") as f:
-        yaml.dump(struct_config(config), f)
+    save_config(struct_config(config), Path(appdir) / "cache" / "config.yml")
     if not ctx.obj["quiet"]:
         typer.echo(
             f"✅\tKey {typer.style(key, fg=typer.colors.GREEN)} set to {typer.style(value, fg=typer.colors.GREEN)}.")
 
 
+db_app = typer.Typer(name="db",
+                     help="E-REDES Scraper API state database",
+                     add_completion=False,
+                     add_help_option=True,
+                     no_args_is_help=True)
+
+app.add_typer(db_app, name="db", help="Maintain the API state database")
+
+
+@db_app.command(help="Delete the expired tasks and files and compact the API state database. "
+                     "Defaults to the `retention` policy of the loaded config file.")
+def compact(max_age_days: Optional[int] = typer.Option(None, "--max-age-days",
+                                                       help="Delete the finished tasks older than this",
+                                                       show_default=False),
+            max_tasks: Optional[int] = typer.Option(None, "--max-tasks",
+                                                    help="Keep only the most recent tasks",
+                                                    show_default=False),
+            max_file_mb: Optional[int] = typer.Option(None, "--max-file-mb",
+                                                      help="Size budget of the stored task files, in MB",
+                                                      show_default=False),
+            rewrite: Optional[bool] = typer.Option(True, "--rewrite/--no-rewrite",
+                                                   help="Rewrite the database file to give the freed space back"),
+            storage: Optional[str] = typer.Option(db_path.absolute().as_posix(), "--storage", "-S",
+                                                  help="Specify the path of the API state database"),
+            ctx: typer.Context = typer.Option(None, callback=main)):
+    """Apply the retention policy to the API state database"""
+    import duckdb
+
+    from eredesscraper.backend import DuckDB
+    from eredesscraper.blobstore import BlobStore
+    from eredesscraper.utils import parse_config
+
+    try:
+        retention = parse_config(Path(appdir) / "cache" / "config.yml").get("retention") or {}
+    except (AssertionError, FileNotFoundError):
+        retention = {}
+
+    max_age_days = max_age_days if max_age_days is not None else retention.get("max_age_days")
+    max_tasks = max_tasks if max_tasks is not None else retention.get("max_tasks")
+    max_file_mb = max_file_mb if max_file_mb is not None else retention.get("max_file_mb")
+
+    size = Path(storage).stat().st_size if Path(storage).exists() else 0
+
+    try:
+        ddb = DuckDB(Path(storage).absolute().as_posix())
+    except duckdb.IOException:
+        if not ctx.obj["quiet"]:
+            typer.echo("💥\tThe database is in use. Stop the API server and try again.")
+        raise typer.Exit(code=1)
+
+    stats = ddb.compact(max_age_days=max_age_days,
+                        max_tasks=max_tasks,
+                        max_file_bytes=max_file_mb * 1024 * 1024 if max_file_mb is not None else None,
+                        blobs=BlobStore(Path(storage).parent / "files"))
+
+    if rewrite:
+        ddb.rewrite()
+
+    ddb.close()
+
+    if not ctx.obj["quiet"]:
+        typer.echo(f"🧹\tDeleted {stats['tasks']} tasks and {stats['files']} files ({stats['bytes'] / 1024 / 1024:.1f} MB)")
+        typer.echo(f"💾\tDatabase size: {size / 1024 / 1024:.1f} MB -> "
+                   f"{Path(storage).stat().st_size / 1024 / 1024:.1f} MB")
+
+
 @app.command(help="Start the application webserver")
 def server(
         ctx: typer.Context,
@@ -218,6 +323,7 @@ def server(
         storage: Optional[str] = typer.Option(db_path.parent.absolute().as_posix(), "--storage", "-S",
                                               help="Specify the storage path to persist the API state")):
     """Start the application webserver"""
+    from eredesscraper.server import start_api_server
 
     if not debug:
         warnings.filterwarnings("ignore", category=UserWarning)
@@ -235,5 +341,75 @@ def server(
     start_api_server(port=port, host=host, reload=reload, debug=debug)
 
 
+@app.command(help="Run the queued tasks of a remote API server")
+def worker(ctx: typer.Context,
+           server_url: str = typer.Option(..., "--server", "-s",
+                                          help="Specify the URL of the API server, e.g. http://localhost:8778"),
+           name: Optional[str] = typer.Option(None, "--name", "-n",
+                                              help="Specify the name of the worker. [Default: <hostname>:<pid>]",
+                                              show_default=False),
+           poll_interval: Optional[float] = typer.Option(5, "--poll-interval",
+                                                         help="Seconds to wait when no task is queued"),
+           max_jobs: Optional[int] = typer.Option(None, "--max-jobs",
+                                                  help="Stop after running this many tasks",
+                                                  show_default=False)):
+    """Run the queued tasks of a remote API server"""
+    from eredesscraper.workers import RemoteWorker
+
+    if not config_path.exists():
+        typer.echo(f"💥\tConfig file not found. "
+                   f"Run {typer.style('ers config load </path/to/config.yml>', fg=typer.colors.GREEN)} to load it.")
+        raise typer.Exit(code=1)
+
+    remote = RemoteWorker(server_url, config_path.resolve(), name=name, poll_interval=poll_interval)
+
+    if not ctx.obj["quiet"]:
+        typer.echo(f"👷\tWorker {typer.style(remote.name, fg=typer.colors.GREEN)} running the tasks of {server_url}")
+
+    try:
+        done = remote.serve(max_jobs=max_jobs)
+    except KeyboardInterrupt:
+        raise typer.Exit(code=0)
+
+    if not ctx.obj["quiet"]:
+        typer.echo(f"✅\tRan {done} task(s)")
+
+
+
+@app.command(help="Benchmark the parse, delta and sink stages on synthetic E-REDES exports")
+def bench(ctx: typer.Context,
+          months: Optional[int] = typer.Option(12, "--months", "-m",
+                                               help="Specify the number of months of readings per CPE"),
+          cpes: Optional[int] = typer.Option(1, "--cpes", "-c",
+                                             help="Specify the number of CPEs"),
+          files: Optional[str] = typer.Option(None, "--files", "-f",
+                                              help="Specify a folder to keep the generated exports in. "
+                                                   "[Default: a temporary folder]",
+                                              show_default=False),
+          output: Optional[str] = typer.Option(None, "--output", "-o",
+                                               help="Specify a file to write the JSON report to",
+                                               show_default=False),
+          influxdb: Optional[bool] = typer.Option(True, "--influxdb/--no-influxdb",
+                                                  help="Write into a local fake InfluxDB"),
+          seed: Optional[int] = typer.Option(0, "--seed",
+                                             help="Specify the seed of the generated readings")):
+    """Benchmark the parse, delta and sink stages on synthetic E-REDES exports"""
+    import json
+
+    from eredesscraper.bench import run_bench
+
+    if months < 1 or cpes < 1:
+        typer.echo("💥\tThe number of months and CPEs must be at least 1")
+        raise typer.Exit(code=1)
+
+    report = run_bench(Path(files) if files else None, months=months, cpes=cpes, influxdb=influxdb, seed=seed)
+    report = json.dumps(report, indent=2)
+
+    if output:
+        Path(output).write_text(report + "\n")
+    if not ctx.obj["quiet"] or not output:
+        typer.echo(report)
+
+
 if __name__ == "__main__":
     app()
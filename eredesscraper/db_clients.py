@@ -9,6 +9,7 @@ from influxdb_client.client.exceptions import InfluxDBError
 from influxdb_client.client.write_api import SYNCHRONOUS
 from pytz import UTC
 
+from eredesscraper.tracing import traced
 from eredesscraper.utils import parse_readings_influx
 
 
@@ -127,19 +128,54 @@ class InfluxDB:
         else:
             records = parse_readings_influx(source_data, cpe_code=cpe_code)
 
+        self.write(records)
+
+        self.client.close()
+
+        return None
+
+    def write(self, records: pd.DataFrame, measurement: str = 'kW', fields: list = None) -> None:
+        """
+        The ``write`` method writes an already parsed readings DataFrame (as returned by ``parse_readings_influx``)
+        into the InfluxDB bucket. The connection is kept open so the caller can issue further writes or queries.
+
+        :param records: The readings DataFrame, indexed by ``date_time``
+        :param measurement: The measurement name (default: ``kW``)
+        :param fields: The field columns to write (default: ``['consumption']``)
+        :return: None
+        :doc-author: Ricardo Filipe dos Santos
+        """
         self.client.write_api(write_options=SYNCHRONOUS).write(bucket=self.__bucket,
                                                                org=self.__org,
                                                                record=records,
-                                                               data_frame_measurement_name='kW',
+                                                               data_frame_measurement_name=measurement,
                                                                data_frame_tag_columns=['cpe'],
-                                                               data_frame_field_columns=['consumption'],
+                                                               data_frame_field_columns=fields or ['consumption'],
                                                                data_frame_timestamp='date_time',
                                                                data_frame_write_precision=WritePrecision.S)
 
-        self.client.close()
+        return None
+
+    def write_rollups(self, rollups: dict) -> None:
+        """
+        The ``write_rollups`` method writes the windows computed by ``compute_rollups`` into the InfluxDB bucket,
+        one measurement per rollup (``kW_1h``, ``kW_1d`` and ``kW_1mo``). Points are keyed by the window start, so
+        recomputed windows overwrite the previous values.
+
+        :param rollups: A mapping of rollup names to DataFrames, as returned by ``compute_rollups``
+        :return: None
+        :doc-author: Ricardo Filipe dos Santos
+        """
+        for name, rollup in rollups.items():
+            if rollup.empty:
+                continue
+            self.write(rollup,
+                       measurement=f'kW_{name}',
+                       fields=[c for c in rollup.columns if c.startswith('consumption_')])
 
         return None
 
+    @traced("influxdb.get_last_insert")
     def get_last_insert(self, cpe_code: str) -> datetime:
         """
         The ``get_last_insert`` method returns the ``datetime`` object representing the latest data point present in
@@ -176,6 +212,40 @@ from(bucket: "{self.__bucket}")
 
         return last_insert
 
+    @traced("influxdb.get_points")
+    def get_points(self, cpe_code: str, start: datetime.datetime, stop: datetime.datetime) -> pd.DataFrame:
+        """
+        The ``get_points`` method returns the raw data points of a CPE stored in the InfluxDB bucket between ``start``
+        (inclusive) and ``stop`` (exclusive), in the format returned by ``parse_readings_influx``.
+
+        :param cpe_code: Specify the CPE code of the data points to be returned
+        :param start: The start of the range
+        :param stop: The end of the range
+        :return: A pandas DataFrame indexed by ``date_time``, with ``consumption`` and ``cpe`` columns
+        :doc-author: Ricardo Filipe dos Santos
+        """
+
+        start, stop = (f"{pd.Timestamp(ts).tz_convert(UTC):%Y-%m-%dT%H:%M:%SZ}" for ts in (start, stop))
+        query = (f'''from(bucket: "{self.__bucket}")
+  |> range(start: {start}, stop: {stop})
+  |> filter(fn: (r) => r["_measurement"] == "kW")
+  |> filter(fn: (r) => r["_field"] == "consumption")
+  |> filter(fn: (r) => r["cpe"] == "{cpe_code}")
+  |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")''')
+
+        result = self.client.query_api().query_data_frame(org=self.__org, query=query)
+        if isinstance(result, list):
+            result = pd.concat(result) if result else pd.DataFrame()
+
+        if result.empty:
+            return pd.DataFrame(columns=['consumption', 'cpe'], index=pd.DatetimeIndex([], tz=UTC, name='date_time'))
+
+        points = result[['_time', 'consumption']].rename(columns={'_time': 'date_time'})
+        points['date_time'] = points['date_time'].dt.tz_convert(UTC)
+        points['cpe'] = cpe_code
+
+        return points.set_index('date_time').sort_index()
+
     def delta(self, source_data: Path, cpe_code: str) -> pd.DataFrame:
         """
         The ``delta`` method uses ``parse_readings_influx`` function to get the source data into a pandas
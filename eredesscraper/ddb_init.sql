@@ -20,4 +20,53 @@ CREATE TABLE IF NOT EXISTS taskstatus
     file    BLOB,
     created TIMESTAMP,
     updated TIMESTAMP
-);
\ No newline at end of file
+);
+
+-- downloaded files are kept in the content-addressed file store. `file` only holds files of older versions
+ALTER TABLE taskstatus ADD COLUMN IF NOT EXISTS file_hash VARCHAR;
+
+-- task listing (`GET /tasks`) is ordered and paginated on the request creation time
+CREATE INDEX IF NOT EXISTS workflowrequests_created_idx ON workflowrequests (created);
+
+-- durable queue of the tasks run by the worker pool. No key: DuckDB rejects repeated updates of indexed rows
+CREATE TABLE IF NOT EXISTS jobs
+(
+    task_id       UUID NOT NULL,
+    state         VARCHAR   DEFAULT 'queued',
+    worker        VARCHAR,
+    lease_expires TIMESTAMP,
+    attempts      INTEGER   DEFAULT 0,
+    -- identical requests in flight share a single task (see `singleflight`)
+    flight_key    VARCHAR,
+    no_cache      BOOL      DEFAULT false,
+    created       TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- range of months of the `backfill` jobs
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS range_start VARCHAR;
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS range_end VARCHAR;
+
+-- jobs run with `profile=1`, and the CPU profile they wrote (see `profiling`)
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS profile BOOL DEFAULT false;
+ALTER TABLE taskstatus ADD COLUMN IF NOT EXISTS profile VARCHAR;
+
+-- circuit breaker of each E-REDES account (see `breaker`). No key: DuckDB rejects repeated updates of indexed rows
+CREATE TABLE IF NOT EXISTS breakers
+(
+    account    VARCHAR NOT NULL,
+    state      VARCHAR DEFAULT 'closed',
+    failures   INTEGER DEFAULT 0,
+    opens      INTEGER DEFAULT 0,
+    retry_at   TIMESTAMP,
+    last_error VARCHAR,
+    updated    TIMESTAMP
+);
+
+-- child tasks of the batches (`/run_batch`): one row per month and CPE, run by the job of their batch
+CREATE TABLE IF NOT EXISTS batchtasks
+(
+    batch_id UUID    NOT NULL,
+    task_id  UUID    NOT NULL,
+    cpe      VARCHAR NOT NULL,
+    position INTEGER
+);
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+from datetime import datetime
+
+from eredesscraper.backend import active_statuses
+from eredesscraper.models import TaskstatusRecord
+
+
+class Subscription:
+    """
+    A subscription to the status events of some tasks.
+
+    Events are delivered into an ``asyncio.Queue`` bound to the event loop of the subscriber, so they can be
+    published from any thread.
+
+    Attributes:
+        task_ids (set | None): The IDs of the tasks subscribed to, or None for every task.
+        queue (asyncio.Queue): The queue the events are delivered into.
+        loop (asyncio.AbstractEventLoop): The event loop of the subscriber.
+    """
+
+    def __init__(self, task_ids: set | None, loop: asyncio.AbstractEventLoop):
+        self.task_ids = task_ids
+        self.queue = asyncio.Queue()
+        self.loop = loop
+
+    def wants(self, task_id: str) -> bool:
+        return self.task_ids is None or task_id in self.task_ids
+
+
+class TaskEvents:
+    """
+    An in-process publish/subscribe hub for task status transitions.
+
+    The task runner publishes the status records it writes, and the streaming endpoints subscribe to the tasks
+    their clients follow.
+
+    Methods:
+        subscribe: Subscribes to the events of some tasks.
+        unsubscribe: Cancels a subscription.
+        publish: Publishes a task status record to its subscribers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+
+    def subscribe(self, task_ids: set | None = None) -> Subscription:
+        """
+        Subscribes to the events of some tasks. Must be called from the event loop of the subscriber.
+
+        Args:
+            task_ids (set, optional): The IDs of the tasks. Defaults to None (every task).
+
+        Returns:
+            Subscription: The subscription.
+        """
+        subscription = Subscription(task_ids, asyncio.get_running_loop())
+
+        with self._lock:
+            self._subscriptions.add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, record: TaskstatusRecord):
+        """
+        Publishes a task status record to its subscribers. Can be called from any thread.
+
+        Args:
+            record (TaskstatusRecord): The record that was written.
+
+        Returns:
+            None
+        """
+        event = status_event(record)
+
+        with self._lock:
+            subscriptions = [s for s in self._subscriptions if s.wants(event["task_id"])]
+
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.queue.put_nowait, event)
+            except RuntimeError:
+                # the loop of the subscriber is closed
+                self.unsubscribe(subscription)
+
+
+def status_event(record: TaskstatusRecord) -> dict:
+    """
+    Builds the event sent to the clients for a task status record.
+
+    Args:
+        record (TaskstatusRecord): The task status record.
+
+    Returns:
+        dict: The ``task_id``, ``status``, ``updated`` time and whether the task is ``finished``.
+    """
+    updated = record.updated or record.created or datetime.now()
+
+    return {"task_id": str(record.task_id),
+            "status": record.status,
+            "updated": updated.isoformat(),
+            "finished": record.status not in active_statuses}
@@ -1,30 +1,50 @@
 import sys
 import tomllib
+from functools import lru_cache
 from pathlib import Path
 
 import typer
 
 from eredesscraper._version import get_version
 
-project = tomllib.loads(Path(Path(__file__).parent.parent / "pyproject.toml").resolve().read_text())
+# the state of the program. The folder is created by the first file written into it
+ers_home = Path.home() / ".ers"
+db_path = ers_home / "ers.db"
+checkpoints_path = ers_home / "checkpoints.db"
 
-cli_header = f"""
+
+@lru_cache(maxsize=None)
+def project() -> dict:
+    """
+    Returns the project metadata of ``pyproject.toml``, read on first use.
+    """
+    return tomllib.loads(Path(Path(__file__).parent.parent / "pyproject.toml").resolve().read_text())
+
+
+def cli_header() -> str:
+    """
+    Returns the header of the CLI help: the name, version, authors, homepage and description of the project.
+    """
+    poetry = project()['tool']['poetry']
+
+    return f"""
 {typer.style("E-REDES Scraper",
              fg=typer.colors.BRIGHT_CYAN,
              bold=True)}
 {typer.style(f"Version: {typer.style(get_version(), underline=True)}",
              bold=True)}
-{typer.style(f"Authors: {project['tool']['poetry']['authors']}",
+{typer.style(f"Authors: {poetry['authors']}",
              bold=True)}
-{typer.style(f"Hompage: {typer.style(project['tool']['poetry']['homepage'], fg=typer.colors.CYAN, italic=True)}",
+{typer.style(f"Hompage: {typer.style(poetry['homepage'], fg=typer.colors.CYAN, italic=True)}",
              bold=True)}
 
-{project['tool']['poetry']['description']}
+{poetry['description']}
 """
 
-supported_workflows = ["current", "previous", "select"]
+supported_workflows = ["current", "previous", "select", "backfill", "sync"]
 
-supported_databases = ["influxdb"]
+# built-in sinks. Sinks installed by other packages are listed by `eredesscraper.sinks.available_sinks`
+supported_databases = ["influxdb", "duckdb", "parquet", "postgres"]
 
 if sys.platform == "win32":
     user_agent_list = [
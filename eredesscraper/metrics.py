@@ -0,0 +1,331 @@
+import math
+import threading
+import time
+from collections.abc import Callable
+
+# OpenMetrics text exposition format (https://openmetrics.io)
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# seconds, from the API requests up to the scrapes
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    A metric family: one sample (or histogram) per combination of label values.
+
+    Updating a metric takes a lock and a dictionary lookup, so the metrics stay on in production.
+
+    Args:
+        name (str): The name of the metric.
+        documentation (str): Its description.
+        labelnames (tuple, optional): The names of its labels.
+    """
+    type = "unknown"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects the labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self) -> list:
+        """
+        Returns the samples of the metric, as (suffix, label values, extra label, value) tuples.
+        """
+        with self._lock:
+            return [("", key, "", value) for key, value in self._values.items()]
+
+    def render(self) -> str:
+        lines = [f"# TYPE {self.name} {self.type}", f"# HELP {self.name} {_escape(self.documentation)}"]
+        lines += [f"{self.name}{suffix}{_labels(self.labelnames, key, extra)} {_number(value)}"
+                  for suffix, key, extra, value in self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """
+    A counter, only ever increased. Its samples are exposed with the ``_total`` suffix.
+    """
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> list:
+        return [("_total", key, extra, value) for _, key, extra, value in super().samples()]
+
+
+class Gauge(Metric):
+    """
+    A gauge, set to its current value, or read from a function when the metrics are collected.
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable | None):
+        """
+        Reads the value of the gauge from a function when the metrics are collected.
+
+        Args:
+            function (Callable | None): Returns the value, or a dict of values keyed by label values tuples. None
+                stops reading the function.
+
+        Returns:
+            None
+        """
+        self._function = function
+
+    def samples(self) -> list:
+        function = self._function
+        if function is None:
+            return super().samples()
+
+        try:
+            value = function()
+        except Exception:
+            # a failing collector must not break the others
+            return []
+
+        if isinstance(value, dict):
+            return [("", tuple(str(v) for v in key), "", v) for key, v in value.items()]
+        return [("", (), "", value)]
+
+
+class Histogram(Metric):
+    """
+    A histogram with fixed buckets, exposing its cumulative ``_bucket`` counts, ``_count`` and ``_sum``.
+
+    Args:
+        buckets (tuple, optional): The upper bounds of the buckets. Defaults to ``DEFAULT_BUCKETS``.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def time(self, **labels) -> "Timer":
+        return Timer(self, labels)
+
+    def samples(self) -> list:
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+
+        samples = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(("_bucket", key, f'le="{_number(float(bound))}"', cumulative))
+            samples.append(("_count", key, "", cumulative))
+            samples.append(("_sum", key, "", total))
+
+        return samples
+
+
+class Timer:
+    """
+    Observes the wall time of a ``with`` block into a histogram.
+    """
+
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    """
+    The metrics exposed by a process.
+
+    Methods:
+        register: Adds a metric.
+        render: Renders every metric in the OpenMetrics text format.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n# EOF\n"
+
+
+REGISTRY = Registry()
+
+http_request_duration = REGISTRY.register(Histogram(
+    "ers_http_request_duration_seconds", "Latency of the API requests, per route",
+    ("method", "route", "status")))
+queue_depth = REGISTRY.register(Gauge(
+    "ers_job_queue_depth", "Tasks waiting in the job queue"))
+scrapes_running = REGISTRY.register(Gauge(
+    "ers_scrapes_running", "Scrapes admitted and not finished yet, each running a browser unless served from the "
+                           "cache"))
+workers_busy = REGISTRY.register(Gauge(
+    "ers_workers_busy", "Worker processes of the pool running a job"))
+state_size = REGISTRY.register(Gauge(
+    "ers_state_db_bytes", "Size of the API state database files"))
+scrape_phase_duration = REGISTRY.register(Histogram(
+    "ers_scrape_phase_duration_seconds", "Duration of the phases of the workflows (browser, login, cpe, download, "
+                                         "parse, sinks)", ("phase",)))
+tasks = REGISTRY.register(Counter(
+    "ers_tasks", "Finished tasks, per final status (completed, completed with sink errors, failed)", ("status",)))
+task_failures = REGISTRY.register(Counter(
+    "ers_task_failures", "Failed tasks, per reason (captcha, login, other)", ("reason",)))
+sink_write_duration = REGISTRY.register(Histogram(
+    "ers_sink_write_duration_seconds", "Duration of the writes into the sinks", ("sink",)))
+sink_points = REGISTRY.register(Counter(
+    "ers_sink_points_written", "Data points written into the sinks", ("sink",)))
+sink_errors = REGISTRY.register(Counter(
+    "ers_sink_errors", "Failed writes into the sinks", ("sink",)))
+stage_utilization = REGISTRY.register(Gauge(
+    "ers_pipeline_stage_utilization", "Share of the wall time each stage (download, parse, sinks) of the last "
+                                      "multi-month pipeline was busy", ("stage",)))
+
+
+def session_stats(session) -> dict:
+    """
+    Extracts the measurements of a workflow run, to observe them in another process (see ``observe_task``).
+
+    Args:
+        session (ERSSession): The result of the workflow.
+
+    Returns:
+        dict: The phase timings, the sink results, the pipeline stages and the path to the CPU profile of a profiled
+        run, as plain JSON-serializable values.
+    """
+    profile = getattr(session, "profile", None)
+
+    return {"timings": dict(getattr(session, "timings", None) or {}),
+            "sinks": [{"sink": r.sink, "points": r.points, "elapsed": r.elapsed, "error": r.error}
+                      for r in getattr(session, "sinks", None) or []],
+            "stages": dict(getattr(session, "stages", None) or {}),
+            **({"profile": str(profile)} if profile else {})}
+
+
+def observe_task(status: str, failure: str = None, stats: dict = None):
+    """
+    Observes the outcome and the measurements of a finished task.
+
+    Args:
+        status (str): The final status of the task.
+        failure (str, optional): ``captcha`` or ``login`` if the task failed to log in.
+        stats (dict, optional): The measurements of the workflow (see ``session_stats``).
+
+    Returns:
+        None
+    """
+    failed = status.startswith("failed")
+    tasks.inc(status="failed" if failed else status)
+    if failed:
+        task_failures.inc(reason=failure or "other")
+
+    stats = stats or {}
+    for phase, seconds in (stats.get("timings") or {}).items():
+        scrape_phase_duration.observe(seconds, phase=phase)
+    for result in stats.get("sinks") or []:
+        sink_write_duration.observe(result["elapsed"], sink=result["sink"])
+        if result.get("error") is None:
+            sink_points.inc(result["points"], sink=result["sink"])
+        else:
+            sink_errors.inc(sink=result["sink"])
+    for stage, report in (stats.get("stages") or {}).items():
+        stage_utilization.set(report["utilization"], stage=stage)
+
+
+class RequestMetrics:
+    """
+    ASGI middleware observing the latency of the HTTP requests, labelled with their route template (e.g.
+    ``/status/{task_id}``) so the number of series stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = scope.get("route")
+            http_request_duration.observe(time.perf_counter() - start, method=scope["method"],
+                                          route=getattr(route, "path", "unmatched"), status=status[0])
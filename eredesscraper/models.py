@@ -8,6 +8,10 @@ from pydantic import BaseModel, Field
 
 from eredesscraper.meta import supported_workflows, supported_databases
 
+# a month, as YYYY-MM
+MONTH_PATTERN = r"^\d{4}-(0[1-9]|1[0-2])$"
+
+
 class ERSSession():
     """
     Represents an ERSSession object.
@@ -20,6 +24,13 @@ class ERSSession():
         staging_area (Path | None): The path to the staging area, or None if not available.
         status (str): The status of the session.
         timestamp (datetime): The timestamp of the session.
+        sinks (list): The ``SinkResult`` of each database the data was loaded into.
+        timings (dict): The wall time of each phase of the workflow (e.g. ``login``, ``parse``), in seconds.
+        stages (dict): The utilization of each stage of the pipeline of a multi-month workflow (see
+            ``eredesscraper.pipeline.Pipeline.report``).
+        watermark (datetime | None): The timestamp of the latest reading loaded, or None if none was parsed.
+        profile (Path | None): The CPU profile of the run (see ``eredesscraper.profiling``), or None if it was not
+            profiled.
 
     Methods:
         __str__(): Returns a string representation of the ERSSession object.
@@ -34,7 +45,8 @@ class ERSSession():
     """
 
     def __init__(self, session_id: str, workflow: str, databases: list, source_data: Path | None, status: str,
-                 timestamp: datetime):
+                 timestamp: datetime, sinks: list | None = None, timings: dict | None = None,
+                 stages: dict | None = None, watermark: datetime | None = None, profile: Path | None = None):
         self.session_id = session_id
         self.workflow = workflow
         self.databases = databases
@@ -42,9 +54,18 @@ class ERSSession():
         self.staging_area = source_data.parent if source_data else None
         self.status = status
         self.timestamp = timestamp
+        self.sinks = sinks or []
+        self.timings = timings or {}
+        self.stages = stages or {}
+        self.watermark = watermark
+        self.profile = profile
 
     def __str__(self):
-        return f"Session ID: {self.session_id}\nWorkflow: {self.workflow}\nDatabases: {self.databases}\nSource Data: {self.source_data}\nStaging Area: {self.staging_area}\nStatus: {self.status}\nTimestamp: {self.timestamp}\n"
+        sinks = "Sinks:\n" + "".join(f"  - {sink}\n" for sink in self.sinks) if self.sinks else ""
+        stages = "Stages:\n" + "".join(f"  - {name}: {stage['items']} items, {stage['busy']:.2f}s busy "
+                                       f"({stage['utilization']:.0%})\n"
+                                       for name, stage in self.stages.items()) if self.stages else ""
+        return f"Session ID: {self.session_id}\nWorkflow: {self.workflow}\nDatabases: {self.databases}\nSource Data: {self.source_data}\nStaging Area: {self.staging_area}\nStatus: {self.status}\nTimestamp: {self.timestamp}\n{sinks}{stages}"
 
     def __repr__(self):
         return f"ERSSession(session_id={self.session_id}, workflow={self.workflow}, databases={self.databases}, source_data={self.source_data}, staging_area={self.staging_area}, status={self.status}, timestamp={self.timestamp})"
@@ -119,6 +140,10 @@ class RunWorkflowRequest(BaseModel):
         year (int, optional): The year to load. Required for `select` workflow. Default is None.
         delta (bool, optional): If True, load only the most recent data points. Default is False.
         download (bool, optional): If True, keeps the source data file after loading. Default is False.
+        no_cache (bool, optional): If True, the data is always retrieved from E-REDES. Default is False.
+        start (str, optional): The first month to load, as YYYY-MM. Required for `backfill` workflow. Default is None.
+        end (str, optional): The last month to load by the `backfill` workflow, as YYYY-MM. Default is the current
+            month.
     """
     workflow: str = Query("current", description=f"Specify one of the supported workflows: {supported_workflows}")
     db: Optional[list[str]] = Query(None, description=f"Specify one of the supported databases: {supported_databases}")
@@ -126,6 +151,29 @@ class RunWorkflowRequest(BaseModel):
     year: Optional[int] = Query(None, description="Specify the year to load (YYYY). [Required for `select` workflow]")
     delta: Optional[bool] = Query(False, description="Load only the most recent data points")
     download: Optional[bool] = Query(False, description="If set, keeps the source data file after loading")
+    no_cache: Optional[bool] = Query(False, description="If set, bypasses the result cache")
+    start: Optional[str] = Query(None, pattern=MONTH_PATTERN,
+                                 description="Specify the first month to load (YYYY-MM). [Required for `backfill` "
+                                             "workflow]")
+    end: Optional[str] = Query(None, pattern=MONTH_PATTERN,
+                               description="Specify the last month to load (YYYY-MM). [Optional for `backfill` "
+                                           "workflow, defaults to the current month]")
+
+
+class BatchChild(BaseModel):
+    """
+    A Pydantic model representing a child task of a batch: the readings of one month of one CPE.
+
+    Attributes:
+        task_id (UUID): The unique identifier of the child task.
+        cpe (str): The CPE to load.
+        month (int): The month to load.
+        year (int): The year to load.
+    """
+    task_id: UUID
+    cpe: str
+    month: int
+    year: int
 
 
 class WorkflowRequestRecord(BaseModel):
@@ -140,6 +188,11 @@ class WorkflowRequestRecord(BaseModel):
         year (int, optional): The year that was loaded. Default is None.
         delta (bool, optional): If True, only the most recent data points were loaded. Default is False.
         download (bool, optional): If True, the source data file was kept after loading. Default is False.
+        no_cache (bool, optional): If True, the result cache was bypassed. Default is False.
+        start (str, optional): The first month loaded by a ``backfill`` task, as YYYY-MM. Default is None.
+        end (str, optional): The last month loaded by a ``backfill`` task, as YYYY-MM. Default is None.
+        profile (bool, optional): If True, the task is profiled. Default is False.
+        children (list, optional): The ``BatchChild`` tasks run by a ``batch`` task. Default is None.
     """
     task_id: UUID
     workflow: str
@@ -148,6 +201,91 @@ class WorkflowRequestRecord(BaseModel):
     year: Optional[int]
     delta: Optional[bool]
     download: Optional[bool]
+    no_cache: Optional[bool] = False
+    start: Optional[str] = None
+    end: Optional[str] = None
+    profile: Optional[bool] = False
+    children: Optional[list[BatchChild]] = None
+
+
+class RunBatchRequest(BaseModel):
+    """
+    A Pydantic model representing a request to load many months and CPEs at once.
+
+    The months are either listed in ``months``, or ranged from ``start`` to ``end`` (both included).
+
+    Attributes:
+        months (list, optional): The months to load, as ``YYYY-MM``. Default is None.
+        start (str, optional): The first month to load, as ``YYYY-MM``. Default is None.
+        end (str, optional): The last month to load, as ``YYYY-MM``. Default is the current month.
+        cpes (list, optional): The CPEs of the account to load. Default is the CPE of the config file.
+        db (list, optional): The databases to use. Default is None.
+        delta (bool, optional): If True, load only the most recent data points. Default is False.
+        download (bool, optional): If True, keeps the source data files after loading. Default is False.
+        no_cache (bool, optional): If True, the data is always retrieved from E-REDES. Default is False.
+    """
+    months: Optional[list[str]] = Field(None, examples=[["2023-11", "2023-12"]])
+    start: Optional[str] = Field(None, pattern=MONTH_PATTERN, examples=["2023-01"])
+    end: Optional[str] = Field(None, pattern=MONTH_PATTERN, examples=["2023-12"])
+    cpes: Optional[list[str]] = None
+    db: Optional[list[str]] = None
+    delta: Optional[bool] = False
+    download: Optional[bool] = False
+    no_cache: Optional[bool] = False
+
+
+class BatchResponse(BaseModel):
+    """
+    A Pydantic model representing a queued batch.
+
+    Attributes:
+        task_id (UUID): The unique identifier of the parent task.
+        status (str): The status of the parent task.
+        detail (str): Additional information about the request.
+        children (list[BatchChild]): The child tasks, one per month and CPE.
+    """
+    task_id: UUID
+    status: str
+    detail: str
+    children: list[BatchChild]
+
+
+class BatchChildStatus(BaseModel):
+    """
+    A Pydantic model representing the status of a child task of a batch.
+
+    Attributes:
+        task_id (UUID): The unique identifier of the child task.
+        cpe (str): The CPE loaded.
+        month (int): The month loaded.
+        year (int): The year loaded.
+        status (str): The status of the child task.
+        file_hash (str, optional): The hash of the task file in the file store, if any.
+    """
+    task_id: UUID
+    cpe: str
+    month: int
+    year: int
+    status: str
+    file_hash: Optional[str] = None
+
+
+class BatchStatusResponse(BaseModel):
+    """
+    A Pydantic model representing the aggregate progress of a batch.
+
+    Attributes:
+        task_id (UUID): The unique identifier of the parent task.
+        status (str): The status of the parent task.
+        total (int): The number of child tasks.
+        progress (dict): The number of child tasks per status (``queued``, ``running``, ``completed``, ``failed``).
+        children (list[BatchChildStatus]): The status of each child task.
+    """
+    task_id: UUID
+    status: str
+    total: int
+    progress: dict
+    children: list[BatchChildStatus]
 
 
 class TaskstatusRecord(BaseModel):
@@ -160,12 +298,167 @@ class TaskstatusRecord(BaseModel):
         file (str, optional): The file associated with the task. Default is None.
         created (datetime, optional): The creation time of the task. Default is None.
         updated (datetime, optional): The last update time of the task. Default is None.
+        file_hash (str, optional): The hash of the task file in the file store. Default is None.
+        profile (str, optional): The CPU profile of a task run with ``profile=1``, on the host that ran it. Default is
+            None.
     """
     task_id: UUID
     status: str
     file: Optional[bytes]
     created: Optional[datetime]
     updated: Optional[datetime]
+    file_hash: Optional[str] = None
+    profile: Optional[str] = None
+
+
+class JobRecord(BaseModel):
+    """
+    A Pydantic model representing a job of the task queue.
+
+    Attributes:
+        task_id (UUID): The unique identifier of the task run by the job.
+        state (str, optional): ``queued`` or ``leased``. Default is ``queued``.
+        worker (str, optional): The worker holding the lease. Default is None.
+        lease_expires (datetime, optional): When the lease expires, unless renewed. Default is None.
+        attempts (int, optional): The number of times the job was leased. Default is 0.
+        flight_key (str, optional): The key shared by identical requests. Default is None.
+        no_cache (bool, optional): If True, the job bypasses the result cache. Default is False.
+        range_start (str, optional): The first month loaded by a ``backfill`` job, as YYYY-MM. Default is None.
+        range_end (str, optional): The last month loaded by a ``backfill`` job, as YYYY-MM. Default is None.
+        profile (bool, optional): If True, the job is profiled. Default is False.
+    """
+    task_id: UUID
+    state: Optional[str] = "queued"
+    worker: Optional[str] = None
+    lease_expires: Optional[datetime] = None
+    attempts: Optional[int] = 0
+    flight_key: Optional[str] = None
+    no_cache: Optional[bool] = False
+    range_start: Optional[str] = None
+    range_end: Optional[str] = None
+    profile: Optional[bool] = False
+
+
+class CheckpointRecord(BaseModel):
+    """
+    A Pydantic model representing the checkpoint of a month loaded by the ``backfill`` workflow.
+
+    Attributes:
+        cpe (str): The CPE.
+        sinks (str): The databases the month was loaded into, sorted and comma-separated.
+        year (int): The year of the month.
+        month (int): The month.
+        state (str): ``loaded``, ``partial`` (the current month, loaded so far) or ``failed``.
+        attempts (int, optional): How many times the month was tried. Default is 1.
+        error (str, optional): The last failure. Default is None.
+        updated (datetime, optional): When the checkpoint was written. Default is None.
+    """
+    cpe: str
+    sinks: str
+    year: int
+    month: int
+    state: str
+    attempts: Optional[int] = 1
+    error: Optional[str] = None
+    updated: Optional[datetime] = None
+
+
+class BatchTaskRecord(BaseModel):
+    """
+    A Pydantic model representing the link between a batch and one of its child tasks.
+
+    Attributes:
+        batch_id (UUID): The unique identifier of the parent task of the batch.
+        task_id (UUID): The unique identifier of the child task.
+        cpe (str): The CPE loaded by the child task.
+        position (int): The position of the child task in the batch.
+    """
+    batch_id: UUID
+    task_id: UUID
+    cpe: str
+    position: int
+
+
+class BreakerRecord(BaseModel):
+    """
+    A Pydantic model representing the circuit breaker of an E-REDES account.
+
+    Attributes:
+        account (str): The account (NIF).
+        state (str, optional): ``closed``, ``open`` or ``half_open``. Default is ``closed``.
+        failures (int, optional): The consecutive captcha or login failures. Default is 0.
+        opens (int, optional): How many times in a row the breaker opened, which sets its cool-down. Default is 0.
+        retry_at (datetime, optional): When an open breaker lets a probe run. Default is None.
+        last_error (str, optional): The last failure. Default is None.
+        updated (datetime, optional): When the breaker last changed. Default is None.
+    """
+    account: str
+    state: Optional[str] = "closed"
+    failures: Optional[int] = 0
+    opens: Optional[int] = 0
+    retry_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+    updated: Optional[datetime] = None
+
+
+class JobLeaseRequest(BaseModel):
+    """
+    A Pydantic model representing a request of a remote worker about a job.
+
+    Attributes:
+        worker (str): The name of the worker.
+    """
+    worker: str
+
+
+class JobLease(BaseModel):
+    """
+    A Pydantic model representing a job leased to a remote worker.
+
+    Attributes:
+        job (WorkflowRequestRecord): The request of the task to run.
+        lease_seconds (float): The duration of the lease. The worker must renew it before it expires.
+    """
+    job: WorkflowRequestRecord
+    lease_seconds: float
+
+
+class TaskSummary(BaseModel):
+    """
+    A Pydantic model representing a task in the task listing.
+
+    Attributes:
+        task_id (UUID): The unique identifier of the task.
+        workflow (str): The workflow that was requested.
+        db (list, optional): The databases that were requested.
+        month (int, optional): The month that was requested.
+        year (int, optional): The year that was requested.
+        status (str): The status of the task.
+        file_hash (str, optional): The hash of the task file in the file store, if any.
+        created (datetime, optional): The creation time of the task.
+        updated (datetime, optional): The last update time of the task.
+    """
+    task_id: UUID
+    workflow: str
+    db: Optional[list]
+    month: Optional[int]
+    year: Optional[int]
+    status: str
+    file_hash: Optional[str]
+    created: Optional[datetime]
+    updated: Optional[datetime]
+
+
+class TaskListResponse(BaseModel):
+    """
+    A Pydantic model representing a page of the task listing.
+
+    Attributes:
+        tasks (list[TaskSummary]): The tasks, most recent first.
+        next_cursor (str, optional): The cursor of the next page, or None if this is the last page.
+    """
+    tasks: list[TaskSummary]
+    next_cursor: Optional[str]
 
 
 class ConfigLoadRequest(BaseModel):
@@ -214,12 +507,180 @@ class InfluxDB(BaseModel):
         bucket (str): The name of the bucket in the InfluxDB database.
         org (str): The name of the organization in the InfluxDB database.
         token (str): The authentication token for accessing the InfluxDB database.
+        rollups (bool, optional): If True, hourly, daily and monthly rollups are written alongside the raw points.
     """
     host: str
     port: int
     bucket: str
     org: str
     token: str
+    rollups: Optional[bool] = False
+
+
+class DuckDB(BaseModel):
+    """
+    Represents the DuckDB sink settings.
+
+    Attributes:
+        path (str, optional): The path to the DuckDB database file the readings are loaded into.
+        table (str, optional): The name of the readings table.
+    """
+    path: Optional[str] = None
+    table: Optional[str] = None
+
+
+class Parquet(BaseModel):
+    """
+    Represents the Parquet sink settings.
+
+    Attributes:
+        path (str, optional): The directory the Parquet files are written to.
+    """
+    path: Optional[str] = None
+
+
+class Postgres(BaseModel):
+    """
+    Represents a connection to a PostgreSQL (or TimescaleDB) database.
+
+    Attributes:
+        host (str): The hostname or IP address of the PostgreSQL server.
+        port (int): The port number of the PostgreSQL server.
+        dbname (str): The name of the database.
+        user (str): The user name.
+        password (str): The password of the user.
+        table (str, optional): The name of the readings table.
+        timescale (bool, optional): If True, the readings table is converted into a TimescaleDB hypertable.
+    """
+    host: str
+    port: int
+    dbname: str
+    user: str
+    password: str
+    table: Optional[str] = None
+    timescale: Optional[bool] = False
+
+
+class Retention(BaseModel):
+    """
+    Represents the retention policy of the API state database.
+
+    Attributes:
+        max_age_days (int, optional): Finished tasks older than this are deleted.
+        max_tasks (int, optional): Only the most recent tasks are kept.
+        max_file_mb (int, optional): The size budget of the stored task files, in MB.
+        interval_hours (float, optional): How often the API server applies the policy. Default is 24.
+    """
+    max_age_days: Optional[int] = None
+    max_tasks: Optional[int] = None
+    max_file_mb: Optional[int] = None
+    interval_hours: Optional[float] = 24
+
+
+class Cache(BaseModel):
+    """
+    Represents the result cache of the files retrieved from E-REDES.
+
+    Attributes:
+        enabled (bool, optional): Whether the cache is used. Default is True.
+        path (str, optional): The cache directory. Default is ``~/.ers/cache``.
+        ttl_minutes (float, optional): How long the data of a month that is not closed yet is cached. Default is 60.
+        max_mb (int, optional): The size budget of the cache, in MB. Default is None (no limit).
+    """
+    enabled: Optional[bool] = True
+    path: Optional[str] = None
+    ttl_minutes: Optional[float] = 60
+    max_mb: Optional[int] = None
+
+
+class Workers(BaseModel):
+    """
+    Represents the worker pool running the queued tasks of the API server.
+
+    Attributes:
+        processes (int, optional): The number of worker processes. 0 leaves the tasks to remote workers. Default is 2.
+        lease_seconds (int, optional): How long a worker holds a job without renewing its lease. Default is 60.
+        max_attempts (int, optional): How many times a job is leased before it is failed. Default is 3.
+    """
+    processes: Optional[int] = Field(2, ge=0)
+    lease_seconds: Optional[int] = Field(60, ge=5)
+    max_attempts: Optional[int] = Field(3, ge=1)
+
+
+class Breaker(BaseModel):
+    """
+    Represents the circuit breaker pausing the scrapes of an account after captcha or login failures.
+
+    Attributes:
+        threshold (int, optional): The consecutive failures that open the breaker. Default is 1.
+        cooldown_minutes (float, optional): The first cool-down of an open breaker, doubled every time it opens again
+            in a row. Default is 15.
+        max_cooldown_minutes (float, optional): The longest cool-down. Default is 720 (12 hours).
+    """
+    threshold: Optional[int] = Field(1, ge=1)
+    cooldown_minutes: Optional[float] = Field(15, gt=0)
+    max_cooldown_minutes: Optional[float] = Field(720, gt=0)
+
+
+class Limits(BaseModel):
+    """
+    Represents the admission control of the API server: how fast and how many scrapes run per E-REDES account (NIF)
+    and in total.
+
+    Attributes:
+        rate_per_minute (float, optional): The scrapes started per minute for an account. Default is 2.
+        burst (int, optional): The scrapes an account may start at once, above its rate. Default is 2.
+        max_concurrent (int, optional): The scrapes running at once for an account. Default is 1.
+        global_rate_per_minute (float, optional): The scrapes started per minute in total. Default is None (no limit).
+        global_burst (int, optional): The scrapes started at once in total, above the global rate. Default is None
+            (the global rate per minute, rounded up).
+        global_max_concurrent (int, optional): The scrapes running at once in total. Default is None (no limit).
+        max_queued (int, optional): The tasks waiting in the job queue before new ones are refused. Default is 100.
+    """
+    rate_per_minute: Optional[float] = Field(2, gt=0)
+    burst: Optional[int] = Field(2, ge=1)
+    max_concurrent: Optional[int] = Field(1, ge=1)
+    global_rate_per_minute: Optional[float] = Field(None, gt=0)
+    global_burst: Optional[int] = Field(None, ge=1)
+    global_max_concurrent: Optional[int] = Field(None, ge=1)
+    max_queued: Optional[int] = Field(100, ge=1)
+
+
+class Tracing(BaseModel):
+    """
+    Represents the tracing of the runs: the spans of the sampled runs are exported when the run is finished, with the
+    ID of its task as trace ID.
+
+    Attributes:
+        sample_rate (float, optional): The share of the runs traced, from 0 to 1. Default is 0 (disabled).
+        jsonl (str, optional): The JSONL file the spans are appended to. Default is None.
+        otlp_endpoint (str, optional): The OTLP/HTTP endpoint of an OpenTelemetry collector the spans are sent to,
+            e.g. ``http://localhost:4318``. Default is None.
+        service_name (str, optional): The ``service.name`` of the spans. Default is ``eredesscraper``.
+    """
+    sample_rate: Optional[float] = Field(0, ge=0, le=1)
+    jsonl: Optional[str] = None
+    otlp_endpoint: Optional[str] = None
+    service_name: Optional[str] = "eredesscraper"
+
+
+class ScheduleEntry(BaseModel):
+    """
+    Represents a workflow run periodically by the scheduler of the API server.
+
+    Attributes:
+        cron (str): When to run, as a 5-field cron expression (minute, hour, day of month, month, day of week).
+        workflow (str, optional): The workflow to run: ``current``, ``previous`` or ``sync``. Default is ``current``.
+        db (list, optional): The databases to load the readings into. Default is [].
+        delta (bool, optional): If True, load only the most recent data points. Default is True.
+        jitter_minutes (float, optional): The runs are delayed by up to this many minutes, by a fixed offset per CPE
+            and entry, to spread them. Default is 0.
+    """
+    cron: str
+    workflow: Optional[str] = Field("current", pattern="^(current|previous|sync)$")
+    db: Optional[list[str]] = []
+    delta: Optional[bool] = True
+    jitter_minutes: Optional[float] = Field(0, ge=0)
 
 
 class Config(BaseModel):
@@ -228,7 +689,27 @@ class Config(BaseModel):
     
     Attributes:
         eredes (Eredes): The Eredes configuration.
-        influxdb (InfluxDB): The InfluxDB configuration.
+        influxdb (InfluxDB, optional): The InfluxDB configuration.
+        duckdb (DuckDB, optional): The DuckDB sink configuration.
+        parquet (Parquet, optional): The Parquet sink configuration.
+        postgres (Postgres, optional): The PostgreSQL sink configuration.
+        retention (Retention, optional): The retention policy of the API state database.
+        workers (Workers, optional): The worker pool of the API server.
+        cache (Cache, optional): The result cache.
+        limits (Limits, optional): The rate and concurrency limits of the API server.
+        breaker (Breaker, optional): The circuit breaker of the accounts.
+        tracing (Tracing, optional): The tracing of the runs.
+        schedule (list, optional): The workflows run periodically by the API server (``ScheduleEntry``).
     """
     eredes: Eredes
-    influxdb: InfluxDB
+    influxdb: Optional[InfluxDB] = None
+    duckdb: Optional[DuckDB] = None
+    parquet: Optional[Parquet] = None
+    postgres: Optional[Postgres] = None
+    retention: Optional[Retention] = None
+    workers: Optional[Workers] = None
+    cache: Optional[Cache] = None
+    limits: Optional[Limits] = None
+    breaker: Optional[Breaker] = None
+    tracing: Optional[Tracing] = None
+    schedule: Optional[list[ScheduleEntry]] = None
@@ -0,0 +1,161 @@
+import contextvars
+import queue
+import threading
+import time
+from collections.abc import Iterable
+
+# items waiting between two stages: enough to keep the next stage busy, without buffering the whole run
+DEFAULT_MAXSIZE = 2
+
+_done = object()
+
+
+class Pipeline:
+    """
+    A producer/consumer pipeline: the items fed into it go through its stages in order, each stage running in its
+    own thread and connected to the next one by a bounded queue.
+
+    The items are fed from the calling thread (e.g. the downloads of a browser session, which cannot leave the
+    thread that started it), so the first stage works on an item while the next one is being produced. A full queue
+    blocks the stage before it, so at most ``maxsize`` items wait between two stages.
+
+    The stage functions are expected to handle their errors: an exception raised by a stage drops the item, and is
+    kept in ``errors``.
+
+    Args:
+        stages (list): The (name, function) of each stage. Each function takes the item returned by the stage
+            before it.
+        feeder (str, optional): The name of the stage feeding the pipeline. Defaults to ``feed``.
+        maxsize (int, optional): The capacity of the queues. Defaults to ``DEFAULT_MAXSIZE``.
+
+    Methods:
+        start: Starts the stage threads.
+        feed: Feeds the items of an iterable, producing them in the calling thread.
+        put: Feeds a single item.
+        close: Waits for the items fed to go through every stage, and stops the stage threads.
+        report: Returns the utilization of each stage.
+    """
+
+    def __init__(self, stages: list, feeder: str = "feed", maxsize: int = DEFAULT_MAXSIZE):
+        self.names = [feeder] + [name for name, _ in stages]
+        self.functions = [function for _, function in stages]
+        self.queues = [queue.Queue(maxsize) for _ in stages]
+        self.busy = {name: 0.0 for name in self.names}
+        self.items = {name: 0 for name in self.names}
+        self.errors = []
+        self.started = None
+        self.elapsed = None
+        self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        """
+        Starts the stage threads.
+
+        Returns:
+            Pipeline: The pipeline itself.
+        """
+        self.started = time.perf_counter()
+        # the stages run in a copy of the context of the caller, e.g. within its tracing span
+        self._threads = [threading.Thread(target=contextvars.copy_context().run, args=(self._run, i),
+                                          name=f"ers-pipeline-{self.names[i + 1]}", daemon=True)
+                         for i in range(len(self.functions))]
+        for thread in self._threads:
+            thread.start()
+
+        return self
+
+    def feed(self, items: Iterable):
+        """
+        Feeds the items of an iterable. The time spent producing the items counts as the busy time of the feeder,
+        the time spent waiting for room in the first queue does not.
+
+        Args:
+            items (Iterable): The items. An exception raised while producing them is propagated.
+
+        Returns:
+            None
+        """
+        items = iter(items)
+
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            finally:
+                self.busy[self.names[0]] += time.perf_counter() - started
+
+            self.put(item)
+
+    def put(self, item):
+        if self.queues:
+            self.queues[0].put(item)
+        self.items[self.names[0]] += 1
+
+    def _run(self, index: int):
+        name, function = self.names[index + 1], self.functions[index]
+        inbox = self.queues[index]
+        outbox = self.queues[index + 1] if index + 1 < len(self.queues) else None
+
+        while True:
+            item = inbox.get()
+            if item is _done:
+                if outbox is not None:
+                    outbox.put(_done)
+                return
+
+            started = time.perf_counter()
+            try:
+                item = function(item)
+            except Exception as e:
+                self.errors.append(e)
+                continue
+            finally:
+                self.busy[name] += time.perf_counter() - started
+                self.items[name] += 1
+
+            if outbox is not None:
+                outbox.put(item)
+
+    def close(self):
+        """
+        Waits for the items fed to go through every stage, and stops the stage threads.
+
+        Returns:
+            None
+        """
+        if self.started is None or self.elapsed is not None:
+            return
+
+        if self.queues:
+            self.queues[0].put(_done)
+        for thread in self._threads:
+            thread.join()
+
+        self.elapsed = time.perf_counter() - self.started
+
+    def report(self) -> dict:
+        """
+        Returns the utilization of each stage: the items it processed, the time it was busy (in seconds) and the
+        share of the wall time of the pipeline it was busy. A stage close to 1 is the bottleneck of the pipeline.
+
+        Returns:
+            dict: The ``items``, ``busy`` and ``utilization`` of each stage, by name.
+        """
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - (self.started or 0)
+
+        return {name: {"items": self.items[name],
+                       "busy": round(self.busy[name], 6),
+                       "utilization": round(min(self.busy[name] / elapsed, 1.0), 4) if elapsed > 0 else 0.0}
+                for name in self.names}
+
+
+def format_report(report: dict) -> str:
+    return ", ".join(f"{name} {stage['utilization']:.0%} busy" for name, stage in report.items())
@@ -0,0 +1,128 @@
+import cProfile
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+# files written next to the session output
+PROFILE_FILE = "profile.pstats"
+SUMMARY_FILE = "profile.json"
+
+# functions and allocation sites listed in the summary
+TOP_FUNCTIONS = 25
+TOP_ALLOCATIONS = 10
+
+# the profilers hook every thread of the process, so a single run is profiled at a time
+_lock = threading.Lock()
+
+
+class RunProfile:
+    """
+    The profile of a run: a CPU profile of every thread it started, and its peak memory.
+
+    Attributes:
+        directory (Path): The folder the profile is written into.
+        path (Path): The CPU profile, in the ``pstats`` format (``python -m pstats``, snakeviz, ...).
+        summary (Path): The wall time, the peak memory, the functions with the most cumulative time and the
+            allocation sites holding the most memory at the end of the run, as JSON.
+        seconds (float): The wall time of the run, once finished.
+        peak_memory (int): The peak memory allocated by Python objects during the run, in bytes, once finished.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.path = self.directory / PROFILE_FILE
+        self.summary = self.directory / SUMMARY_FILE
+        self.seconds = None
+        self.peak_memory = None
+
+
+def _stats(profilers: list) -> pstats.Stats:
+    stats = pstats.Stats(profilers[0])
+    for profiler in profilers[1:]:
+        try:
+            stats.add(profiler)
+        except TypeError:
+            # a thread that never ran any Python code
+            pass
+    return stats
+
+
+def top_functions(stats: pstats.Stats, limit: int = TOP_FUNCTIONS) -> list:
+    """
+    Returns the functions with the most cumulative time of a profile.
+
+    Args:
+        stats (pstats.Stats): The profile.
+        limit (int, optional): The number of functions. Defaults to ``TOP_FUNCTIONS``.
+
+    Returns:
+        list: The ``function`` (name, file and line), ``calls``, ``tottime`` and ``cumtime`` of each function.
+    """
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [{"function": f"{name} ({file}:{line})", "calls": calls, "tottime": round(tottime, 6),
+             "cumtime": round(cumtime, 6)}
+            for (file, line, name), (_, calls, tottime, cumtime, _) in rows]
+
+
+@contextmanager
+def profile_run(directory: Path):
+    """
+    Profiles the code run in its block: the CPU time of the calling thread and of the threads it starts (e.g. the
+    pipeline stages and the sink pool), and the memory allocated meanwhile (``tracemalloc``). The profile is written
+    once the block is finished, even if it failed.
+
+    Profiling slows the run down, tracemalloc by a factor of 2 or more: it is meant for debugging runs.
+
+    Args:
+        directory (Path): The folder to write the profile into, created if needed.
+
+    Yields:
+        RunProfile: The profile, complete once the block is finished.
+    """
+    profile = RunProfile(directory)
+    profilers = [cProfile.Profile()]
+
+    def hook(*args):
+        # called by the first event of a new thread: profile it from there on
+        profiler = cProfile.Profile()
+        profilers.append(profiler)
+        profiler.enable()
+
+    with _lock:
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+
+        started = time.perf_counter()
+        threading.setprofile(hook)
+        profilers[0].enable()
+        try:
+            yield profile
+        finally:
+            profilers[0].disable()
+            threading.setprofile(None)
+            profile.seconds = time.perf_counter() - started
+
+            profile.peak_memory = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot()
+            if not tracing:
+                tracemalloc.stop()
+
+            stats = _stats(profilers)
+            profile.directory.mkdir(parents=True, exist_ok=True)
+            stats.dump_stats(profile.path)
+
+            allocations = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)]) \
+                .statistics("lineno")[:TOP_ALLOCATIONS]
+            profile.summary.write_text(json.dumps({
+                "seconds": round(profile.seconds, 6),
+                "peak_memory_bytes": profile.peak_memory,
+                "profile": PROFILE_FILE,
+                "functions": top_functions(stats),
+                "allocations": [{"line": str(stat.traceback[0]), "bytes": stat.size, "blocks": stat.count}
+                                for stat in allocations]}, indent=2))
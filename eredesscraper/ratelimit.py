@@ -0,0 +1,255 @@
+import math
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from eredesscraper.models import Limits
+from eredesscraper.utils import parse_config
+
+
+class RateLimited(Exception):
+    """
+    Raised when a scrape is not admitted.
+
+    Attributes:
+        retry_after (float): How long to wait before trying again, in seconds.
+    """
+
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    """
+    A token bucket: ``rate`` tokens are added per second, up to ``burst`` tokens.
+
+    Args:
+        rate (float): The tokens added per second.
+        burst (int): The capacity of the bucket.
+        clock (Callable): The monotonic clock of the bucket. Defaults to ``time.monotonic``.
+
+    Methods:
+        wait: Returns how long until a token is available.
+        take: Takes a token.
+        refund: Returns a token taken.
+        resize: Changes the rate and the capacity of the bucket.
+    """
+
+    def __init__(self, rate: float, burst: int, clock: Callable = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self) -> float:
+        """
+        Returns how long until a token is available, in seconds. 0 if one is available now.
+        """
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    def refund(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def resize(self, rate: float, burst: int):
+        self._refill()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = min(self.tokens, burst)
+
+
+class Permit:
+    """
+    The admission of a scrape: it holds a concurrency slot of its account until released.
+
+    Attributes:
+        account (str | None): The account the scrape runs for.
+    """
+
+    def __init__(self, limiter: "RateLimiter", account: str | None):
+        self.limiter = limiter
+        self.account = account
+        self.released = False
+
+    def release(self, refund: bool = False):
+        """
+        Releases the concurrency slot. Releasing a permit twice has no effect.
+
+        Args:
+            refund (bool, optional): Also return the rate tokens, when no scrape was started after all.
+
+        Returns:
+            None
+        """
+        self.limiter._release(self, refund)
+
+
+class RateLimiter:
+    """
+    Admission control of the scrapes: token-bucket rate limits and concurrency limits, per E-REDES account (NIF)
+    and in total.
+
+    Bursts of logins into the same account trigger the E-REDES captcha, so every scrape started by the API server
+    (``/run``, the worker pool and the remote workers) acquires a ``Permit`` first, and releases it when the scrape
+    is finished.
+
+    Args:
+        limits (Limits): The limits.
+        clock (Callable): The monotonic clock of the token buckets. Defaults to ``time.monotonic``.
+
+    Methods:
+        acquire: Admits a scrape, or raises ``RateLimited``.
+        check_queue: Admits a task into the job queue, or raises ``RateLimited``.
+        running: Returns the number of scrapes admitted and not released yet.
+        update: Applies new limits.
+    """
+
+    def __init__(self, limits: Limits = None, clock: Callable = time.monotonic):
+        self.limits = limits or Limits()
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._running = {}
+        self._global = None
+        self._set_global()
+
+    def _set_global(self):
+        if not self.limits.global_rate_per_minute:
+            self._global = None
+            return
+
+        rate = self.limits.global_rate_per_minute / 60
+        burst = self.limits.global_burst or math.ceil(self.limits.global_rate_per_minute)
+
+        if self._global is None:
+            self._global = TokenBucket(rate, burst, self.clock)
+        else:
+            self._global.resize(rate, burst)
+
+    def update(self, limits: Limits = None):
+        """
+        Applies new limits, e.g. after the config file changed. The tokens left in the buckets are kept (up to
+        their new capacity), as well as the scrapes running.
+
+        Args:
+            limits (Limits, optional): The new limits. Defaults to ``Limits()``.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.limits = limits or Limits()
+            self._set_global()
+            for bucket in self._buckets.values():
+                bucket.resize(self.limits.rate_per_minute / 60, self.limits.burst)
+
+    def _bucket(self, account: str) -> TokenBucket:
+        if account not in self._buckets:
+            self._buckets[account] = TokenBucket(self.limits.rate_per_minute / 60, self.limits.burst, self.clock)
+        return self._buckets[account]
+
+    def running(self, account: str = None) -> int:
+        with self._lock:
+            if account is None:
+                return sum(self._running.values())
+            return self._running.get(account, 0)
+
+    def acquire(self, account: str | None) -> Permit:
+        """
+        Admits a scrape for an account: takes a token from the bucket of the account and from the global bucket, and
+        a concurrency slot of both. Nothing is taken if the scrape is not admitted.
+
+        Args:
+            account (str | None): The account (NIF) the scrape runs for. None only applies the global limits.
+
+        Returns:
+            Permit: The admission, to release once the scrape is finished.
+
+        Raises:
+            RateLimited: If a limit is reached.
+        """
+        # when a concurrency limit is reached, a slot is expected to be released within one rate period
+        period = 60 / self.limits.rate_per_minute
+
+        with self._lock:
+            total = sum(self._running.values())
+
+            if self.limits.global_max_concurrent and total >= self.limits.global_max_concurrent:
+                raise RateLimited(f"{total} scrapes are already running", period)
+
+            if account is not None and self._running.get(account, 0) >= self.limits.max_concurrent:
+                raise RateLimited(f"{self._running[account]} scrape(s) already running for this account", period)
+
+            buckets = [self._global] if self._global is not None else []
+            if account is not None:
+                buckets.append(self._bucket(account))
+
+            wait = max((bucket.wait() for bucket in buckets), default=0)
+            if wait > 0:
+                raise RateLimited("Too many scrapes started", wait)
+
+            for bucket in buckets:
+                bucket.take()
+            self._running[account] = self._running.get(account, 0) + 1
+
+        return Permit(self, account)
+
+    def check_queue(self, queued: int):
+        """
+        Admits a task into the job queue.
+
+        Args:
+            queued (int): The number of tasks already queued.
+
+        Returns:
+            None
+
+        Raises:
+            RateLimited: If the queue is full. The retry delay is the time the account takes to start enough of the
+            queued scrapes.
+        """
+        if queued >= self.limits.max_queued:
+            raise RateLimited(f"The job queue is full ({queued} tasks queued)",
+                              (queued - self.limits.max_queued + 1) * 60 / self.limits.rate_per_minute)
+
+    def _release(self, permit: Permit, refund: bool):
+        with self._lock:
+            if permit.released:
+                return
+            permit.released = True
+
+            self._running[permit.account] -= 1
+            if not self._running[permit.account]:
+                del self._running[permit.account]
+
+            if refund:
+                if self._global is not None:
+                    self._global.refund()
+                if permit.account is not None:
+                    self._bucket(permit.account).refund()
+
+
+def config_account(config_path: Path) -> str | None:
+    """
+    Returns the E-REDES account (NIF) of a config file, or None if the config file cannot be read.
+    """
+    try:
+        return str(parse_config(config_path)["eredes"]["nif"])
+    except (AssertionError, FileNotFoundError, KeyError, TypeError):
+        return None
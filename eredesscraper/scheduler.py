@@ -0,0 +1,267 @@
+import hashlib
+import threading
+from collections.abc import Callable
+from datetime import datetime, timedelta
+
+from eredesscraper.models import ScheduleEntry
+
+_aliases = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+}
+
+_names = {
+    3: {name: i + 1 for i, name in enumerate(["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct",
+                                              "nov", "dec"])},
+    4: {name: i for i, name in enumerate(["sun", "mon", "tue", "wed", "thu", "fri", "sat"])},
+}
+
+# (first, last) value of each field: minute, hour, day of month, month, day of week
+_ranges = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+
+class CronExpression:
+    """
+    A 5-field cron expression: minute, hour, day of month, month and day of week.
+
+    Fields accept ``*``, values, ranges (``1-5``), lists (``1,15``), steps (``*/15``, ``0-30/10``) and the names of
+    the months and days of the week (``jan``, ``mon``). The ``@hourly``, ``@daily``, ``@weekly``, ``@monthly`` and
+    ``@yearly`` aliases are supported. As in cron, when both the day of month and the day of week are restricted, a
+    day matching either of them matches.
+
+    Args:
+        expression (str): The cron expression.
+
+    Raises:
+        ValueError: If the expression is invalid.
+
+    Methods:
+        matches: Checks if a time matches the expression.
+        next: Returns the first time matching the expression after a given time.
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = _aliases.get(expression.strip().lower(), expression).split()
+
+        if len(fields) != 5:
+            raise ValueError(f"Invalid cron expression {expression!r}: expected 5 fields")
+
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse(field, i) for i, field in enumerate(fields))
+        # 7 is Sunday as well
+        if 7 in self.weekdays:
+            self.weekdays = (self.weekdays - {7}) | {0}
+
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    def _parse(self, field: str, index: int) -> set:
+        first, last = _ranges[index]
+        values = set()
+
+        for part in field.lower().split(","):
+            span, _, step = part.partition("/")
+
+            try:
+                step = int(step) if step else 1
+                if span == "*":
+                    start, end = first, last
+                elif "-" in span:
+                    start, end = (self._value(v, index) for v in span.split("-", 1))
+                else:
+                    start = end = self._value(span, index)
+                    if step != 1:
+                        end = last
+            except ValueError:
+                raise ValueError(f"Invalid cron expression {self.expression!r}: {part!r}")
+
+            if not first <= start <= end <= last or step < 1:
+                raise ValueError(f"Invalid cron expression {self.expression!r}: {part!r} is out of range")
+
+            values.update(range(start, end + 1, step))
+
+        return values
+
+    @staticmethod
+    def _value(value: str, index: int) -> int:
+        names = _names.get(index, {})
+        return names[value] if value in names else int(value)
+
+    def _day_matches(self, when: datetime) -> bool:
+        day = when.day in self.days
+        # cron counts the days of the week from Sunday
+        weekday = (when.weekday() + 1) % 7 in self.weekdays
+
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def matches(self, when: datetime) -> bool:
+        return (when.minute in self.minutes and when.hour in self.hours and when.month in self.months
+                and self._day_matches(when))
+
+    def next(self, after: datetime) -> datetime:
+        """
+        Returns the first time matching the expression, strictly after ``after``.
+
+        Args:
+            after (datetime): The time to start from.
+
+        Returns:
+            datetime: The next matching time, to the minute.
+
+        Raises:
+            ValueError: If no time matches the expression (e.g. ``0 0 30 2 *``).
+        """
+        when = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # every valid expression matches within 4 years (29 February)
+        limit = when + timedelta(days=4 * 366 + 1)
+
+        while when < limit:
+            if when.month not in self.months:
+                when = datetime(when.year + when.month // 12, when.month % 12 + 1, 1)
+            elif not self._day_matches(when):
+                when = datetime(when.year, when.month, when.day) + timedelta(days=1)
+            elif when.hour not in self.hours:
+                when = when.replace(minute=0) + timedelta(hours=1)
+            elif when.minute not in self.minutes:
+                when += timedelta(minutes=1)
+            else:
+                return when
+
+        raise ValueError(f"The cron expression {self.expression!r} never matches")
+
+
+def jitter_offset(entry: ScheduleEntry, cpe: str, index: int) -> timedelta:
+    """
+    Returns the fixed delay of the runs of a schedule entry, between 0 and its ``jitter_minutes``.
+
+    The delay is derived from the CPE and the entry, so the runs of different CPEs and entries sharing a cron
+    expression are spread over the jitter window, while each one keeps a regular period.
+
+    Args:
+        entry (ScheduleEntry): The schedule entry.
+        cpe (str): The CPE the entry runs for.
+        index (int): The position of the entry in the schedule.
+
+    Returns:
+        timedelta: The delay.
+    """
+    window = int(entry.jitter_minutes * 60)
+    if not window:
+        return timedelta()
+
+    digest = hashlib.sha256(f"{cpe}|{index}|{entry.cron}|{entry.workflow}".encode()).digest()
+    return timedelta(seconds=int.from_bytes(digest[:8], "big") % window)
+
+
+class Scheduler:
+    """
+    Runs workflows periodically inside the API server (``schedule`` config section).
+
+    Each entry is queued on its cron expression, delayed by its jitter offset (see ``jitter_offset``), into the job
+    queue of the server. The runs then reuse the warm worker processes, the rate limits and the circuit breaker of
+    the server, instead of starting a new process per run. A run is skipped while the previous run for the same CPE
+    is still queued or running.
+
+    Args:
+        entries (list): The ``ScheduleEntry`` of each workflow.
+        cpe (str): The CPE the workflows run for.
+        enqueue (Callable): Queues the workflow of an entry, and returns the ID of its task.
+        is_active (Callable): Checks if a task is still queued or running, given its ID.
+        clock (Callable): Returns the current time. Defaults to ``datetime.now``.
+
+    Methods:
+        start: Starts the scheduler thread.
+        stop: Stops the scheduler thread.
+        run_pending: Queues the entries that are due.
+    """
+
+    def __init__(self, entries: list, cpe: str, enqueue: Callable, is_active: Callable,
+                 clock: Callable = datetime.now):
+        self.entries = list(entries)
+        self.cpe = cpe
+        self.enqueue = enqueue
+        self.is_active = is_active
+        self.clock = clock
+        self.crons = [CronExpression(entry.cron) for entry in self.entries]
+        self.offsets = [jitter_offset(entry, cpe, i) for i, entry in enumerate(self.entries)]
+        now = clock()
+        # the next cron time of each entry, before its jitter offset
+        self.slots = [cron.next(now - offset) for cron, offset in zip(self.crons, self.offsets)]
+        self.last_task = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def due(self, index: int) -> datetime:
+        return self.slots[index] + self.offsets[index]
+
+    def start(self):
+        """
+        Starts the scheduler thread.
+
+        Returns:
+            Scheduler: The scheduler itself.
+        """
+        if self.entries and (self._thread is None or not self._thread.is_alive()):
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="ers-scheduler", daemon=True)
+            self._thread.start()
+
+        return self
+
+    def stop(self, timeout: float = None):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run_pending(self, now: datetime = None) -> list:
+        """
+        Queues the entries that are due, and schedules their next run.
+
+        Args:
+            now (datetime, optional): The current time. Defaults to the time of the clock.
+
+        Returns:
+            list: The IDs of the tasks queued.
+        """
+        now = now or self.clock()
+        queued = []
+
+        for i, entry in enumerate(self.entries):
+            if self.due(i) > now:
+                continue
+
+            # runs missed while the server was busy (or stopped) are not caught up
+            while self.due(i) <= now:
+                self.slots[i] = self.crons[i].next(self.slots[i])
+
+            if self.last_task is not None and self.is_active(self.last_task):
+                print(f"⏭️\tSkipped the scheduled {entry.workflow} workflow for {self.cpe}: the previous run "
+                      f"{self.last_task} is still in progress")
+                continue
+
+            try:
+                self.last_task = str(self.enqueue(entry))
+            except Exception as e:
+                print(f"💥\tFailed to queue the scheduled {entry.workflow} workflow for {self.cpe}: {e}")
+                continue
+
+            queued.append(self.last_task)
+
+        return queued
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_pending()
+
+            wait = min(self.due(i) for i in range(len(self.entries))) - self.clock()
+            # wakes up at least every minute, so changes of the system clock are caught up
+            self._stop.wait(min(max(wait.total_seconds(), 0), 60))
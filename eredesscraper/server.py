@@ -1,6 +1,6 @@
 import uvicorn
 
-from eredesscraper.backend import db_path
+from eredesscraper.meta import db_path
 from eredesscraper.utils import db_conn
 
 
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import threading
+from collections.abc import Callable
+from concurrent.futures import Future
+from datetime import date
+
+from eredesscraper.backend import active_statuses
+from eredesscraper.models import RunWorkflowRequest, TaskstatusRecord
+from eredesscraper.utils import workflow_period
+
+
+def flight_key(request: RunWorkflowRequest, cpe: str, today: date = None) -> str:
+    """
+    Builds the key identifying the requests that share a single run.
+
+    Requests are normalized first: e.g. a ``select`` request for the current month has the same key as a ``current``
+    request, and a ``backfill`` request is identified by its range of months. The databases and the delta, download
+    and cache options are part of the key, since a shared run only writes into the databases of the request that
+    started it.
+
+    Args:
+        request (RunWorkflowRequest): The workflow request.
+        cpe (str): The CPE the workflow is run for.
+        today (date, optional): The current date. Defaults to today.
+
+    Returns:
+        str: The SHA-256 hex digest of the normalized request.
+    """
+    if request.workflow == "backfill":
+        today = today or date.today()
+        period = {"workflow": "backfill", "start": request.start, "end": request.end or f"{today:%Y-%m}"}
+    elif request.workflow == "sync":
+        # the months are derived from the databases, which are part of the key
+        period = {"workflow": "sync"}
+    else:
+        year, month = workflow_period(request.workflow, request.month, request.year, today)
+        period = {"year": year, "month": month}
+
+    normalized = {"cpe": cpe,
+                  **period,
+                  "db": sorted(set(request.db or [])),
+                  "delta": bool(request.delta),
+                  "download": bool(request.download),
+                  "no_cache": bool(request.no_cache)}
+
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+
+class Flight:
+    """
+    A run shared by identical requests.
+
+    Attributes:
+        key (str): The key of the requests sharing the run.
+        task_id (str): The ID of the task running the workflow.
+        future (Future): Resolves to the final ``TaskstatusRecord`` of the task.
+    """
+
+    def __init__(self, key: str, task_id: str):
+        self.key = key
+        self.task_id = str(task_id)
+        self.future = Future()
+        self.started = threading.Event()
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight workflow requests into a single run.
+
+    The first request for a key starts a task, and the requests made with the same key while it is queued or
+    running attach to it instead of starting another browser (and login). The flights are resolved with the final
+    status record of their task, as it is written (see ``resolve``).
+
+    Methods:
+        attach: Attaches to the in-flight task of a key, or starts one.
+        resolve: Resolves the flight of a finished task.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._tasks = {}
+
+    def __len__(self):
+        return len(self._flights)
+
+    def attach(self, key: str, task_id: str, start: Callable, find: Callable = None) -> tuple:
+        """
+        Attaches to the in-flight task of a key, or starts one.
+
+        Args:
+            key (str): The key of the request (see ``flight_key``).
+            task_id (str): The ID of the task to start if none is in flight.
+            start (Callable): Starts the task, given its ID. Called at most once per key at a time.
+            find (Callable, optional): Returns the ID of an unfinished task of the key, e.g. queued before a restart,
+                or None.
+
+        Returns:
+            tuple: The ``Flight``, with its task started, and True if it was started by this call, False if it was
+            attached to.
+
+        Raises:
+            Exception: The exception raised while starting the task.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+
+            if leader:
+                # looked up under the lock: the found task cannot finish before its flight is registered
+                found = find() if find is not None else None
+                flight = Flight(key, found or task_id)
+                self._flights[key] = flight
+                self._tasks[flight.task_id] = flight
+
+                if found is not None:
+                    flight.started.set()
+                    return flight, False
+
+        if not leader:
+            flight.started.wait()
+            if flight.future.done() and flight.future.exception() is not None:
+                raise flight.future.exception()
+            return flight, False
+
+        # started outside the lock: starting a task waits for the state database writer, which resolves the flights
+        try:
+            start(task_id)
+        except Exception as e:
+            with self._lock:
+                self._flights.pop(key, None)
+                self._tasks.pop(flight.task_id, None)
+            flight.future.set_exception(e)
+            raise
+        finally:
+            flight.started.set()
+
+        return flight, True
+
+    def resolve(self, record: TaskstatusRecord):
+        """
+        Resolves the flight of a task once it is finished. Called with every task status record written.
+
+        Args:
+            record (TaskstatusRecord): The status record written.
+
+        Returns:
+            None
+        """
+        if record.status in active_statuses:
+            return
+
+        with self._lock:
+            flight = self._tasks.pop(str(record.task_id), None)
+            if flight is None:
+                return
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+        flight.future.set_result(record)
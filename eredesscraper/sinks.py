@@ -0,0 +1,575 @@
+import contextvars
+import datetime
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from importlib.metadata import entry_points
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+import typer
+from pandas.tseries.frequencies import to_offset
+from pytz import UTC
+
+from eredesscraper.db_clients import InfluxDB
+from eredesscraper.tracing import span
+from eredesscraper.utils import compute_rollups, parse_readings_influx, rollup_window_start, rollup_windows
+
+# entry point group used to discover third-party sinks
+SINK_ENTRY_POINT_GROUP = "eredesscraper.sinks"
+
+# timestamp returned by sinks that hold no data points for a CPE (same as ``InfluxDB.get_last_insert``)
+EMPTY_SINK_TIMESTAMP = datetime.datetime(1989, 5, 11, 0, 0, 0, tzinfo=UTC)
+
+
+class SinkError(Exception):
+    pass
+
+
+class ReadingsBatch:
+    """
+    An immutable batch of parsed readings shared by every sink of a run.
+
+    The source file is parsed once and the resulting DataFrame is handed to all the sinks. Sinks must treat the
+    data as read-only: ``frame`` returns a shallow copy, so column assignments or re-indexing done by a sink do
+    not leak into the other sinks writing the same batch concurrently.
+
+    Attributes:
+        cpe (str): The CPE code of the readings.
+        source (Path | None): The file the readings were parsed from, if any.
+        frame (pd.DataFrame): The readings, indexed by ``date_time`` (UTC), with ``consumption`` and ``cpe`` columns.
+    """
+    __slots__ = ("_frame", "_cpe", "_source")
+
+    def __init__(self, frame: pd.DataFrame, cpe: str, source: Path | None = None):
+        object.__setattr__(self, "_frame", frame)
+        object.__setattr__(self, "_cpe", cpe)
+        object.__setattr__(self, "_source", source)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("ReadingsBatch is immutable")
+
+    def __len__(self):
+        return len(self._frame)
+
+    def __repr__(self):
+        return f"ReadingsBatch(cpe={self._cpe}, source={self._source}, points={len(self._frame)})"
+
+    @classmethod
+    def from_file(cls, file_path: Path, cpe_code: str) -> "ReadingsBatch":
+        """
+        Parses an E-REDES readings file into a batch.
+
+        Args:
+            file_path (pathlib.Path): The XLSX file retrieved from E-REDES.
+            cpe_code (str): The CPE code of the readings.
+
+        Returns:
+            ReadingsBatch: The parsed batch.
+        """
+        return cls(parse_readings_influx(file_path, cpe_code=cpe_code), cpe=cpe_code, source=Path(file_path))
+
+    @property
+    def cpe(self) -> str:
+        return self._cpe
+
+    @property
+    def source(self) -> Path | None:
+        return self._source
+
+    @property
+    def frame(self) -> pd.DataFrame:
+        return self._frame.copy(deep=False)
+
+
+class SinkResult:
+    """
+    The outcome of writing a batch into a single sink.
+
+    Attributes:
+        sink (str): The name of the sink.
+        points (int): The number of data points written.
+        elapsed (float): The wall time spent by the sink, in seconds.
+        error (str | None): The error message if the write failed, None otherwise.
+    """
+
+    def __init__(self, sink: str, points: int = 0, elapsed: float = 0.0, error: str | None = None):
+        self.sink = sink
+        self.points = points
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __str__(self):
+        if self.ok:
+            return f"{self.sink}: {self.points} points in {self.elapsed:.3f}s"
+        return f"{self.sink}: failed after {self.elapsed:.3f}s ({self.error})"
+
+    def __repr__(self):
+        return f"SinkResult(sink={self.sink}, points={self.points}, elapsed={self.elapsed}, error={self.error})"
+
+
+class Sink:
+    """
+    Base class of the data sinks.
+
+    A sink is built from the parsed application config with ``from_config`` and must implement ``load_frame``.
+    Sinks that can tell which data points they already hold should override ``last_insert`` so delta loads only
+    write the new points. Third-party sinks are registered under the ``eredesscraper.sinks`` entry point group.
+
+    Sinks that support pre-aggregated windows implement ``load_rollups``, and ``stored_points`` so the windows at
+    the edges of a batch are completed with the readings already loaded; the rollup stage runs after the raw points
+    are written when ``rollups`` is set.
+
+    Attributes:
+        name (str): The name used to select the sink (e.g. ``ers run -d <name>``).
+        rollups (bool): If True, the hourly, daily and monthly rollups are written alongside the raw points.
+    """
+    name: str = None
+
+    def __init__(self, quiet: bool = False, rollups: bool = False):
+        self.quiet = quiet
+        self.rollups = rollups
+
+    @classmethod
+    def from_config(cls, config: dict, quiet: bool = False) -> "Sink":
+        """
+        Builds the sink from the parsed application config.
+
+        Args:
+            config (dict): The parsed config file.
+            quiet (bool): If True, the sink does not echo anything.
+
+        Returns:
+            Sink: The sink instance.
+        """
+        return cls(quiet=quiet)
+
+    def connect(self) -> None:
+        return None
+
+    def close(self) -> None:
+        return None
+
+    def last_insert(self, cpe_code: str) -> datetime.datetime:
+        """
+        Returns the timestamp of the latest data point held by the sink for the given CPE.
+
+        Args:
+            cpe_code (str): The CPE code.
+
+        Returns:
+            datetime.datetime: The latest timestamp (UTC), or ``EMPTY_SINK_TIMESTAMP`` if there is none.
+        """
+        return EMPTY_SINK_TIMESTAMP
+
+    def load_frame(self, df: pd.DataFrame) -> None:
+        """
+        Writes the readings DataFrame into the sink.
+
+        Args:
+            df (pd.DataFrame): The readings, indexed by ``date_time``.
+
+        Returns:
+            None
+        """
+        raise NotImplementedError
+
+    def load_rollups(self, rollups: dict) -> None:
+        """
+        Writes the windows computed by ``compute_rollups`` into the sink.
+
+        Args:
+            rollups (dict): A mapping of rollup names to DataFrames.
+
+        Returns:
+            None
+        """
+        raise NotImplementedError(f"The {self.name} sink does not support rollups")
+
+    def stored_points(self, cpe_code: str, start: datetime.datetime, stop: datetime.datetime) -> pd.DataFrame | None:
+        """
+        Returns the readings held by the sink for the given CPE between ``start`` (inclusive) and ``stop``
+        (exclusive). The rollup stage reads them to complete the windows at the edges of a batch.
+
+        Args:
+            cpe_code (str): The CPE code.
+            start (datetime.datetime): The start of the range.
+            stop (datetime.datetime): The end of the range.
+
+        Returns:
+            pd.DataFrame | None: The readings, indexed by ``date_time``, or None if the sink cannot read them back.
+        """
+        return None
+
+    def rollup_frame(self, batch: ReadingsBatch) -> pd.DataFrame:
+        """
+        Returns the readings the rollups of a batch are computed from: the batch, and the stored readings of the
+        windows it only partially covers. An export of a month starts at 00:15 and ends at 00:00 of the next month,
+        so its first and last windows are completed with the points of the neighbouring exports, whatever the order
+        they were loaded in.
+
+        Args:
+            batch (ReadingsBatch): The batch being written.
+
+        Returns:
+            pd.DataFrame: The readings, indexed by ``date_time``.
+        """
+        frame = batch.frame
+        first, last = frame.index.min(), frame.index.max()
+        start = min(rollup_window_start(first, freq) for freq in rollup_windows.values())
+        stop = max(rollup_window_start(last, freq) + to_offset(freq) for freq in rollup_windows.values())
+
+        stored = self.stored_points(batch.cpe, start, stop)
+        if stored is None or stored.empty:
+            return frame
+
+        stored = stored[(stored.index < first) | (stored.index > last)]
+        return pd.concat([stored[frame.columns], frame]).sort_index()
+
+    def write(self, batch: ReadingsBatch, delta: bool = False) -> int:
+        """
+        Writes a batch into the sink, keeping only the points newer than ``last_insert`` if ``delta`` is set.
+        If ``rollups`` is set, the windows touched by the written points are recomputed from the whole batch and
+        the stored readings around it (see ``rollup_frame``), and written as well.
+
+        Args:
+            batch (ReadingsBatch): The batch to write.
+            delta (bool): Specify whether to load only the most recent data points.
+
+        Returns:
+            int: The number of data points written.
+        """
+        df = batch.frame
+
+        if delta:
+            df = df[df.index > self.last_insert(cpe_code=batch.cpe)]
+
+        if df.empty:
+            return 0
+
+        self.load_frame(df)
+
+        if self.rollups:
+            self.load_rollups(compute_rollups(self.rollup_frame(batch), since=df.index.min() if delta else None))
+
+        return len(df)
+
+
+class InfluxDBSink(Sink):
+    name = "influxdb"
+
+    def __init__(self, client: InfluxDB, quiet: bool = False, rollups: bool = False):
+        super().__init__(quiet=quiet, rollups=rollups)
+        self.client = client
+
+    @classmethod
+    def from_config(cls, config: dict, quiet: bool = False) -> "InfluxDBSink":
+        if not config.get('influxdb'):
+            raise SinkError("Missing `influxdb` section in the config file")
+
+        client = InfluxDB(
+            token=config['influxdb']['token'],
+            org=config['influxdb']['org'],
+            host=config['influxdb']['host'],
+            port=config['influxdb']['port'],
+            bucket=config['influxdb']['bucket'],
+            quiet=quiet)
+
+        return cls(client, quiet=quiet, rollups=bool(config['influxdb'].get('rollups', False)))
+
+    def connect(self) -> None:
+        self.client.connect()
+
+    def close(self) -> None:
+        if self.client.client is not None:
+            self.client.client.close()
+
+    def last_insert(self, cpe_code: str) -> datetime.datetime:
+        return self.client.get_last_insert(cpe_code=cpe_code)
+
+    def load_frame(self, df: pd.DataFrame) -> None:
+        self.client.write(df)
+
+    def load_rollups(self, rollups: dict) -> None:
+        self.client.write_rollups(rollups)
+
+    def stored_points(self, cpe_code: str, start: datetime.datetime, stop: datetime.datetime) -> pd.DataFrame:
+        return self.client.get_points(cpe_code, start, stop)
+
+
+class DuckDBSink(Sink):
+    """
+    Loads the readings into a ``readings`` table of a DuckDB database file.
+
+    The database is not the API state database (``~/.ers/ers.db``), so it can be queried while the server is running.
+    """
+    name = "duckdb"
+
+    def __init__(self, path: Path = Path.home() / ".ers" / "readings.db", table: str = "readings",
+                 quiet: bool = False):
+        super().__init__(quiet=quiet)
+        self.path = Path(path)
+        self.table = table
+        self.conn = None
+
+    @classmethod
+    def from_config(cls, config: dict, quiet: bool = False) -> "DuckDBSink":
+        section = config.get('duckdb') or {}
+        kwargs = {k: v for k, v in section.items() if k in ("path", "table")}
+        return cls(quiet=quiet, **kwargs)
+
+    def connect(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = duckdb.connect(self.path.as_posix())
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                          f"date_time TIMESTAMPTZ, cpe VARCHAR, consumption DOUBLE, PRIMARY KEY (cpe, date_time))")
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def last_insert(self, cpe_code: str) -> datetime.datetime:
+        last = self.conn.execute(f"SELECT max(date_time) FROM {self.table} WHERE cpe = ?", [cpe_code]).fetchone()[0]
+        return last.astimezone(UTC) if last is not None else EMPTY_SINK_TIMESTAMP
+
+    def load_frame(self, df: pd.DataFrame) -> None:
+        records = df.reset_index()[['date_time', 'cpe', 'consumption']]
+        self.conn.register("batch", records)
+        try:
+            self.conn.execute(f"INSERT OR REPLACE INTO {self.table} SELECT date_time, cpe, consumption FROM batch")
+        finally:
+            self.conn.unregister("batch")
+
+
+class ParquetSink(Sink):
+    """
+    Writes the readings as Parquet files, partitioned by CPE and month:
+    ``<path>/cpe=<cpe>/month=<YYYY-MM>/data.parquet``.
+
+    A load merges the readings into the files of their months, the new ones replacing the stored ones of the same
+    timestamp, and each file is replaced atomically: reloading a month never duplicates readings. Files are written
+    with DuckDB, so no extra Parquet library is required.
+    """
+    name = "parquet"
+
+    def __init__(self, path: Path = Path.home() / ".ers" / "parquet", quiet: bool = False):
+        super().__init__(quiet=quiet)
+        self.path = Path(path)
+        self.conn = None
+
+    @classmethod
+    def from_config(cls, config: dict, quiet: bool = False) -> "ParquetSink":
+        section = config.get('parquet') or {}
+        kwargs = {k: v for k, v in section.items() if k in ("path",)}
+        return cls(quiet=quiet, **kwargs)
+
+    def connect(self) -> None:
+        self.conn = duckdb.connect()
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def partition(self, cpe_code: str) -> Path:
+        return self.path / f"cpe={cpe_code}"
+
+    def last_insert(self, cpe_code: str) -> datetime.datetime:
+        partition = self.partition(cpe_code)
+        if not any(partition.glob("*/*.parquet")):
+            return EMPTY_SINK_TIMESTAMP
+
+        last = self.conn.execute(f"SELECT max(date_time) FROM read_parquet("
+                                 f"'{(partition / '*' / '*.parquet').as_posix()}', hive_partitioning = false)"
+                                 ).fetchone()[0]
+        return last.astimezone(UTC) if last is not None else EMPTY_SINK_TIMESTAMP
+
+    def load_frame(self, df: pd.DataFrame) -> None:
+        records = df.reset_index()[['date_time', 'cpe', 'consumption']]
+
+        for (cpe_code, month), group in records.groupby(['cpe', records['date_time'].dt.strftime('%Y-%m')]):
+            target = self.partition(cpe_code) / f"month={month}" / "data.parquet"
+            target.parent.mkdir(parents=True, exist_ok=True)
+            staging = target.with_suffix(".tmp")
+
+            query = "SELECT * FROM batch"
+            if target.exists():
+                query += (f" UNION ALL BY NAME SELECT * FROM read_parquet('{target.as_posix()}', "
+                          f"hive_partitioning = false) WHERE date_time NOT IN (SELECT date_time FROM batch)")
+
+            self.conn.register("batch", group)
+            try:
+                self.conn.execute(f"COPY ({query} ORDER BY date_time) TO '{staging.as_posix()}' (FORMAT PARQUET)")
+            finally:
+                self.conn.unregister("batch")
+            os.replace(staging, target)
+
+
+class PostgresSink(Sink):
+    """
+    Loads the readings into a PostgreSQL table, optionally converted to a TimescaleDB hypertable.
+
+    Requires the optional ``psycopg`` dependency (``pip install eredesscraper[postgres]``).
+    """
+    name = "postgres"
+
+    def __init__(self, host: str = "localhost", port: int = 5432, dbname: str = "postgres", user: str = "postgres",
+                 password: str = None, table: str = "readings", timescale: bool = False, quiet: bool = False):
+        super().__init__(quiet=quiet)
+        self.host = host
+        self.port = port
+        self.dbname = dbname
+        self.user = user
+        self.__password = password
+        self.table = table
+        self.timescale = timescale
+        self.conn = None
+
+    @classmethod
+    def from_config(cls, config: dict, quiet: bool = False) -> "PostgresSink":
+        if not config.get('postgres'):
+            raise SinkError("Missing `postgres` section in the config file")
+
+        keys = ("host", "port", "dbname", "user", "password", "table", "timescale")
+        return cls(quiet=quiet, **{k: v for k, v in config['postgres'].items() if k in keys})
+
+    def connect(self) -> None:
+        try:
+            import psycopg
+        except ImportError:
+            raise SinkError("The postgres sink requires `psycopg`. Install it with `pip install eredesscraper[postgres]`")
+
+        self.conn = psycopg.connect(host=self.host, port=self.port, dbname=self.dbname, user=self.user,
+                                    password=self.__password)
+
+        with self.conn.cursor() as cur:
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                        f"date_time TIMESTAMPTZ NOT NULL, cpe TEXT NOT NULL, consumption DOUBLE PRECISION, "
+                        f"PRIMARY KEY (cpe, date_time))")
+            if self.timescale:
+                cur.execute("SELECT create_hypertable(%s, 'date_time', if_not_exists => TRUE)", [self.table])
+        self.conn.commit()
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def last_insert(self, cpe_code: str) -> datetime.datetime:
+        with self.conn.cursor() as cur:
+            cur.execute(f"SELECT max(date_time) FROM {self.table} WHERE cpe = %s", [cpe_code])
+            last = cur.fetchone()[0]
+        return last.astimezone(UTC) if last is not None else EMPTY_SINK_TIMESTAMP
+
+    def load_frame(self, df: pd.DataFrame) -> None:
+        records = df.reset_index()[['date_time', 'cpe', 'consumption']]
+
+        with self.conn.cursor() as cur:
+            cur.execute(f"CREATE TEMP TABLE ers_batch (LIKE {self.table}) ON COMMIT DROP")
+            with cur.copy("COPY ers_batch (date_time, cpe, consumption) FROM STDIN") as copy:
+                for row in records.itertuples(index=False):
+                    copy.write_row(row)
+            cur.execute(f"INSERT INTO {self.table} SELECT * FROM ers_batch "
+                        f"ON CONFLICT (cpe, date_time) DO UPDATE SET consumption = EXCLUDED.consumption")
+        self.conn.commit()
+
+
+builtin_sinks = {sink.name: sink for sink in (InfluxDBSink, DuckDBSink, ParquetSink, PostgresSink)}
+
+
+@lru_cache(maxsize=None)
+def available_sinks() -> dict:
+    """
+    Returns the sinks that can be selected, by name: the built-in sinks plus the ones registered by installed
+    packages under the ``eredesscraper.sinks`` entry point group. Entry points that fail to load are ignored.
+
+    Returns:
+        dict: A mapping of sink names to ``Sink`` subclasses.
+    """
+    sinks = dict(builtin_sinks)
+
+    for ep in entry_points(group=SINK_ENTRY_POINT_GROUP):
+        if ep.name in sinks:
+            continue
+        try:
+            sink = ep.load()
+        except Exception:
+            continue
+        if isinstance(sink, type) and issubclass(sink, Sink):
+            sinks[ep.name] = sink
+
+    return sinks
+
+
+def _write_sink(sink_cls: type, name: str, batch: ReadingsBatch, config: dict, delta: bool,
+                quiet: bool) -> SinkResult:
+    with span("sink.load", **{"ers.sink": name, "ers.delta": delta}) as load:
+        start = time.perf_counter()
+        sink = None
+        try:
+            sink = sink_cls.from_config(config, quiet=quiet)
+            sink.connect()
+            points = sink.write(batch, delta=delta)
+            load.set_attribute("ers.points", points)
+            return SinkResult(sink=name, points=points, elapsed=time.perf_counter() - start)
+        except Exception as e:
+            load.record_exception(e)
+            return SinkResult(sink=name, elapsed=time.perf_counter() - start, error=str(e) or type(e).__name__)
+        finally:
+            if sink is not None:
+                try:
+                    sink.close()
+                except Exception:
+                    pass
+
+
+def write_sinks(batch: ReadingsBatch, names: list, config: dict, delta: bool = False, quiet: bool = False,
+                max_workers: int | None = None) -> list:
+    """
+    Writes a batch into every selected sink concurrently, in a thread pool.
+
+    A failing sink does not affect the others: its error is reported in its ``SinkResult``.
+
+    Args:
+        batch (ReadingsBatch): The parsed readings.
+        names (list): The names of the sinks to write to.
+        config (dict): The parsed config file.
+        delta (bool): Specify whether to load only the most recent data points.
+        quiet (bool): If True, nothing is echoed.
+        max_workers (int, optional): The size of the thread pool. Defaults to one thread per sink.
+
+    Returns:
+        list: A ``SinkResult`` per requested sink, in the requested order.
+    """
+    names = [name for name in dict.fromkeys(names or []) if name]
+    sinks = available_sinks()
+
+    results = {name: SinkResult(sink=name, error="not supported") for name in names if name not in sinks}
+    selected = [name for name in names if name in sinks]
+
+    if selected:
+        with ThreadPoolExecutor(max_workers=max_workers or len(selected), thread_name_prefix="ers-sink") as pool:
+            # each sink runs in a copy of the context, so its span is a child of the current one
+            futures = {name: pool.submit(contextvars.copy_context().run, _write_sink, sinks[name], name, batch,
+                                         config, delta, quiet)
+                       for name in selected}
+            results.update({name: future.result() for name, future in futures.items()})
+
+    for result in (results[name] for name in names):
+        if quiet:
+            continue
+        if result.ok:
+            typer.echo(f"📈\tLoaded {result.points} data points into the {typer.style(result.sink, fg=typer.colors.GREEN)}"
+                       f" sink in {result.elapsed:.3f}s")
+        else:
+            typer.echo(f"💥\tFailed to load data into the {typer.style(result.sink, fg=typer.colors.GREEN)} sink: "
+                       f"{result.error}")
+
+    return [results[name] for name in names]
@@ -0,0 +1,362 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING
+from uuid import UUID, uuid4
+
+if TYPE_CHECKING:
+    from eredesscraper.models import Tracing
+
+# the span the code runs in, None outside of a trace (or NOOP in a trace that is not sampled)
+_current = contextvars.ContextVar("ers_span", default=None)
+
+
+def trace_id_of(task_id) -> str:
+    """
+    Returns the trace ID of a task: its UUID as 32 hex digits, so the spans of a task are found by its ID.
+    """
+    try:
+        return UUID(str(task_id)).hex
+    except (TypeError, ValueError):
+        return uuid4().hex
+
+
+class NoopSpan:
+    """
+    The span returned outside of a sampled trace: recording into it does nothing.
+    """
+    trace_id = None
+    span_id = None
+
+    def set_attribute(self, key: str, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def record_exception(self, e: BaseException):
+        pass
+
+
+NOOP = NoopSpan()
+
+
+class Span:
+    """
+    A timed operation of a trace, with the structure of an OpenTelemetry span: trace and span IDs, the ID of its
+    parent, start and end times in nanoseconds since the epoch, attributes and a status.
+    """
+    __slots__ = ("trace", "name", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: str | None, attributes: dict, start_ns: int = None):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes)
+        self.error = None
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def record_exception(self, e: BaseException):
+        self.error = str(e) or type(e).__name__
+        self.attributes["exception.type"] = type(e).__name__
+        self.attributes["exception.message"] = str(e)
+
+    def end(self, end_ns: int = None):
+        self.end_ns = end_ns or time.time_ns()
+        self.trace.add(self)
+
+    def to_dict(self) -> dict:
+        """
+        Returns the span as in the OTLP JSON encoding, with the attributes as a plain dict.
+        """
+        return {"traceId": self.trace_id,
+                "spanId": self.span_id,
+                "parentSpanId": self.parent_id or "",
+                "name": self.name,
+                "kind": "SPAN_KIND_INTERNAL",
+                "startTimeUnixNano": str(self.start_ns),
+                "endTimeUnixNano": str(self.end_ns),
+                "attributes": self.attributes,
+                "status": {"code": "STATUS_CODE_ERROR", "message": self.error} if self.error is not None
+                else {"code": "STATUS_CODE_OK"}}
+
+
+class Trace:
+    """
+    The spans of a trace, exported together when its root span ends.
+    """
+
+    def __init__(self, trace_id: str, tracer: "Tracer"):
+        self.trace_id = trace_id
+        self.tracer = tracer
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class JsonlExporter:
+    """
+    Appends the spans to a JSONL file, one span per line (see ``Span.to_dict``).
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path).expanduser()
+        self._lock = threading.Lock()
+
+    def export(self, spans: list, service_name: str):
+        lines = "".join(json.dumps({**span.to_dict(), "service.name": service_name}, default=str) + "\n"
+                        for span in spans)
+
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+
+
+class OtlpExporter:
+    """
+    Sends the spans to an OpenTelemetry collector, with the OTLP/HTTP JSON protocol (``POST /v1/traces``).
+    """
+
+    def __init__(self, endpoint: str, timeout: float = 5):
+        self.endpoint = endpoint if endpoint.rstrip("/").endswith("/v1/traces") else endpoint.rstrip("/") + \
+            "/v1/traces"
+        self.timeout = timeout
+
+    def export(self, spans: list, service_name: str):
+        import requests
+
+        otlp_spans = []
+        for span in spans:
+            otlp = span.to_dict()
+            otlp["attributes"] = [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()]
+            otlp["kind"] = 1
+            otlp["status"] = {"code": 2, "message": span.error} if span.error is not None else {"code": 1}
+            otlp_spans.append(otlp)
+
+        body = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{"scope": {"name": "eredesscraper"}, "spans": otlp_spans}]}]}
+
+        requests.post(self.endpoint, json=body, timeout=self.timeout).raise_for_status()
+
+
+class Tracer:
+    """
+    Records the spans of the sampled traces and exports them when their root span ends.
+
+    A trace is started by ``start_trace`` (e.g. around ``switchboard``), with the ID of its task as trace ID. Its
+    spans are nested through a context variable, so they follow the code across function calls and into the threads
+    started with a copy of the context (see ``eredesscraper.pipeline.Pipeline``). Outside of a sampled trace, a span
+    costs a context variable lookup.
+
+    Args:
+        settings (Tracing, optional): The sampling rate and the exporters. Defaults to None (disabled).
+
+    Methods:
+        configure: Applies new settings.
+        sampled: Checks if a trace is sampled.
+        start_trace: Starts a trace, or a span of the current trace.
+        span: Starts a span of the current trace.
+        add_span: Records a span already finished.
+    """
+
+    def __init__(self, settings: "Tracing" = None):
+        self.settings = None
+        self.exporters = []
+        self.configure(settings)
+
+    def configure(self, settings: "Tracing" = None):
+        if settings == self.settings:
+            return
+
+        self.settings = settings
+        self.exporters = [] if settings is None else \
+            ([JsonlExporter(settings.jsonl)] if settings.jsonl else []) + \
+            ([OtlpExporter(settings.otlp_endpoint)] if settings.otlp_endpoint else [])
+
+    def sampled(self, trace_id: str) -> bool:
+        """
+        Checks if a trace is sampled. The decision is derived from the trace ID, so it is the same in every process.
+        """
+        if self.settings is None or self.settings.sample_rate <= 0 or not self.exporters:
+            return False
+        return int(trace_id[:16], 16) / 2 ** 64 < self.settings.sample_rate
+
+    @contextmanager
+    def start_trace(self, name: str, task_id=None, force: bool = False, **attributes):
+        """
+        Starts a trace, with its root span. Within a trace, starts a span of it instead.
+
+        Args:
+            name (str): The name of the root span.
+            task_id (UUID, optional): The task the trace is for, giving its trace ID. Defaults to a random ID.
+            force (bool, optional): Record the trace even if it is not sampled. Defaults to False.
+            **attributes: The attributes of the root span.
+
+        Yields:
+            Span | NoopSpan: The root span, or ``NOOP`` if the trace is not sampled.
+        """
+        if _current.get() is not None:
+            with self.span(name, **attributes) as span:
+                yield span
+            return
+
+        trace_id = trace_id_of(task_id)
+        if not (force or self.sampled(trace_id)):
+            token = _current.set(NOOP)
+            try:
+                yield NOOP
+            finally:
+                _current.reset(token)
+            return
+
+        trace = Trace(trace_id, self)
+        if task_id is not None:
+            attributes = {"ers.task_id": str(task_id), **attributes}
+
+        try:
+            with self._span(Span(trace, name, None, attributes)) as span:
+                yield span
+        finally:
+            # a failed run is exported too, with the error in its root span
+            self.export(trace)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        Starts a span of the current trace, as a child of the current span.
+
+        Args:
+            name (str): The name of the span.
+            **attributes: The attributes of the span.
+
+        Yields:
+            Span | NoopSpan: The span, or ``NOOP`` outside of a sampled trace.
+        """
+        parent = _current.get()
+        if parent is None or parent is NOOP:
+            yield NOOP
+            return
+
+        with self._span(Span(parent.trace, name, parent.span_id, attributes)) as span:
+            yield span
+
+    @contextmanager
+    def _span(self, span: Span):
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            _current.reset(token)
+            span.end()
+
+    def add_span(self, name: str, seconds: float, **attributes):
+        """
+        Records a span of the current trace that just finished, given its duration.
+
+        Args:
+            name (str): The name of the span.
+            seconds (float): How long the span lasted, up to now.
+            **attributes: The attributes of the span.
+
+        Returns:
+            None
+        """
+        parent = _current.get()
+        if parent is None or parent is NOOP:
+            return
+
+        end_ns = time.time_ns()
+        Span(parent.trace, name, parent.span_id, attributes, start_ns=end_ns - int(seconds * 1e9)).end(end_ns)
+
+    def export(self, trace: Trace):
+        for exporter in self.exporters:
+            try:
+                exporter.export(trace.spans, self.settings.service_name)
+            except Exception:
+                # tracing must never fail a run
+                pass
+
+
+tracer = Tracer()
+
+
+def configure(config: dict):
+    """
+    Applies the ``tracing`` section of a parsed config file to the tracer.
+    """
+    from eredesscraper.models import Tracing
+
+    tracer.configure(Tracing(**config["tracing"]) if config.get("tracing") else None)
+
+
+def span(name: str, **attributes):
+    return tracer.span(name, **attributes)
+
+
+def start_trace(name: str, task_id=None, force: bool = False, **attributes):
+    return tracer.start_trace(name, task_id=task_id, force=force, **attributes)
+
+
+def add_span(name: str, seconds: float, **attributes):
+    tracer.add_span(name, seconds, **attributes)
+
+
+def traced(name: str) -> Callable:
+    """
+    Decorates a function to run it in a span of the current trace.
+
+    Args:
+        name (str): The name of the span.
+
+    Returns:
+        Callable: The decorator.
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            parent = _current.get()
+            if parent is None or parent is NOOP:
+                return function(*args, **kwargs)
+
+            with tracer.span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
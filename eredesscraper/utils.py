@@ -1,28 +1,45 @@
+import copy
 import locale
 import math
 import os
+import re
+import tempfile
+import threading
 import time
 from collections.abc import MutableMapping
-from datetime import datetime
+from datetime import date, datetime
 from pathlib import Path
-from typing import Union
+from typing import TYPE_CHECKING, Union
 from importlib.resources import files
 
-import pandas as pd
 import yaml
-import screeninfo
-from playwright.sync_api import Page
 from pykwalify.core import Core
 from pytz import UTC
 
-from eredesscraper.backend import DuckDB
 from eredesscraper.meta import en_pt_month_map
+from eredesscraper.tracing import traced
+
+if TYPE_CHECKING:
+    # pandas, Playwright and DuckDB are imported by the functions using them, so the config helpers load fast
+    import pandas as pd
+    from playwright.sync_api import Page
 
 config_schema = files("eredesscraper").joinpath("config_schema.yml")
 config_schema_path = Path(str(config_schema)).resolve()
 
+# pykwalify parses with a module-level YAML instance, which is not thread-safe
+_validate_lock = threading.Lock()
+
+# validated config files and loaded schemas, keyed on their path, invalidated when their mtime or size changes
+_config_cache = {}
+_config_lock = threading.Lock()
+
+# rollup name -> pandas resampling frequency
+rollup_windows = {"1h": "h", "1d": "D", "1mo": "MS"}
 
-def parse_readings_influx(file_path: Path, cpe_code: str) -> pd.DataFrame:
+
+@traced("parse_readings_influx")
+def parse_readings_influx(file_path: Path, cpe_code: str) -> "pd.DataFrame":
     """
     The `parse_readings_influx` function takes a XLSX file path retrieved from E-REDES and returns
     a pandas DataFrame with the parsed data.
@@ -41,6 +58,7 @@ def parse_readings_influx(file_path: Path, cpe_code: str) -> pd.DataFrame:
     :return: A pandas DataFrame with the parsed data
     :doc-author: Ricardo Filipe dos Santos
     """
+    import pandas as pd
 
     df = pd.read_excel(
         file_path,
@@ -63,6 +81,58 @@ def parse_readings_influx(file_path: Path, cpe_code: str) -> pd.DataFrame:
     return df
 
 
+def rollup_window_start(ts: "pd.Timestamp", freq: str) -> "pd.Timestamp":
+    """
+    The rollup_window_start function returns the start of the rollup window holding the given timestamp.
+
+    :param ts: The timestamp
+    :type ts: pandas.Timestamp
+    :param freq: The pandas resampling frequency of the window (one of the `rollup_windows` values)
+    :type freq: str
+    :return: The start of the window
+    :doc-author: Ricardo Filipe dos Santos
+    """
+    if freq == "MS":
+        return ts.normalize().replace(day=1)
+
+    return ts.floor(freq)
+
+
+def compute_rollups(df: "pd.DataFrame", since: "pd.Timestamp" = None, windows: dict = None) -> dict:
+    """
+    The compute_rollups function aggregates the readings DataFrame returned by `parse_readings_influx` into
+    hourly, daily and monthly windows (sum, mean, max and count of the consumption), per CPE.
+    If `since` is given, only the windows holding `since` and the ones after it are computed, so a delta load
+    only recomputes the windows it touched. The windows are aligned to UTC.
+
+    :param df: The readings DataFrame, indexed by `date_time`
+    :type df: pandas.DataFrame
+    :param since: The timestamp of the oldest point that changed. Defaults to None (compute every window)
+    :type since: pandas.Timestamp
+    :param windows: A mapping of rollup names to pandas resampling frequencies. Defaults to `rollup_windows`
+    :type windows: dict
+    :return: A mapping of rollup names to DataFrames indexed by `date_time` with `cpe`, `consumption_sum`,
+        `consumption_mean`, `consumption_max` and `consumption_count` columns
+    :doc-author: Ricardo Filipe dos Santos
+    """
+    rollups = {}
+
+    for name, freq in (windows or rollup_windows).items():
+        window = df if since is None else df[df.index >= rollup_window_start(since, freq)]
+
+        rollup = (window.groupby('cpe')['consumption']
+                  .resample(freq)
+                  .agg(['sum', 'mean', 'max', 'count'])
+                  .add_prefix('consumption_'))
+
+        rollup = rollup[rollup['consumption_count'] > 0].reset_index(level='cpe')
+        rollup['consumption_count'] = rollup['consumption_count'].astype(int)
+
+        rollups[name] = rollup
+
+    return rollups
+
+
 def flatten_config(d, parent_key='', sep='.') -> dict:
     """
     The flatten_config function takes a dictionary and flattens it into a single level.
@@ -157,26 +227,208 @@ def validate_config(config_path: Path, schema_path: Path = config_schema_path) -
     assert schema_path.suffix == ".yml", f"Invalid file extension: {schema_path.suffix}"
     assert schema_path.exists(), f"Invalid file: {schema_path}"
 
-    c = Core(source_file=config_path.__str__(), schema_files=[schema_path.__str__()])
-    return c.validate()
+    with open(config_path, "r") as f:
+        data = yaml.safe_load(f)
+
+    return _validate(data, schema_path)
+
+
+def _file_key(path: Path) -> tuple:
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _load_schema(schema_path: Path) -> dict:
+    key = ("schema", schema_path.resolve())
+    version = _file_key(schema_path)
+
+    with _config_lock:
+        cached = _config_cache.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+    with open(schema_path, "r") as f:
+        schema = yaml.safe_load(f)
+
+    with _config_lock:
+        _config_cache[key] = (version, schema)
+
+    return schema
+
+
+def _validate(data: dict, schema_path: Path = config_schema_path) -> bool:
+    with _validate_lock:
+        # pykwalify may annotate the schema it is given: it gets its own copy
+        c = Core(source_data=data, schema_data=copy.deepcopy(_load_schema(schema_path)))
+        return c.validate()
+
+
+def workflow_period(workflow: str, month: int = None, year: int = None, today: date = None) -> tuple:
+    """
+    The workflow_period function resolves the month loaded by a workflow.
+
+    :param workflow: Specify the workflow (`current`, `previous` or `select`)
+    :type workflow: str
+    :param month: Specify the month requested for the `select` workflow
+    :type month: int
+    :param year: Specify the year requested for the `select` workflow
+    :type year: int
+    :param today: Specify the current date. Defaults to today
+    :type today: datetime.date
+    :return: The (year, month) loaded by the workflow
+    :doc-author: Ricardo Filipe dos Santos
+    """
+    today = today or date.today()
+
+    match workflow:
+        case "current":
+            return today.year, today.month
+        case "previous":
+            return (today.year, today.month - 1) if today.month > 1 else (today.year - 1, 12)
+        case _:
+            return year, month
+
+
+def batch_months(months: list = None, start: str = None, end: str = None, today: date = None) -> list:
+    """
+    The batch_months function resolves the months loaded by a batch.
+
+    :param months: Specify the months to load, as `YYYY-MM`
+    :type months: list
+    :param start: Specify the first month of a range of months, as `YYYY-MM`
+    :type start: str
+    :param end: Specify the last month of the range. Defaults to the current month
+    :type end: str
+    :param today: Specify the current date. Defaults to today
+    :type today: datetime.date
+    :return: The (year, month) of each month, sorted and without duplicates
+    :raises ValueError: If a month is invalid or in the future, or if no month is given
+    :doc-author: Ricardo Filipe dos Santos
+    """
+    today = today or date.today()
+
+    def parse(value: str) -> tuple:
+        if not re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", str(value)):
+            raise ValueError(f"Invalid month {value!r}: expected YYYY-MM")
+        year, month = value.split("-")
+        return int(year), int(month)
+
+    if months and start:
+        raise ValueError("Specify either a list of months or a range of months, not both")
+
+    if months:
+        periods = {parse(value) for value in months}
+    elif start:
+        first, last = parse(start), parse(end) if end else (today.year, today.month)
+        if first > last:
+            raise ValueError(f"The range of months starts after it ends: {start} > {end}")
+        periods = {(year, month) for year in range(first[0], last[0] + 1) for month in range(1, 13)
+                   if first <= (year, month) <= last}
+    else:
+        raise ValueError("Specify the months to load")
+
+    future = [f"{year}-{month:02d}" for year, month in periods if (year, month) > (today.year, today.month)]
+    if future:
+        raise ValueError(f"Months in the future: {', '.join(sorted(future))}")
+
+    return sorted(periods)
 
 
 def parse_config(config_path: Path = Path.cwd() / "config.yml") -> dict:
     """
     Parses a YAML configuration file and returns its contents as a dictionary.
 
+    The validated contents are cached, keyed on the path, the modification time and the size of the file, so the
+    file is only read and validated again once it changed.
+
     Args:
         config_path (pathlib.Path): The path to the YAML configuration file. Defaults to the current working directory.
 
     Returns:
-        dict: The contents of the YAML configuration file as a dictionary.
+        dict: The contents of the YAML configuration file as a dictionary. Callers get their own copy.
     """
-    validate_config(config_path)
+    config_path = Path(config_path)
+    assert config_path.is_file(), f"Invalid file: {config_path}"
+    assert config_path.suffix == ".yml", f"Invalid file extension: {config_path.suffix}"
 
-    with open(config_path, "r") as f:
-        config = yaml.safe_load(f)
+    key = ("config", config_path.resolve())
+    version = _file_key(config_path)
+
+    with _config_lock:
+        cached = _config_cache.get(key)
+
+    if cached is None or cached[0] != version:
+        with open(config_path, "r") as f:
+            config = yaml.safe_load(f)
+
+        _validate(config)
+        cached = (version, config)
+
+        with _config_lock:
+            _config_cache[key] = cached
 
-    return config
+    return copy.deepcopy(cached[1])
+
+
+def config_version(config_path: Path) -> tuple | None:
+    """
+    Returns the version of a config file: its modification time and size, or None if it does not exist.
+
+    Args:
+        config_path (pathlib.Path): The path to the YAML configuration file.
+
+    Returns:
+        tuple | None: The (mtime in nanoseconds, size) of the file.
+    """
+    try:
+        return _file_key(Path(config_path))
+    except FileNotFoundError:
+        return None
+
+
+def invalidate_config(config_path: Path):
+    """
+    Drops a config file from the cache of ``parse_config``.
+
+    Args:
+        config_path (pathlib.Path): The path to the YAML configuration file.
+
+    Returns:
+        None
+    """
+    with _config_lock:
+        _config_cache.pop(("config", Path(config_path).resolve()), None)
+
+
+def save_config(config: dict, config_path: Path):
+    """
+    Writes a configuration file atomically: readers see either the previous or the new file, never a partial one.
+
+    The file is written next to its destination, then moved over it, and the cache of ``parse_config`` is
+    invalidated.
+
+    Args:
+        config (dict): The configuration.
+        config_path (pathlib.Path): The path to the YAML configuration file.
+
+    Returns:
+        None
+    """
+    config_path = Path(config_path)
+    config_path.parent.mkdir(parents=True, exist_ok=True)
+
+    fd, tmp = tempfile.mkstemp(dir=config_path.parent, prefix=f".{config_path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            yaml.dump(config, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, config_path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    finally:
+        invalidate_config(config_path)
 
 
 # Legacy function to create screenshot with Selenium WebDriver
@@ -342,6 +594,8 @@ def db_conn(db_path: str) -> bool:
     """
     Test the database connection.
     """
+    from eredesscraper.backend import DuckDB
+
     try:
         db = DuckDB(db_path)
         db.query("SELECT 1")
@@ -351,7 +605,7 @@ def db_conn(db_path: str) -> bool:
         return False
 
 
-def pw_nav_year_back(date: datetime, pw_page: Page, call_counter: int = 0) -> Page:
+def pw_nav_year_back(date: datetime, pw_page: "Page", call_counter: int = 0) -> "Page":
     """
     Navigate back in the year selection popup table in the E-REDES website consumption history.
 
@@ -380,6 +634,8 @@ def get_screen_resolution():
     Returns:
         tuple: A tuple containing the width and height of the screen resolution.
     """
+    import screeninfo
+
     try:
         monitors = screeninfo.get_monitors()
         if monitors:
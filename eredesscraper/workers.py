@@ -0,0 +1,502 @@
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+from eredesscraper.backend import DuckDB, DuckDBWriter
+from eredesscraper.blobstore import BlobStore
+from eredesscraper.models import TaskstatusRecord, WorkflowRequestRecord, JobLease
+from eredesscraper import metrics
+from eredesscraper.breaker import CircuitBreaker, admit, breaker_failure, logged_in
+from eredesscraper.ratelimit import RateLimiter, RateLimited, config_account
+from eredesscraper.workflows import switchboard, batch_switchboard
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def run_job(config_path: Path, job: WorkflowRequestRecord) -> tuple:
+    """
+    Runs the workflow of a job. Called in a worker process.
+
+    Args:
+        config_path (Path): The path to the config file.
+        job (WorkflowRequestRecord): The request of the task.
+
+    Returns:
+        tuple: The status of the task, the path to the downloaded file (or None) and the measurements of the
+        workflow (see ``metrics.session_stats``). The measurements of a batch hold the result of each child task,
+        under ``children``.
+    """
+    if job.workflow == "batch":
+        stages = {}
+        results = batch_switchboard(
+            config_path=config_path,
+            children=job.children or [],
+            db=job.db or [],
+            delta=job.delta,
+            keep=True if job.download else False,
+            quiet=True,
+            cache=not job.no_cache,
+            stages=stages,
+            uuid=job.task_id
+        )
+
+        return batch_status([r.status for r in results]), None, {"stages": stages, "children": {
+            str(r.session_id): {"status": r.status, "source_data": str(r.source_data) if r.source_data else None,
+                                **metrics.session_stats(r)} for r in results}}
+
+    result = switchboard(
+        config_path=config_path,
+        name=job.workflow,
+        db=job.db or [],
+        month=job.month,
+        year=job.year,
+        delta=job.delta,
+        keep=True if job.download else False,
+        quiet=True,
+        uuid=job.task_id,
+        cache=not job.no_cache,
+        start=job.start,
+        end=job.end,
+        profile=bool(job.profile)
+    )
+
+    return result.status, result.source_data, metrics.session_stats(result)
+
+
+def batch_status(statuses: list) -> str:
+    """
+    Returns the status of a batch, given the final status of its child tasks.
+    """
+    failed = sum(status.startswith("failed") for status in statuses)
+
+    if statuses and failed == len(statuses):
+        return f"failed: the {failed} child tasks failed"
+    if failed:
+        return f"completed with {failed} failed child tasks"
+    return "completed"
+
+
+class WorkerPool:
+    """
+    Runs the queued tasks of the API server in a pool of worker processes, and leases them to remote workers.
+
+    A dispatcher thread leases jobs from the ``jobs`` table of the state database, as long as a process of the pool
+    is free, and renews their lease while they run. Remote workers (``ers worker --server``) lease jobs through the
+    API in the same way. Since the jobs are stored in the database, the queued tasks survive a restart of the
+    server, and the tasks whose worker stopped (or crashed) are requeued once their lease expires, to be leased by
+    any other worker. A task is failed after its job was leased ``max_attempts`` times.
+
+    Every lease, local or remote, is admitted by the circuit breaker and the rate limiter of the server first: jobs
+    stay queued while the scrapes of the account of the config file are paused after a captcha, or while it has
+    too many scrapes running or started recently.
+
+    Args:
+        ddb (DuckDB): The connection to the state database.
+        writer (DuckDBWriter): The writer of the task status records.
+        blobs (BlobStore): The file store keeping the downloaded files.
+        config_path (Path): The path to the config file the workflows run with.
+        processes (int): The number of worker processes. 0 leaves the jobs to the remote workers.
+        lease_seconds (float): How long a job is leased without renewing its lease, in seconds.
+        max_attempts (int): How many times a job is leased before its task is failed.
+        poll_interval (float): How often the queue is checked for jobs queued by other processes, in seconds.
+        executor (Executor, optional): The executor running the jobs. Defaults to a pool of ``processes`` processes.
+        run (Callable): The function running a job. Defaults to ``run_job``.
+        limiter (RateLimiter, optional): The rate limits of the leases. Defaults to None (no limits).
+        breaker (CircuitBreaker, optional): The circuit breaker of the leases. Defaults to None.
+
+    Methods:
+        start: Starts the dispatcher thread.
+        stop: Stops the dispatcher thread.
+        notify: Wakes up the dispatcher after a job was queued.
+        lease: Leases the oldest queued job to a worker.
+        heartbeat: Renews the lease of a job.
+        complete: Records the result of a job.
+    """
+
+    def __init__(self, ddb: DuckDB, writer: DuckDBWriter, blobs: BlobStore, config_path: Path, processes: int = 2,
+                 lease_seconds: float = 60, max_attempts: int = 3, poll_interval: float = 5,
+                 executor: Executor = None, run: Callable = run_job, limiter: RateLimiter = None,
+                 breaker: CircuitBreaker = None):
+        self.ddb = ddb
+        self.writer = writer
+        self.blobs = blobs
+        self.config_path = config_path
+        self.processes = processes
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.executor = executor
+        self.run = run
+        self.limiter = limiter
+        self.breaker = breaker
+        self.name = worker_name()
+        # the jobs are leased and released by the dispatcher and the API request threads: serializing the updates of
+        # the queue avoids transaction conflicts between their cursors
+        self._lock = threading.Lock()
+        self._admissions = {}
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts the dispatcher thread.
+
+        Returns:
+            WorkerPool: The pool itself.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._dispatch, name="ers-dispatcher", daemon=True)
+            self._thread.start()
+
+        return self
+
+    def stop(self, timeout: float = None):
+        """
+        Stops the dispatcher thread. Running jobs are abandoned: they are requeued when their lease expires.
+
+        Args:
+            timeout (float, optional): The maximum time to wait for the thread, in seconds.
+
+        Returns:
+            None
+        """
+        if self._thread is not None:
+            self._stopping.set()
+            self._wake.set()
+            self._thread.join(timeout)
+            self._thread = None
+
+    def notify(self):
+        self._wake.set()
+
+    def lease(self, cursor: DuckDB, worker: str) -> WorkflowRequestRecord | None:
+        """
+        Leases the oldest queued job to a worker and marks its task as running.
+
+        Args:
+            cursor (DuckDB): The cursor of the calling thread.
+            worker (str): The name of the worker.
+
+        Returns:
+            WorkflowRequestRecord | None: The request of the leased task, or None if no job is queued.
+
+        Raises:
+            RateLimited: If no scrape is admitted yet (``CircuitOpen`` if the circuit breaker is open).
+        """
+        admission = admit(config_account(self.config_path), self.breaker, self.limiter)
+
+        with self._lock:
+            job = cursor.claim_job(worker, self.lease_seconds)
+            if job is None:
+                admission.cancel()
+            else:
+                self._admissions[str(job.task_id)] = admission
+
+        if job is not None:
+            for task_id in [job.task_id] + [child.task_id for child in job.children or []]:
+                self.writer.update_taskstatus(TaskstatusRecord(task_id=task_id, status="running", file=None,
+                                                               created=None, updated=datetime.now()))
+
+        return job
+
+    def heartbeat(self, cursor: DuckDB, task_id: str, worker: str) -> bool:
+        """
+        Renews the lease of a job.
+
+        Args:
+            cursor (DuckDB): The cursor of the calling thread.
+            task_id (str): The ID of the task run by the job.
+            worker (str): The name of the worker holding the lease.
+
+        Returns:
+            bool: True if the lease was renewed, False if the worker no longer holds it.
+        """
+        with self._lock:
+            return cursor.heartbeat_job(task_id, worker, self.lease_seconds)
+
+    def complete(self, cursor: DuckDB, task_id: str, worker: str, status: str, file_path: Path = None,
+                 failure: str = None, stats: dict = None) -> bool:
+        """
+        Records the result of a job and removes it from the queue.
+
+        Args:
+            cursor (DuckDB): The cursor of the calling thread.
+            task_id (str): The ID of the task run by the job.
+            worker (str): The name of the worker holding the lease.
+            status (str): The final status of the task.
+            file_path (Path, optional): The file downloaded by the task, stored into the file store.
+            failure (str, optional): ``captcha`` or ``login`` if the task failed to log in (see
+                ``breaker.breaker_failure``).
+            stats (dict, optional): The measurements of the workflow (see ``metrics.session_stats``). For a batch,
+                the status, file and measurements of each child task, under ``children``.
+
+        Returns:
+            bool: True if the result was recorded, False if the worker no longer holds the lease. The job was then
+            requeued, and the result of its new lease is kept instead.
+        """
+        with self._lock:
+            if not cursor.finish_job(task_id, worker):
+                return False
+            admission = self._admissions.pop(str(task_id), None)
+
+        if admission is not None:
+            if failure or status.startswith("failed") or logged_in(stats):
+                admission.finish(failure, error=status.removeprefix("failed: ") if failure else None)
+            else:
+                # served from the result cache: no login was attempted
+                admission.cancel()
+
+        children = cursor.get_batch_children(task_id)
+
+        if children:
+            results = (stats or {}).get("children") or {}
+            for child in children:
+                # the children without a result failed along with their batch (e.g. on a captcha)
+                result = results.get(str(child.task_id)) or {"status": status if status.startswith("failed") else
+                                                             "failed: no result was reported"}
+                self._record(child.task_id, result["status"], result.get("source_data"), failure, result)
+        else:
+            self._record(task_id, status, file_path, failure, stats)
+            return True
+
+        self.writer.update_taskstatus(TaskstatusRecord(task_id=task_id, status=status, file=None, created=None,
+                                                       updated=datetime.now()))
+        return True
+
+    def _record(self, task_id: str, status: str, file_path: Path | str | None, failure: str | None, stats: dict):
+        try:
+            file_hash = self.blobs.put(Path(file_path)) if file_path else None
+        except OSError as e:
+            status, file_hash = f"failed: {str(e)}", None
+
+        self.writer.update_taskstatus(TaskstatusRecord(task_id=task_id, status=status, file=None, created=None,
+                                                       updated=datetime.now(), file_hash=file_hash,
+                                                       profile=(stats or {}).get("profile")))
+        metrics.observe_task(status, failure if status.startswith("failed") else None, stats)
+
+    def _new_executor(self) -> Executor:
+        # spawned processes do not inherit the threads and open database of the server
+        return ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"))
+
+    def _dispatch(self):
+        cursor = self.ddb.cursor()
+        executor = self.executor or (self._new_executor() if self.processes else None)
+        running = {}
+        renewed = 0
+
+        try:
+            while not self._stopping.is_set():
+                self._wake.clear()
+
+                try:
+                    for task_id, (job, future, submitted_to) in list(running.items()):
+                        if future.done():
+                            del running[task_id]
+                            if isinstance(future.exception(), BrokenProcessPool):
+                                # a worker process died (e.g. the browser ran out of memory): its jobs are requeued
+                                # when their lease expires
+                                if submitted_to is executor:
+                                    executor.shutdown(wait=False, cancel_futures=True)
+                                    executor = self._new_executor()
+                                continue
+                            self._finish(cursor, job, future)
+
+                    if time.monotonic() - renewed > self.lease_seconds / 3:
+                        for task_id in running:
+                            self.heartbeat(cursor, task_id, self.name)
+                        self._requeue(cursor)
+                        renewed = time.monotonic()
+
+                    while len(running) < self.processes and not self._stopping.is_set():
+                        try:
+                            job = self.lease(cursor, self.name)
+                        except RateLimited:
+                            break
+                        if job is None:
+                            break
+
+                        future = executor.submit(self.run, self.config_path, job)
+                        future.add_done_callback(lambda _: self._wake.set())
+                        running[job.task_id] = (job, future, executor)
+                except Exception as e:
+                    print(f"💥\tWorker pool error: {e}")
+
+                metrics.workers_busy.set(len(running))
+                self._wake.wait(min(self.poll_interval, self.lease_seconds / 3))
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+            cursor.close()
+
+    def _finish(self, cursor: DuckDB, job: WorkflowRequestRecord, future: Future):
+        failure = stats = None
+
+        try:
+            status, source_data, stats = future.result()
+        except Exception as e:
+            status, source_data, failure = f"failed: {str(e)}", None, breaker_failure(e)
+
+        self.complete(cursor, job.task_id, self.name, status, source_data, failure, stats)
+
+    def _requeue(self, cursor: DuckDB):
+        with self._lock:
+            requeued, abandoned = cursor.requeue_expired_jobs(self.max_attempts)
+            admissions = [self._admissions.pop(str(task_id), None) for task_id in requeued + abandoned]
+
+        for admission in filter(None, admissions):
+            admission.cancel()
+
+        # the child tasks of a batch follow their batch
+        requeued = [child.task_id for task_id in requeued for child in cursor.get_batch_children(task_id)] + requeued
+        abandoned = [child.task_id for task_id in abandoned for child in cursor.get_batch_children(task_id)] + abandoned
+
+        for task_id in requeued:
+            self.writer.update_taskstatus(TaskstatusRecord(task_id=task_id, status="queued", file=None, created=None,
+                                                           updated=datetime.now()))
+        for task_id in abandoned:
+            self.writer.update_taskstatus(TaskstatusRecord(task_id=task_id,
+                                                           status=f"failed: the task was abandoned by its worker "
+                                                                  f"{self.max_attempts} times",
+                                                           file=None, created=None, updated=datetime.now()))
+
+
+class RemoteWorker:
+    """
+    Runs the queued tasks of a remote API server (``ers worker --server``).
+
+    The worker leases one job at a time from the server, runs its workflow locally (the scrape and the database
+    writes, with the local config file), renews the lease from a background thread while it runs, and reports the
+    status and the downloaded file back. Start several workers, on one or many hosts, to run more tasks at once.
+
+    Args:
+        server (str): The URL of the API server.
+        config_path (Path): The path to the config file the workflows run with.
+        name (str, optional): The name of the worker. Defaults to ``<hostname>:<pid>``.
+        poll_interval (float): How long to wait before leasing again when no job is queued, in seconds.
+        timeout (float): The timeout of the requests to the server, in seconds.
+        run (Callable): The function running a job. Defaults to ``run_job``.
+        session (requests.Session, optional): The HTTP session to the server. Defaults to a new session.
+
+    Methods:
+        serve: Runs the queued tasks until stopped.
+        run_once: Leases and runs one job.
+    """
+
+    def __init__(self, server: str, config_path: Path, name: str = None, poll_interval: float = 5,
+                 timeout: float = 30, run: Callable = run_job, session: requests.Session = None):
+        self.server = server.rstrip("/")
+        self.config_path = config_path
+        self.name = name or worker_name()
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.run = run
+        self.session = session or requests.Session()
+        # how long the server asked to wait before leasing again
+        self.retry_after = 0
+
+    def serve(self, stop: threading.Event = None, max_jobs: int = None) -> int:
+        """
+        Runs the queued tasks until ``stop`` is set or ``max_jobs`` jobs were run.
+
+        Args:
+            stop (threading.Event, optional): Stops the worker once its current job is finished.
+            max_jobs (int, optional): The number of jobs to run before stopping. Defaults to None (no limit).
+
+        Returns:
+            int: The number of jobs run.
+        """
+        stop = stop or threading.Event()
+        done = 0
+
+        while not stop.is_set() and (max_jobs is None or done < max_jobs):
+            try:
+                ran = self.run_once()
+            except requests.RequestException as e:
+                print(f"💥\tServer unreachable: {e}")
+                ran = False
+
+            if ran:
+                done += 1
+            else:
+                stop.wait(max(self.poll_interval, self.retry_after))
+
+        return done
+
+    def run_once(self) -> bool:
+        """
+        Leases and runs one job.
+
+        Returns:
+            bool: True if a job was run, False if no job was leased.
+        """
+        response = self.session.post(f"{self.server}/jobs/lease", json={"worker": self.name}, timeout=self.timeout)
+        response.raise_for_status()
+
+        if response.status_code == 204:
+            # no job is queued, or the server is throttling the scrapes
+            self.retry_after = float(response.headers.get("Retry-After", 0))
+            return False
+
+        lease = JobLease(**response.json())
+        job = lease.job
+
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job.task_id, lease.lease_seconds, finished),
+                                     name="ers-heartbeat", daemon=True)
+        heartbeat.start()
+
+        failure = stats = None
+
+        try:
+            status, source_data, stats = self.run(self.config_path, job)
+        except Exception as e:
+            status, source_data, failure = f"failed: {str(e)}", None, breaker_failure(e)
+        finally:
+            finished.set()
+            heartbeat.join()
+
+        data = {"worker": self.name, "status": status, **({"failure": failure} if failure else {}),
+                **({"stats": json.dumps(stats)} if stats else {})}
+
+        # the files of the child tasks of a batch are uploaded along, named after their task
+        uploads = [("file", Path(source_data).name, source_data)] if source_data else []
+        uploads += [("files", child_id, child["source_data"])
+                    for child_id, child in ((stats or {}).get("children") or {}).items() if child.get("source_data")]
+
+        with ExitStack() as stack:
+            files = [(field, (name, stack.enter_context(open(path, "rb")))) for field, name, path in uploads]
+            response = self.session.post(f"{self.server}/jobs/{job.task_id}/complete", data=data,
+                                         files=files or None, timeout=self.timeout)
+
+        if response.status_code == 409:
+            print(f"⚠️\tThe lease of task {job.task_id} expired: its result was discarded")
+        else:
+            response.raise_for_status()
+
+        return True
+
+    def _heartbeat(self, task_id: str, lease_seconds: float, finished: threading.Event):
+        while not finished.wait(lease_seconds / 3):
+            try:
+                response = self.session.post(f"{self.server}/jobs/{task_id}/heartbeat", json={"worker": self.name},
+                                             timeout=self.timeout)
+            except requests.RequestException:
+                continue
+            if response.status_code == 409:
+                # the job was requeued: there is no lease to renew anymore
+                return
@@ -1,5 +1,8 @@
 # package imports
 import os
+import shutil
+import time
+from collections.abc import Callable
 from datetime import datetime
 from pathlib import Path
 from uuid import uuid4
@@ -7,18 +10,21 @@ from uuid import uuid4
 import typer
 
 from eredesscraper.agent import EredesScraper
-from eredesscraper.db_clients import InfluxDB
-from eredesscraper.utils import parse_config
-from eredesscraper.models import ERSSession
-
-user_config_path = Path().home() / ".ers"
-Path.mkdir(user_config_path, exist_ok=True)
+from eredesscraper.backend import CheckpointStore, checkpoints_path
+from eredesscraper.cache import ResultCache
+from eredesscraper.models import BatchChild, CheckpointRecord, ERSSession
+from eredesscraper.pipeline import Pipeline, format_report
+from eredesscraper.profiling import profile_run
+from eredesscraper.sinks import EMPTY_SINK_TIMESTAMP, ReadingsBatch, available_sinks, write_sinks
+from eredesscraper import tracing
+from eredesscraper.utils import batch_months, parse_config, workflow_period
 
 date = datetime.now()
 
 def switchboard(config_path: Path, name: str, db: None | list = None, month: int = date.month, year: int = date.year,
                 delta: bool = False, keep: bool = False, quiet: bool = False, output: Path = Path.home() / ".ers",
-                uuid: uuid4 = uuid4(), headless: bool = True) -> ERSSession:
+                uuid: uuid4 = uuid4(), headless: bool = True, cache: bool = True, start: str = None,
+                end: str = None, profile: bool = False) -> ERSSession:
     """
     The run function is the entry point.
 
@@ -42,14 +48,71 @@ def switchboard(config_path: Path, name: str, db: None | list = None, month: int
     :type output: pathlib.Path
     :param uuid: uuid4: Specify the UUID for the session. [Optional]
     :type uuid: uuid4
+    :param cache: bool: Specify if the source data file can be served from (and is stored into) the result cache. [Optional]
+    :type cache: bool
+    :param start: str: Specify the first month of the backfill workflow, as `YYYY-MM`. [Optional]
+    :type start: str
+    :param end: str: Specify the last month of the backfill workflow, as `YYYY-MM`. Defaults to the current month. [Optional]
+    :type end: str
+    :param profile: bool: Specify if the run should be profiled. The CPU profile and the peak memory are written to `<output>/<uuid>`. [Optional]
+    :type profile: bool
     :return: ERSSession: The result object of the workflow run.
     :doc-author: Ricardo Filipe dos Santos
     """
 
-    date = datetime.now()
+    configure_tracing(config_path)
+    kwargs = dict(config_path=config_path, name=name, db=db, month=month, year=year, delta=delta, keep=keep,
+                  quiet=quiet, output=output, uuid=uuid, headless=headless, cache=cache, start=start, end=end)
+
+    # the task ID is the trace ID, so the spans of a run are found from its task status
+    with tracing.start_trace("switchboard", task_id=uuid, **{"ers.workflow": name}):
+        if not profile:
+            return _switchboard(**kwargs)
+
+        with profile_run((Path(output) if output else Path.home() / ".ers") / str(uuid)) as run_profile:
+            result = _switchboard(**kwargs)
+
+        result.profile = run_profile.path
+        if not quiet:
+            typer.echo(f"⏱️\tProfile written to: {run_profile.path} (peak memory: "
+                       f"{run_profile.peak_memory / 2 ** 20:.1f} MiB, summary: {run_profile.summary.name})")
+        return result
+
 
+def configure_tracing(config_path: Path):
+    """
+    The configure_tracing function applies the tracing settings of the config file, if it can be read.
+
+    :param config_path: Path: Specify the path to the config file
+    :type config_path: pathlib.Path
+    :return: None
+    :doc-author: Ricardo Filipe dos Santos
+    """
+    try:
+        tracing.configure(parse_config(config_path=config_path))
+    except (AssertionError, FileNotFoundError, KeyError, TypeError, ValueError):
+        # the workflow reports an unreadable config file
+        pass
+
+
+def _switchboard(config_path: Path, name: str, db: None | list, month: int, year: int, delta: bool, keep: bool,
+                 quiet: bool, output: Path, uuid: uuid4, headless: bool, cache: bool, start: str,
+                 end: str) -> ERSSession:
     output = Path(output) if output else Path.home() / ".ers"
 
+    if name == 'backfill':
+        if start is None:
+            if not quiet:
+                typer.echo(f"??\tSpecify the first month for the {typer.style(name, fg=typer.colors.GREEN)} workflow")
+            raise typer.Exit(code=1)
+
+        return backfill(config_path=config_path, start=start, end=end, db=db, delta=delta, keep=keep, quiet=quiet,
+                        output=output, uuid=uuid, headless=headless, cache=cache)
+
+    if name == 'sync':
+        return sync(config_path=config_path, db=db, keep=keep, quiet=quiet, output=output, uuid=uuid,
+                    headless=headless, cache=cache)
+
     if name not in ['current', 'previous', 'select']:
         if not quiet:
             typer.echo(f"??\tWorkflow {typer.style(name, fg=typer.colors.GREEN)} not supported")
@@ -61,107 +124,575 @@ def switchboard(config_path: Path, name: str, db: None | list = None, month: int
         raise typer.Exit(code=1)
 
     config = parse_config(config_path=config_path)
+    cpe = config['eredes']['cpe']
+    year, month = workflow_period(name, month, year)
+
     if not quiet:
         typer.echo(f"🚀\tRunning {typer.style(name, fg=typer.colors.GREEN)} workflow")
 
         typer.echo(f"📇\tE-REDES client info: "
                    f"NIF: {typer.style(config['eredes']['nif'], fg=typer.colors.GREEN, bold=True)}, "
-                   f"CPE: {typer.style(config['eredes']['cpe'], fg=typer.colors.GREEN, bold=True)}")
-
-    bot = EredesScraper(
-        nif=config['eredes']['nif'],
-        password=config['eredes']['pwd'],
-        cpe_code=config['eredes']['cpe'],
-        quiet=quiet,
-        headless=headless,
-        uuid=uuid
-    )
+                   f"CPE: {typer.style(cpe, fg=typer.colors.GREEN, bold=True)}")
 
-    match name:
-        case 'current':
-            bot.run(month=date.month, year=date.year)
+    result_cache = ResultCache.from_config(config) if cache else None
+    entry = result_cache.get(cpe, year, month) if result_cache else None
+    bot = None
+    timings = {}
 
-        case 'previous':
-            bot.run(month=date.month - 1, year=date.year)
+    if entry is not None:
+        if not quiet:
+            typer.echo(f"⚡\tReadings of {year}-{month:02d} served from the cache: {entry.source}")
+        session_id = uuid
+        source = entry.source
+    else:
+        bot = EredesScraper(
+            nif=config['eredes']['nif'],
+            password=config['eredes']['pwd'],
+            cpe_code=cpe,
+            quiet=quiet,
+            headless=headless,
+            uuid=uuid
+        )
 
-        case 'select':
-            bot.run(month=month, year=year)
+        bot.run(month=month, year=year)
 
-        case _:
-            if not quiet:
-                typer.echo(f"??\tWorkflow {typer.style(name, fg=typer.colors.GREEN)} not supported")
-            raise typer.Exit(code=1)
+        session_id = bot.session_id
+        source = bot.dwnl_file
+        timings.update(bot.timings)
 
-    for conn in db:
-        match conn:
-            case 'influxdb':
-                client = InfluxDB(
-                    token=config['influxdb']['token'],
-                    org=config['influxdb']['org'],
-                    host=config['influxdb']['host'],
-                    port=config['influxdb']['port'],
-                    bucket=config['influxdb']['bucket'],
-                    quiet=quiet)
-                client.connect()
-                client.load(source_data=bot.dwnl_file, cpe_code=config['eredes']['cpe'], delta=delta)
-                if not quiet:
-                    typer.echo(f"📈\tLoaded data from {bot.dwnl_file} into the InfluxDB database")
-            case None:
-                pass
+    result = load_source(config=config, name=name, cpe=cpe, month=month, year=year, source=source, entry=entry,
+                         db=db, delta=delta, keep=keep, quiet=quiet, output=output, session_id=session_id,
+                         result_cache=result_cache, timings=timings)
 
-            case '':
-                pass
+    if bot is not None:
+        bot.dwnl_file = result.source_data or bot.dwnl_file
+        if not keep:
+            remove_staging_area(bot.tmp, quiet=quiet)
 
-            case _:
-                if not quiet:
-                    typer.echo(f"??\tDatabase {typer.style(db, fg=typer.colors.GREEN)} not supported")
+    return result
 
-    if not keep:
+
+def load_source(config: dict, name: str, cpe: str, month: int, year: int, source: Path, entry, db: None | list,
+                delta: bool, keep: bool, quiet: bool, output: Path, session_id, result_cache: ResultCache | None,
+                timings: dict, batch: ReadingsBatch = None) -> ERSSession:
+    """
+    The load_source function loads a source data file into the databases, caches it and keeps (or removes) it.
+
+    :param config: dict: Specify the parsed config file.
+    :type config: dict
+    :param name: str: Specify the workflow that was run.
+    :type name: str
+    :param cpe: str: Specify the CPE of the readings.
+    :type cpe: str
+    :param month: int: Specify the month of the readings (1-12).
+    :type month: int
+    :param year: int: Specify the year of the readings (YYYY).
+    :type year: int
+    :param source: Path: Specify the source data file.
+    :type source: pathlib.Path
+    :param entry: CacheEntry: Specify the cache entry the file was served from, or None if it was downloaded.
+    :type entry: eredesscraper.cache.CacheEntry
+    :param db: list: Specify the list of database connections to use.
+    :type db: list
+    :param delta: bool: Specify if the data should be loaded as a delta.
+    :type delta: bool
+    :param keep: bool: Specify if the source data file should be kept after loading.
+    :type keep: bool
+    :param quiet: bool: Specify if the function should run in quiet mode.
+    :type quiet: bool
+    :param output: Path: Specify the path to write the source data file.
+    :type output: pathlib.Path
+    :param session_id: uuid4: Specify the UUID of the session.
+    :type session_id: uuid4
+    :param result_cache: ResultCache: Specify the result cache, or None if it is bypassed.
+    :type result_cache: eredesscraper.cache.ResultCache
+    :param timings: dict: Specify the timings of the session so far.
+    :type timings: dict
+    :param batch: ReadingsBatch: Specify the readings of the file, if they were already parsed. [Optional]
+    :type batch: eredesscraper.sinks.ReadingsBatch
+    :return: ERSSession: The result object of the workflow run.
+    :doc-author: Ricardo Filipe dos Santos
+    """
+    db = [conn for conn in (db or []) if conn]
+    sink_results = []
+
+    if db:
+        # parse the file once and share the batch across all the sinks
+        if batch is None:
+            started = time.perf_counter()
+            batch = parse_source(cpe, source, entry)
+            timings["parse"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        sink_results = write_sinks(batch, db, config=config, delta=delta, quiet=quiet)
+        timings["sinks"] = time.perf_counter() - started
+
+    if entry is None and result_cache is not None:
         try:
-            bot.dwnl_file.unlink()
-            Path.rmdir(bot.tmp)
-            if not quiet:
-                typer.echo(f"💀\tRemoved the source data file and the staging area: {bot.dwnl_file}")
-
-            result = ERSSession(
-                session_id=bot.session_id,
-                workflow=name,
-                databases=db,
-                source_data=None,
-                status="completed",
-                timestamp=datetime.now()
-            )
-
-            return result
-        except PermissionError:
+            result_cache.put(cpe, year, month, source, batch=batch)
+        except OSError as e:
             if not quiet:
-                typer.echo("💥\tPermission denied to remove the source data and/or staging area for the ERS")
-
-            result = ERSSession(
-                session_id=bot.session_id,
-                workflow=name,
-                databases=db,
-                source_data=bot.dwnl_file,
-                status="completed",
-                timestamp=datetime.now()
-            )
-
-            return result
+                typer.echo(f"💥\tFailed to cache the source data file: {e}")
+
+    status = "completed" if all(r.ok for r in sink_results) else "completed with sink errors"
+
+    if not keep:
+        source_data = None
+        if entry is None:
+            try:
+                source.unlink()
+                if not quiet:
+                    typer.echo(f"💀\tRemoved the source data file: {source}")
+            except PermissionError:
+                source_data = source
+                if not quiet:
+                    typer.echo("💥\tPermission denied to remove the source data for the ERS")
     else:
-        out = Path(output / bot.session_id.__str__())
+        out = Path(output / session_id.__str__())
         Path.mkdir(out, exist_ok=True, parents=True)
-        os.rename(bot.dwnl_file, out / bot.dwnl_file.name)
-        bot.dwnl_file = Path(out / bot.dwnl_file.name)
+        source_data = Path(out / source.name)
+        if entry is not None:
+            shutil.copyfile(source, source_data)
+        else:
+            os.rename(source, source_data)
+        if not quiet:
+            typer.echo(f"📂\tSource data file written to: {source_data}")
+
+    return ERSSession(
+        session_id=session_id,
+        workflow=name,
+        databases=db,
+        source_data=source_data,
+        status=status,
+        sinks=sink_results,
+        timestamp=datetime.now(),
+        timings=timings,
+        watermark=batch.frame.index.max().to_pydatetime() if batch is not None and len(batch) else None
+    )
+
+
+def parse_source(cpe: str, source: Path, entry=None) -> ReadingsBatch:
+    """
+    The parse_source function parses the readings of a source data file, or takes them from its cache entry.
+
+    :param cpe: str: Specify the CPE of the readings.
+    :type cpe: str
+    :param source: Path: Specify the source data file.
+    :type source: pathlib.Path
+    :param entry: CacheEntry: Specify the cache entry the file was served from, or None if it was downloaded. [Optional]
+    :type entry: eredesscraper.cache.CacheEntry
+    :return: ReadingsBatch: The readings of the file.
+    :doc-author: Ricardo Filipe dos Santos
+    """
+    return entry.batch() if entry is not None else ReadingsBatch.from_file(source, cpe_code=cpe)
+
+
+def remove_staging_area(tmp: str, quiet: bool = False):
+    """
+    The remove_staging_area function removes the staging area of the scraper, once its files were loaded.
+
+    :param tmp: str: Specify the path to the staging area.
+    :type tmp: str
+    :param quiet: bool: Specify if the function should run in quiet mode. [Optional]
+    :type quiet: bool
+    :return: None
+    :doc-author: Ricardo Filipe dos Santos
+    """
+    try:
+        Path.rmdir(Path(tmp))
         if not quiet:
-            typer.echo(f"📂\tSource data file written to: {bot.dwnl_file}")
-
-        result = ERSSession(
-            session_id=bot.session_id,
-            workflow=name,
-            databases=db,
-            source_data=bot.dwnl_file,
-            status="completed",
-            timestamp=datetime.now()
+            typer.echo(f"💀\tRemoved the staging area: {tmp}")
+    except PermissionError:
+        if not quiet:
+            typer.echo("💥\tPermission denied to remove the staging area for the ERS")
+    except OSError:
+        # other runs are still using it
+        pass
+
+
+def batch_switchboard(config_path: Path, children: list, db: None | list = None, delta: bool = False,
+                      keep: bool = False, quiet: bool = False, output: Path = Path.home() / ".ers",
+                      headless: bool = True, cache: bool = True, on_result: Callable = None,
+                      stages: dict = None, uuid: uuid4 = None) -> list:
+    """
+    The batch_switchboard function runs the select workflow for many months and CPEs of the account, logging in once.
+
+    The months already in the result cache are not downloaded. The others are downloaded in a single browser
+    session, so E-REDES sees a single login however many months are loaded. The months go through a pipeline of
+    download, parse and sinks stages (see ``eredesscraper.pipeline.Pipeline``): a month is downloaded while the
+    month before it is parsed, and the one before that is written into the databases.
+
+    :param config_path: Path: Specify the path to the config file
+    :type config_path: pathlib.Path
+    :param children: list: Specify the ``BatchChild`` (task ID, CPE, month and year) of each month to load.
+    :type children: list
+    :param db: list: Specify the list of database connections to use.
+    :type db: list
+    :param delta: bool: Specify if the data should be loaded as a delta. [Optional]
+    :type delta: bool
+    :param keep: bool: Specify if the source data files should be kept after loading. [Optional]
+    :type keep: bool
+    :param quiet: bool: Specify if the function should run in quiet mode. [Optional]
+    :type quiet: bool
+    :param output: Path: Specify the path to write the source data files. [Optional]
+    :type output: pathlib.Path
+    :param cache: bool: Specify if the source data files can be served from (and are stored into) the result cache. [Optional]
+    :type cache: bool
+    :param on_result: Callable: Specify a function called with each child and its result, as soon as it is loaded. [Optional]
+    :type on_result: Callable
+    :param stages: dict: Specify a dict to fill with the utilization of each stage of the pipeline. [Optional]
+    :type stages: dict
+    :param uuid: uuid4: Specify the UUID of the batch task, the trace ID of its spans. [Optional]
+    :type uuid: uuid4
+    :return: list: The result object of each child, in the order of ``children``. A failed child has a `failed` status.
+    :raises CaptchaError: If E-REDES asked for a captcha, so the months left could not be downloaded.
+    :raises LoginError: If E-REDES rejected the credentials.
+    :doc-author: Ricardo Filipe dos Santos
+    """
+    output = Path(output) if output else Path.home() / ".ers"
+    db = [conn for conn in (db or []) if conn]
+    config = parse_config(config_path=config_path)
+    result_cache = ResultCache.from_config(config) if cache else None
+    tracing.configure(config)
+
+    entries = {child.task_id: result_cache.get(child.cpe, child.year, child.month) if result_cache else None
+               for child in children}
+    missing = [child for child in children if entries[child.task_id] is None]
+    results = {}
+
+    if not quiet:
+        typer.echo(f"🚀\tRunning a batch of {len(children)} months: {len(children) - len(missing)} served from the "
+                   f"cache, {len(missing)} to download")
+
+    def failed(child, error) -> ERSSession:
+        return ERSSession(session_id=child.task_id, workflow="select", databases=db, source_data=None,
+                          status=f"failed: {error}", timestamp=datetime.now())
+
+    def parse(item) -> tuple:
+        child, source, entry, timings = item
+        batch = None
+
+        if db and not isinstance(source, Exception):
+            started = time.perf_counter()
+            try:
+                batch = parse_source(child.cpe, source, entry)
+            except Exception as e:
+                source = e
+            timings["parse"] = time.perf_counter() - started
+
+        return child, source, entry, timings, batch
+
+    def load(item):
+        child, source, entry, timings, batch = item
+
+        with tracing.span("batch.month", **{"ers.task_id": str(child.task_id),
+                                            "ers.month": f"{child.year}-{child.month:02d}"}):
+            if isinstance(source, Exception):
+                result = failed(child, source)
+            else:
+                try:
+                    result = load_source(config=config, name="select", cpe=child.cpe, month=child.month,
+                                         year=child.year, source=source, entry=entry, db=db, delta=delta, keep=keep,
+                                         quiet=quiet, output=output, session_id=child.task_id,
+                                         result_cache=result_cache, timings=timings, batch=batch)
+                except Exception as e:
+                    result = failed(child, str(e))
+
+            results[child.task_id] = result
+            if on_result is not None:
+                on_result(child, result)
+
+    bot = None
+
+    def download():
+        nonlocal bot
+
+        # the cached months go first: they are parsed while the browser logs in
+        for child in children:
+            if entries[child.task_id] is not None:
+                yield child, entries[child.task_id].source, entries[child.task_id], {}
+
+        if not missing:
+            return
+
+        bot = EredesScraper(
+            nif=config['eredes']['nif'],
+            password=config['eredes']['pwd'],
+            cpe_code=missing[0].cpe,
+            quiet=quiet,
+            headless=headless,
+            uuid=uuid4()
         )
+        keys = {str(child.task_id): child for child in missing}
+        spent = {}
 
-        return result
+        for key, source in bot.download_many([(key, child.cpe, child.month, child.year)
+                                              for key, child in keys.items()]):
+            # the time each phase spent on this month (the first one also logged in)
+            timings = {phase: seconds - spent.get(phase, 0) for phase, seconds in bot.timings.items()
+                       if seconds - spent.get(phase, 0) > 0}
+            spent = dict(bot.timings)
+            yield keys[key], source, None, timings
+
+    pipeline = Pipeline([("parse", parse), ("sinks", load)], feeder="download")
+
+    try:
+        # the browser runs in this thread: the downloads feed the pipeline
+        with tracing.start_trace("batch_switchboard", task_id=uuid, **{"ers.months": len(children)}), pipeline:
+            pipeline.feed(download())
+    finally:
+        report = pipeline.report()
+        if stages is not None:
+            stages.update(report)
+        if not quiet:
+            typer.echo(f"📊\tPipeline: {format_report(report)}")
+
+    if bot is not None and not keep:
+        remove_staging_area(bot.tmp, quiet=quiet)
+
+    return [results.get(child.task_id) or failed(child, "not downloaded") for child in children]
+
+
+def backfill(config_path: Path, start: str, end: str = None, db: None | list = None, delta: bool = False,
+             keep: bool = False, quiet: bool = False, output: Path = Path.home() / ".ers", uuid: uuid4 = uuid4(),
+             headless: bool = True, cache: bool = True, checkpoints: Path = checkpoints_path) -> ERSSession:
+    """
+    The backfill function loads a range of months of the CPE, resuming where the previous runs stopped.
+
+    Each month is checkpointed as soon as it is loaded (or fails), so a backfill stopped by a crash, a captcha or a
+    login failure is resumed by running it again: the months already loaded into the same databases are skipped,
+    and only the failed (or never tried) months are downloaded, in a single browser session. The current month is
+    never checkpointed as loaded, since its readings are still growing.
+
+    :param config_path: Path: Specify the path to the config file
+    :type config_path: pathlib.Path
+    :param start: str: Specify the first month to load, as `YYYY-MM`.
+    :type start: str
+    :param end: str: Specify the last month to load, as `YYYY-MM`. Defaults to the current month. [Optional]
+    :type end: str
+    :param db: list: Specify the list of database connections to use.
+    :type db: list
+    :param delta: bool: Specify if the data should be loaded as a delta. [Optional]
+    :type delta: bool
+    :param keep: bool: Specify if the source data files should be kept after loading. [Optional]
+    :type keep: bool
+    :param quiet: bool: Specify if the function should run in quiet mode. [Optional]
+    :type quiet: bool
+    :param output: Path: Specify the path to write the source data files. [Optional]
+    :type output: pathlib.Path
+    :param uuid: uuid4: Specify the UUID for the session. [Optional]
+    :type uuid: uuid4
+    :param cache: bool: Specify if the source data files can be served from (and are stored into) the result cache. [Optional]
+    :type cache: bool
+    :param checkpoints: Path: Specify the path to the checkpoints file. [Optional]
+    :type checkpoints: pathlib.Path
+    :return: ERSSession: The result object of the workflow run, with the sink results of every month loaded.
+    :raises ValueError: If the range of months is invalid.
+    :raises CaptchaError: If E-REDES asked for a captcha. The months loaded so far are checkpointed.
+    :raises LoginError: If E-REDES rejected the credentials.
+    :doc-author: Ricardo Filipe dos Santos
+    """
+    today = datetime.now()
+    periods = batch_months(start=start, end=end, today=today.date())
+    db = [conn for conn in (db or []) if conn]
+    sinks = ",".join(sorted(db))
+    cpe = parse_config(config_path=config_path)['eredes']['cpe']
+
+    with CheckpointStore(checkpoints) as store:
+        done = store.get(cpe, sinks)
+        children = [BatchChild(task_id=str(uuid4()), cpe=cpe, month=month, year=year) for year, month in periods
+                    if getattr(done.get((year, month)), "state", None) != "loaded"]
+
+        if not quiet:
+            typer.echo(f"🚀\tRunning {typer.style('backfill', fg=typer.colors.GREEN)} workflow: {len(periods)} "
+                       f"months, {len(periods) - len(children)} already loaded")
+
+        def checkpoint(child: BatchChild, result: ERSSession):
+            previous = done.get((child.year, child.month))
+            if result.status == "completed":
+                current = (child.year, child.month) == (today.year, today.month)
+                state, error = ("partial" if current else "loaded"), None
+            else:
+                state = "failed"
+                error = "; ".join(f"{r.sink}: {r.error}" for r in result.sinks if not r.ok) or result.status
+
+            store.put(CheckpointRecord(cpe=cpe, sinks=sinks, year=child.year, month=child.month, state=state,
+                                       attempts=(previous.attempts if previous else 0) + 1, error=error))
+
+        stages = {}
+        results = batch_switchboard(config_path=config_path, children=children, db=db, delta=delta, keep=keep,
+                                    quiet=quiet, output=output, headless=headless, cache=cache,
+                                    on_result=checkpoint, stages=stages, uuid=uuid) if children else []
+
+    return summarize_months("backfill", uuid, db, results, stages, quiet=quiet)
+
+
+def summarize_months(name: str, uuid, db: list, results: list, stages: dict, watermark: datetime = None,
+                     quiet: bool = False) -> ERSSession:
+    """
+    The summarize_months function combines the results of the months loaded by a multi-month workflow.
+
+    :param name: str: Specify the workflow that was run.
+    :type name: str
+    :param uuid: uuid4: Specify the UUID of the session.
+    :type uuid: uuid4
+    :param db: list: Specify the list of database connections used.
+    :type db: list
+    :param results: list: Specify the result object of each month.
+    :type results: list
+    :param stages: dict: Specify the utilization of each stage of the pipeline.
+    :type stages: dict
+    :param watermark: datetime: Specify the latest reading loaded. [Optional]
+    :type watermark: datetime
+    :param quiet: bool: Specify if the function should run in quiet mode. [Optional]
+    :type quiet: bool
+    :return: ERSSession: The result object of the workflow run, with the sink results of every month.
+    :doc-author: Ricardo Filipe dos Santos
+    """
+    failed = [result for result in results if not result.status.startswith("completed")]
+    if results and len(failed) == len(results):
+        status = f"failed: the {len(failed)} months failed ({failed[0].status})"
+    elif failed:
+        status = f"completed with {len(failed)} failed months"
+    elif any(result.status != "completed" for result in results):
+        status = "completed with sink errors"
+    else:
+        status = "completed"
+
+    timings = {}
+    for result in results:
+        for phase, seconds in result.timings.items():
+            timings[phase] = timings.get(phase, 0) + seconds
+
+    if not quiet:
+        typer.echo(f"🏁\t{name.capitalize()} {status}: {len(results) - len(failed)} months loaded, "
+                   f"{len(failed)} failed")
+
+    return ERSSession(
+        session_id=uuid,
+        workflow=name,
+        databases=db,
+        source_data=None,
+        status=status,
+        sinks=[r for result in results for r in result.sinks],
+        timestamp=datetime.now(),
+        timings=timings,
+        stages=stages,
+        watermark=watermark
+    )
+
+
+def sink_watermark(config: dict, cpe: str, db: list, quiet: bool = False) -> datetime | None:
+    """
+    The sink_watermark function returns the latest reading of a CPE held by all the databases.
+
+    :param config: dict: Specify the parsed config file.
+    :type config: dict
+    :param cpe: str: Specify the CPE.
+    :type cpe: str
+    :param db: list: Specify the list of database connections to query.
+    :type db: list
+    :param quiet: bool: Specify if the function should run in quiet mode. [Optional]
+    :type quiet: bool
+    :return: datetime: The earliest of the latest readings of the databases, or None if a database holds no
+        readings of the CPE or could not be queried.
+    :doc-author: Ricardo Filipe dos Santos
+    """
+    sinks = available_sinks()
+    marks = []
+
+    for name in db:
+        try:
+            sink = sinks[name].from_config(config, quiet=True)
+            sink.connect()
+            try:
+                marks.append(sink.last_insert(cpe_code=cpe))
+            finally:
+                sink.close()
+        except Exception as e:
+            if not quiet:
+                typer.echo(f"💥\tFailed to read the latest reading from {name}: {e}")
+            return None
+
+    if not marks or EMPTY_SINK_TIMESTAMP in marks:
+        return None
+    return min(marks)
+
+
+def sync(config_path: Path, db: None | list = None, keep: bool = False, quiet: bool = False,
+         output: Path = Path.home() / ".ers", uuid: uuid4 = uuid4(), headless: bool = True, cache: bool = True,
+         checkpoints: Path = checkpoints_path, today: datetime = None) -> ERSSession:
+    """
+    The sync function loads the readings of the CPE missing from the databases, from the latest reading they hold
+    up to now.
+
+    The latest reading is read from the databases. If one of them cannot tell (e.g. it is unreachable, or does not
+    support queries), the local watermark of the previous sync into the same databases is used. The months from the
+    one of the latest reading up to the current month are loaded as deltas, so only the new readings are written,
+    and missed runs only cost the months they skipped. Without any reading to start from, only the current month is
+    loaded: load the history with the backfill workflow.
+
+    :param config_path: Path: Specify the path to the config file
+    :type config_path: pathlib.Path
+    :param db: list: Specify the list of database connections to use.
+    :type db: list
+    :param keep: bool: Specify if the source data files should be kept after loading. [Optional]
+    :type keep: bool
+    :param quiet: bool: Specify if the function should run in quiet mode. [Optional]
+    :type quiet: bool
+    :param output: Path: Specify the path to write the source data files. [Optional]
+    :type output: pathlib.Path
+    :param uuid: uuid4: Specify the UUID for the session. [Optional]
+    :type uuid: uuid4
+    :param cache: bool: Specify if the source data files can be served from (and are stored into) the result cache. [Optional]
+    :type cache: bool
+    :param checkpoints: Path: Specify the path to the file of the local watermarks. [Optional]
+    :type checkpoints: pathlib.Path
+    :param today: datetime: Specify the current time. Defaults to now. [Optional]
+    :type today: datetime
+    :return: ERSSession: The result object of the workflow run, with the new watermark.
+    :raises CaptchaError: If E-REDES asked for a captcha. The watermark is not moved.
+    :raises LoginError: If E-REDES rejected the credentials.
+    :doc-author: Ricardo Filipe dos Santos
+    """
+    today = today or datetime.now()
+    db = [conn for conn in (db or []) if conn]
+    sinks = ",".join(sorted(db))
+    config = parse_config(config_path=config_path)
+    cpe = config['eredes']['cpe']
+
+    with CheckpointStore(checkpoints) as store:
+        watermark = sink_watermark(config, cpe, db, quiet=quiet) or store.get_watermark(cpe, sinks)
+
+        if watermark is None:
+            start = f"{today:%Y-%m}"
+            if not quiet:
+                typer.echo(f"💡\tNo readings of {cpe} found: loading the current month only. Load the previous months "
+                           f"with the {typer.style('backfill', fg=typer.colors.GREEN)} workflow")
+        else:
+            # the readings of a month end at 00:00 of the next one: a complete month starts the next one
+            start = min(f"{watermark:%Y-%m}", f"{today:%Y-%m}")
+
+        periods = batch_months(start=start, today=today.date())
+        children = [BatchChild(task_id=str(uuid4()), cpe=cpe, month=month, year=year) for year, month in periods]
+
+        if not quiet:
+            typer.echo(f"🚀\tRunning {typer.style('sync', fg=typer.colors.GREEN)} workflow from "
+                       f"{watermark or 'the current month'}: {len(children)} months to load")
+
+        stages = {}
+        results = batch_switchboard(config_path=config_path, children=children, db=db, delta=True, keep=keep,
+                                    quiet=quiet, output=output, headless=headless, cache=cache, stages=stages,
+                                    uuid=uuid)
+
+        # the watermark only moves over the months loaded without gaps
+        for result in results:
+            if result.status != "completed":
+                break
+            if result.watermark is not None and (watermark is None or result.watermark > watermark):
+                watermark = result.watermark
+
+        if watermark is not None and db:
+            store.put_watermark(cpe, sinks, watermark)
+
+    return summarize_months("sync", uuid, db, results, stages, watermark=watermark, quiet=quiet)
@@ -0,0 +1,441 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from pathlib import Path
+from uuid import UUID, uuid4
+
+import pytest
+import yaml
+from fastapi.testclient import TestClient
+
+from eredesscraper import api
+from eredesscraper.agent import CaptchaError
+from eredesscraper.backend import DuckDB
+from eredesscraper.blobstore import BlobStore
+from eredesscraper.models import ERSSession, ScheduleEntry, TaskstatusRecord, WorkflowRequestRecord
+from eredesscraper.utils import parse_config, save_config
+from eredesscraper.workers import RemoteWorker, WorkerPool
+
+
+def write_config(tmp_path, config_path, **sections) -> Path:
+    config = yaml.safe_load(config_path.read_text())
+    path = tmp_path / 'config.yml'
+    path.write_text(yaml.dump({**config, **sections}))
+    return path
+
+
+@pytest.fixture
+def client(tmp_path, config_path, monkeypatch):
+    monkeypatch.setattr(api, 'config_path', write_config(tmp_path, config_path,
+                                                         limits={'rate_per_minute': 600, 'burst': 10,
+                                                                 'max_concurrent': 10}))
+    monkeypatch.setattr(api, 'DuckDB', partial(DuckDB, (tmp_path / 'ers.db').as_posix()))
+    monkeypatch.setattr(api, 'BlobStore', partial(BlobStore, tmp_path / 'files'))
+    monkeypatch.setattr(api, 'WorkerPool', partial(WorkerPool, executor=ThreadPoolExecutor(2), run=run_job))
+
+    with TestClient(api.app) as client:
+        yield client
+
+
+def run_job(config_path, job):
+    return 'completed', None, {}
+
+
+def add_task(client, status='completed', file_path=None) -> str:
+    task_id = uuid4()
+    writer = client.app.state.writer
+
+    writer.insert_workflow_request(WorkflowRequestRecord(task_id=task_id, workflow='current', db=[], month=None,
+                                                         year=None, delta=False, download=True))
+    writer.insert_taskstatus(TaskstatusRecord(task_id=task_id, status=status, file=None, created=datetime.now(),
+                                              updated=datetime.now(),
+                                              file_hash=client.app.state.blobs.put(file_path) if file_path else None)
+                             ).result()
+
+    return str(task_id)
+
+
+def test_status(client):
+    task_id = add_task(client, status='queued')
+
+    response = client.get(f'/status/{task_id}')
+    assert response.status_code == 200
+    assert response.json()['status'] == 'queued'
+
+    assert client.get(f'/status/{uuid4()}').status_code == 404
+
+
+def test_download(client):
+    file_path = Path(__file__).parent / 'example.xlsx'
+    content = file_path.read_bytes()
+    task_id = add_task(client, file_path=file_path)
+
+    response = client.get(f'/download/{task_id}')
+    assert response.status_code == 200
+    assert response.content == content
+    etag = response.headers['etag']
+
+    assert client.get(f'/download/{task_id}', headers={'If-None-Match': etag}).status_code == 304
+
+    response = client.get(f'/download/{task_id}', headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert response.content == content[10:20]
+    assert response.headers['content-range'] == f'bytes 10-19/{len(content)}'
+
+    response = client.get(f'/download/{task_id}', headers={'Range': 'bytes=-5'})
+    assert response.content == content[-5:]
+
+    response = client.get(f'/download/{task_id}', headers={'Range': f'bytes={len(content)}-'})
+    assert response.status_code == 416
+
+    assert client.get(f'/download/{add_task(client)}').status_code == 404
+
+
+def test_list_tasks(client):
+    task_ids = [add_task(client, status='failed: captcha' if i % 2 else 'completed') for i in range(5)]
+
+    pages, cursor = [], None
+    while True:
+        response = client.get('/tasks', params={'limit': 2, **({'cursor': cursor} if cursor else {})})
+        assert response.status_code == 200
+        pages.append(response.json()['tasks'])
+        cursor = response.json()['next_cursor']
+        if cursor is None:
+            break
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert sorted(task['task_id'] for page in pages for task in page) == sorted(task_ids)
+
+    response = client.get('/tasks', params={'status': 'failed'})
+    assert len(response.json()['tasks']) == 2
+
+    assert client.get('/tasks', params={'cursor': 'invalid'}).status_code == 400
+
+
+def test_stream_status(client):
+    task_id = add_task(client, status='running')
+    # the test client buffers the whole stream, so the task completes while the request is running
+    done = threading.Timer(0.5, client.app.state.writer.update_taskstatus,
+                           [TaskstatusRecord(task_id=task_id, status='completed', file=None, created=None,
+                                             updated=datetime.now())])
+    done.start()
+
+    with client.stream('GET', f'/status/{task_id}/stream') as response:
+        assert response.headers['content-type'].startswith('text/event-stream')
+        events = [json.loads(line[len('data: '):]) for line in response.iter_lines() if line.startswith('data: ')]
+
+    assert [event['status'] for event in events] == ['running', 'completed']
+    assert events[-1]['finished']
+
+    assert client.get(f'/status/{uuid4()}/stream').status_code == 404
+
+
+def test_status_websocket(client):
+    task_ids = [add_task(client, status='queued') for _ in range(2)]
+
+    with client.websocket_connect('/ws/status') as websocket:
+        websocket.send_json({'subscribe': task_ids})
+        assert {websocket.receive_json()['task_id'] for _ in task_ids} == set(task_ids)
+
+        for task_id in task_ids:
+            client.app.state.writer.update_taskstatus(TaskstatusRecord(task_id=task_id, status='running', file=None,
+                                                                       created=None, updated=datetime.now()))
+        events = [websocket.receive_json() for _ in task_ids]
+        assert {event['task_id'] for event in events} == set(task_ids)
+        assert all(event['status'] == 'running' for event in events)
+
+
+def test_run_async(client):
+    response = client.post('/run_async', json={'workflow': 'current', 'db': []})
+    assert response.status_code == 200
+    task_id = response.json()['task_id']
+
+    for _ in range(50):
+        if client.get(f'/status/{task_id}').json()['status'] == 'completed':
+            break
+        time.sleep(0.1)
+
+    assert client.get(f'/status/{task_id}').json()['status'] == 'completed'
+    assert client.app.state.ddb.query("SELECT count(*) FROM jobs").fetchone()[0] == 0
+
+
+def test_remote_workers(tmp_path, config_path, monkeypatch):
+    monkeypatch.setattr(api, 'config_path', write_config(tmp_path, config_path, limits={'max_concurrent': 3,
+                                                                                         'burst': 6}))
+    monkeypatch.setattr(api, 'DuckDB', partial(DuckDB, (tmp_path / 'ers.db').as_posix()))
+    monkeypatch.setattr(api, 'BlobStore', partial(BlobStore, tmp_path / 'files'))
+    # the tasks are left to the remote workers
+    monkeypatch.setattr(api, 'WorkerPool', lambda *args, **kwargs: WorkerPool(*args, **{**kwargs, 'processes': 0}))
+
+    def run(config_path, job):
+        source = tmp_path / f'{job.task_id}.xlsx'
+        source.write_bytes(job.task_id.bytes)
+        return 'completed', source, {}
+
+    with TestClient(api.app) as client:
+        task_ids = [client.post('/run_async', json={'workflow': 'select', 'month': month, 'year': 2023}).json()['task_id']
+                    for month in range(1, 7)]
+
+        workers = [RemoteWorker('http://testserver', config_path, name=f'worker-{i}', poll_interval=0.05,
+                                run=run, session=client) for i in range(3)]
+        with ThreadPoolExecutor(len(workers)) as pool:
+            done = list(pool.map(lambda worker: worker.serve(max_jobs=2), workers))
+
+        assert done == [2, 2, 2]
+        for task_id in task_ids:
+            assert client.get(f'/status/{task_id}').json()['status'] == 'completed'
+            assert client.get(f'/download/{task_id}').content == UUID(task_id).bytes
+
+        assert client.post('/jobs/lease', json={'worker': 'worker-0'}).status_code == 204
+        assert client.post(f'/jobs/{task_ids[0]}/heartbeat', json={'worker': 'worker-0'}).status_code == 409
+        assert client.post(f'/jobs/{task_ids[0]}/complete',
+                           data={'worker': 'worker-0', 'status': 'completed'}).status_code == 409
+
+
+def test_run_single_flight(client, monkeypatch):
+    calls = []
+
+    def switchboard(**kwargs):
+        calls.append(kwargs)
+        time.sleep(0.5)
+        return ERSSession(session_id=kwargs['uuid'], workflow=kwargs['name'], databases=kwargs['db'],
+                          source_data=None, status='completed', timestamp=datetime.now())
+
+    monkeypatch.setattr(api, 'switchboard', switchboard)
+
+    with ThreadPoolExecutor(3) as pool:
+        responses = list(pool.map(lambda month: client.post('/run', json={'workflow': 'select', 'month': month,
+                                                                         'year': 2023}), [5, 5, 6]))
+
+    assert [response.status_code for response in responses] == [200] * 3
+    assert len(calls) == 2
+    task_ids = [response.json()['task_id'] for response in responses]
+    assert task_ids[0] == task_ids[1] != task_ids[2]
+    assert len(client.app.state.flights) == 0
+
+
+def test_run_profile(client, monkeypatch, tmp_path):
+    calls = []
+
+    def switchboard(**kwargs):
+        calls.append(kwargs)
+        return ERSSession(session_id=kwargs['uuid'], workflow=kwargs['name'], databases=kwargs['db'],
+                          source_data=None, status='completed', timestamp=datetime.now(),
+                          profile=tmp_path / kwargs['uuid'] / 'profile.pstats' if kwargs['profile'] else None)
+
+    monkeypatch.setattr(api, 'switchboard', switchboard)
+
+    task_id = client.post('/run?profile=1', json={'workflow': 'current'}).json()['task_id']
+    assert calls[-1]['profile'] is True
+    assert client.get(f'/status/{task_id}').json()['profile'] == str(tmp_path / task_id / 'profile.pstats')
+
+    task_id = client.post('/run', json={'workflow': 'previous'}).json()['task_id']
+    assert calls[-1]['profile'] is False
+    assert client.get(f'/status/{task_id}').json()['profile'] is None
+
+
+def test_run_async_single_flight(tmp_path, config_path, monkeypatch):
+    monkeypatch.setattr(api, 'DuckDB', partial(DuckDB, (tmp_path / 'ers.db').as_posix()))
+    monkeypatch.setattr(api, 'BlobStore', partial(BlobStore, tmp_path / 'files'))
+    # the tasks stay queued
+    monkeypatch.setattr(api, 'WorkerPool', lambda *args, **kwargs: WorkerPool(*args, **{**kwargs, 'processes': 0}))
+
+    with TestClient(api.app) as client:
+        monkeypatch.setattr(api, 'config_path', config_path)
+
+        first = client.post('/run_async', json={'workflow': 'current', 'db': ['influxdb', 'duckdb']}).json()
+        month, year = datetime.now().month, datetime.now().year
+        same = client.post('/run_async', json={'workflow': 'select', 'month': month, 'year': year,
+                                               'db': ['duckdb', 'influxdb']}).json()
+        other = client.post('/run_async', json={'workflow': 'current', 'db': ['influxdb']}).json()
+
+    assert same['task_id'] == first['task_id'] != other['task_id']
+
+    # the queued task is found again after a restart
+    with TestClient(api.app) as client:
+        again = client.post('/run_async', json={'workflow': 'current', 'db': ['duckdb', 'influxdb']}).json()
+
+    assert again['task_id'] == first['task_id']
+
+
+def test_rate_limits(tmp_path, config_path, monkeypatch):
+    monkeypatch.setattr(api, 'config_path', write_config(tmp_path, config_path,
+                                                         limits={'rate_per_minute': 1, 'burst': 1, 'max_queued': 1}))
+    monkeypatch.setattr(api, 'DuckDB', partial(DuckDB, (tmp_path / 'ers.db').as_posix()))
+    monkeypatch.setattr(api, 'BlobStore', partial(BlobStore, tmp_path / 'files'))
+    monkeypatch.setattr(api, 'WorkerPool', lambda *args, **kwargs: WorkerPool(*args, **{**kwargs, 'processes': 0}))
+
+    with TestClient(api.app) as client:
+        assert client.post('/run_async', json={'workflow': 'select', 'month': 1, 'year': 2023}).status_code == 200
+
+        # the queue is full
+        response = client.post('/run_async', json={'workflow': 'select', 'month': 2, 'year': 2023})
+        assert response.status_code == 429
+        assert int(response.headers['retry-after']) == 60
+
+        assert client.post('/jobs/lease', json={'worker': 'worker-0'}).status_code == 200
+        assert client.post('/run_async', json={'workflow': 'select', 'month': 2, 'year': 2023}).status_code == 200
+
+        # the scrape of the account is running
+        response = client.post('/jobs/lease', json={'worker': 'worker-1'})
+        assert response.status_code == 204
+        assert int(response.headers['retry-after']) > 0
+
+        response = client.post('/run', json={'workflow': 'select', 'month': 3, 'year': 2023})
+        assert response.status_code == 429
+        assert 'retry-after' in response.headers
+
+
+def test_run_circuit_breaker(client, monkeypatch):
+    calls = []
+
+    def switchboard(**kwargs):
+        calls.append(kwargs)
+        raise CaptchaError('Captcha detected')
+
+    monkeypatch.setattr(api, 'switchboard', switchboard)
+
+    assert client.post('/run', json={'workflow': 'current'}).status_code == 500
+    assert client.get('/breaker').json()['state'] == 'open'
+
+    # the scrapes are paused without starting a browser
+    response = client.post('/run', json={'workflow': 'select', 'month': 5, 'year': 2023})
+    assert response.status_code == 503
+    assert int(response.headers['retry-after']) > 0
+    assert len(calls) == 1
+
+
+
+def test_run_circuit_breaker_cache_hit(client, monkeypatch):
+    timings = {}
+
+    def switchboard(**kwargs):
+        if timings is None:
+            raise CaptchaError('Captcha detected')
+        return ERSSession(session_id=kwargs['uuid'], workflow=kwargs['name'], databases=[], source_data=None,
+                          status='completed', timestamp=datetime.now(), timings=timings)
+
+    monkeypatch.setattr(api, 'switchboard', switchboard)
+    breaker = client.app.state.breaker
+
+    timings = None
+    assert client.post('/run', json={'workflow': 'current'}).status_code == 500
+    monkeypatch.setattr(breaker, 'clock', lambda: datetime.now() + timedelta(hours=1))
+
+    # the half-open probe is served from the result cache: no login, so the breaker is not closed
+    timings = {'parse': 0.1}
+    assert client.post('/run', json={'workflow': 'select', 'month': 5, 'year': 2023}).status_code == 200
+    assert client.get('/breaker').json()['state'] == 'half_open'
+
+    # the next probe logs in
+    timings = {'login': 1.0, 'parse': 0.1}
+    assert client.post('/run', json={'workflow': 'select', 'month': 6, 'year': 2023}).status_code == 200
+    assert client.get('/breaker').json()['state'] == 'closed'
+
+
+def test_metrics(client):
+    add_task(client, status='queued')
+    client.get(f'/status/{uuid4()}')
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('application/openmetrics-text')
+
+    lines = response.text.splitlines()
+    assert any(line.startswith('ers_http_request_duration_seconds_count{method="GET",route="/status/{task_id}",'
+                               'status="404"}') for line in lines)
+    assert 'ers_job_queue_depth 0' in lines
+    assert any(line.startswith('ers_state_db_bytes ') for line in lines)
+    assert lines[-1] == '# EOF'
+
+
+def test_run_scheduled(client):
+    task_id = api.run_scheduled(client.app, ScheduleEntry(cron='@daily', db=[]))
+
+    for _ in range(50):
+        if not api.task_active(client.app.state.ddb, task_id):
+            break
+        time.sleep(0.1)
+
+    assert client.get(f'/status/{task_id}').json()['status'] == 'completed'
+
+
+def test_run_batch(tmp_path, config_path, monkeypatch):
+    monkeypatch.setattr(api, 'config_path', write_config(tmp_path, config_path))
+    monkeypatch.setattr(api, 'DuckDB', partial(DuckDB, (tmp_path / 'ers.db').as_posix()))
+    monkeypatch.setattr(api, 'BlobStore', partial(BlobStore, tmp_path / 'files'))
+    monkeypatch.setattr(api, 'WorkerPool', lambda *args, **kwargs: WorkerPool(*args, **{**kwargs, 'processes': 0}))
+    jobs = []
+
+    def run(config_path, job):
+        jobs.append(job)
+        children = {}
+        for child in job.children:
+            source = tmp_path / f'{child.task_id}.xlsx'
+            source.write_bytes(child.task_id.bytes)
+            children[str(child.task_id)] = {'status': 'completed', 'source_data': str(source)}
+        # the last month is not available yet
+        children[str(child.task_id)] = {'status': 'failed: Selected month is not available', 'source_data': None}
+        return 'completed with 1 failed child tasks', None, {'children': children}
+
+    with TestClient(api.app) as client:
+        assert client.post('/run_batch', json={'months': ['2023-13']}).status_code == 422
+        assert client.post('/run_batch', json={'start': '2000-01', 'end': '2023-12'}).status_code == 422
+
+        response = client.post('/run_batch', json={'start': '2023-11', 'end': '2024-01', 'cpes': ['PT1', 'PT2']})
+        assert response.status_code == 200
+        batch = response.json()
+        assert [(c['cpe'], c['year'], c['month']) for c in batch['children']] == [
+            (cpe, year, month) for cpe in ('PT1', 'PT2') for year, month in ((2023, 11), (2023, 12), (2024, 1))]
+
+        progress = client.get(f"/batch/{batch['task_id']}").json()
+        assert progress['total'] == 6
+        assert progress['progress'] == {'queued': 6, 'running': 0, 'completed': 0, 'failed': 0}
+
+        # a single job runs the whole batch, in one login
+        worker = RemoteWorker('http://testserver', config_path, run=run, session=client)
+        assert worker.run_once()
+        assert not worker.run_once()
+        assert len(jobs) == 1 and len(jobs[0].children) == 6
+
+        for _ in range(50):
+            progress = client.get(f"/batch/{batch['task_id']}").json()
+            if progress['status'] != 'running':
+                break
+            time.sleep(0.05)
+        assert progress['status'] == 'completed with 1 failed child tasks'
+        assert progress['progress'] == {'queued': 0, 'running': 0, 'completed': 5, 'failed': 1}
+
+        first = batch['children'][0]['task_id']
+        assert client.get(f'/status/{first}').json()['status'] == 'completed'
+        assert client.get(f'/download/{first}').content == UUID(first).bytes
+
+        assert client.get(f'/batch/{first}').status_code == 404
+
+
+def test_config_hot_reload(client):
+    response = client.post('/config/set', json={'key': 'limits.burst', 'value': '3'})
+    assert response.status_code == 200
+    assert client.app.state.limiter.limits.burst == 3
+
+    # changes made by another process are picked up by the watcher
+    stop = threading.Event()
+    watcher = threading.Thread(target=api.watch_config, args=(client.app, stop, 0.05))
+    watcher.start()
+    try:
+        config = parse_config(api.config_path)
+        time.sleep(0.1)
+        save_config({**config, 'limits': {**config['limits'], 'max_queued': 5}}, api.config_path)
+
+        for _ in range(50):
+            if client.app.state.limiter.limits.max_queued == 5:
+                break
+            time.sleep(0.05)
+    finally:
+        stop.set()
+        watcher.join()
+
+    assert client.app.state.limiter.limits.max_queued == 5
@@ -0,0 +1,217 @@
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import pytest
+
+from eredesscraper.backend import *
+from eredesscraper.backend import _initialized
+from eredesscraper.blobstore import BlobStore
+from eredesscraper.models import TaskstatusRecord, WorkflowRequestRecord, JobRecord, CheckpointRecord
+
+
+@pytest.fixture
+def ddb(tmp_path):
+    ddb = DuckDB((tmp_path / 'ers.db').as_posix())
+    yield ddb
+    ddb.destroy()
+
+
+def test_duckdb_init_once(ddb):
+    assert ddb.db_path in _initialized
+
+    cursor = ddb.cursor()
+    assert cursor.db_path == ddb.db_path
+    assert cursor.query("SELECT count(*) FROM taskstatus").fetchone()[0] == 0
+    cursor.close()
+
+
+def test_duckdb_cursor_shares_connection(ddb):
+    task_id = uuid4()
+    cursor = ddb.cursor()
+
+    cursor.insert_workflow_request(WorkflowRequestRecord(task_id=task_id, workflow='current', db=[], month=None,
+                                                         year=None, delta=False, download=False))
+    cursor.insert_taskstatus(TaskstatusRecord(task_id=task_id, status='queued', file=None, created=None,
+                                              updated=None))
+    cursor.close()
+
+    assert ddb.get_taskstatus(str(task_id)).fetchone()[1] == 'queued'
+
+
+def test_duckdb_writer(ddb):
+    writer = DuckDBWriter(ddb).start()
+    task_ids = [uuid4() for _ in range(20)]
+
+    def run(task_id):
+        writer.insert_workflow_request(WorkflowRequestRecord(task_id=task_id, workflow='current', db=[], month=None,
+                                                             year=None, delta=False, download=False))
+        ts = TaskstatusRecord(task_id=task_id, status='queued', file=None, created=None, updated=None)
+        writer.insert_taskstatus(ts)
+        ts.status = 'completed'
+        return writer.update_taskstatus(ts)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = list(pool.map(run, task_ids))
+
+    assert all(future.result(timeout=5) for future in futures)
+
+    # a failing operation does not fail the rest of its batch
+    duplicate = writer.insert_taskstatus(TaskstatusRecord(task_id=task_ids[0], status='queued', file=None,
+                                                          created=None, updated=None))
+    with pytest.raises(Exception):
+        duplicate.result(timeout=5)
+
+    writer.stop()
+
+    statuses = ddb.query("SELECT DISTINCT status FROM taskstatus").fetchall()
+    assert statuses == [('completed',)]
+
+
+def test_duckdb_compact(ddb, tmp_path):
+    blobs = BlobStore(tmp_path / 'files')
+    now = datetime.now()
+
+    def add(age_days, status, content=None):
+        task_id = uuid4()
+        ddb.insert('workflowrequests', {'task_id': task_id, 'workflow': 'current',
+                                        'created': now - timedelta(days=age_days)})
+        file_hash = None
+        if content:
+            source = tmp_path / f'{task_id}.xlsx'
+            source.write_bytes(content)
+            file_hash = blobs.put(source)
+        ddb.insert('taskstatus', {'task_id': task_id, 'status': status, 'file_hash': file_hash})
+        return task_id
+
+    old = add(40, 'completed', b'a' * 1024)
+    running = add(40, 'running')
+    recent = [add(i, 'completed', bytes([i]) * 1024) for i in range(5)]
+
+    stats = ddb.compact(max_age_days=30, blobs=blobs, grace=0)
+    assert stats['tasks'] == 1
+    assert stats['files'] == 1
+    assert ddb.get_taskstatus(str(old)).fetchone() is None
+    assert ddb.get_taskstatus(str(running)).fetchone() is not None
+
+    # the running task is kept even if it is over the count
+    stats = ddb.compact(max_tasks=4, max_file_bytes=2048, blobs=blobs, grace=0)
+    assert stats['tasks'] == 1
+    assert stats['files'] == 3
+    assert [ddb.get_taskstatus(str(task_id)).fetchone()[5] is not None for task_id in recent[:3]] == \
+           [True, True, False]
+
+    assert ddb.rewrite()
+    assert ddb.query("SELECT count(*) FROM taskstatus").fetchone()[0] == 5
+
+
+def test_duckdb_jobs(ddb):
+    task_ids = [uuid4() for _ in range(3)]
+    for task_id in task_ids:
+        ddb.insert_workflow_request(WorkflowRequestRecord(task_id=task_id, workflow='current', db=['influxdb'],
+                                                          month=None, year=None, delta=True, download=False))
+        ddb.insert_job(JobRecord(task_id=task_id))
+
+    jobs = [ddb.claim_job('a', lease_seconds=60), ddb.claim_job('b', lease_seconds=-1)]
+    assert [job.task_id for job in jobs] == task_ids[:2]
+    assert jobs[0].db == ['influxdb'] and jobs[0].delta
+
+    assert ddb.heartbeat_job(task_ids[0], 'a', lease_seconds=60)
+    assert not ddb.heartbeat_job(task_ids[0], 'b', lease_seconds=60)
+
+    # the lease of `b` expired: its job is requeued, and leased again before the jobs queued after it
+    assert ddb.requeue_expired_jobs(max_attempts=2) == ([task_ids[1]], [])
+    assert not ddb.finish_job(task_ids[1], 'b')
+    assert ddb.claim_job('c', lease_seconds=-1).task_id == task_ids[1]
+    assert ddb.claim_job('c', lease_seconds=60).task_id == task_ids[2]
+    assert ddb.claim_job('c', lease_seconds=60) is None
+
+    # the job of task 1 was leased twice: it is abandoned
+    assert sorted(map(str, ddb.requeue_expired_jobs(max_attempts=2)[1])) == [str(task_ids[1])]
+
+    assert ddb.finish_job(task_ids[0], 'a')
+    assert ddb.query("SELECT task_id FROM jobs").fetchall() == [(task_ids[2],)]
+
+
+def test_duckdb_jobs_range(ddb):
+    task_id = uuid4()
+    ddb.insert_workflow_request(WorkflowRequestRecord(task_id=task_id, workflow='backfill', db=['duckdb'],
+                                                      month=None, year=None, delta=False, download=False))
+    ddb.insert_job(JobRecord(task_id=task_id, range_start='2023-11', range_end='2024-02', profile=True))
+
+    job = ddb.claim_job('a', lease_seconds=60)
+    assert (job.workflow, job.start, job.end, job.profile) == ('backfill', '2023-11', '2024-02', True)
+
+
+
+def test_duckdb_compact_keeps_restored_files(ddb, tmp_path):
+    blobs = BlobStore(tmp_path / 'files')
+    source = tmp_path / 'readings.xlsx'
+    source.write_bytes(b'a' * 1024)
+
+    # the file of an old task, no longer referenced
+    digest = blobs.put(source)
+    two_hours_ago = time.time() - 7200
+    os.utime(blobs.path(digest), (two_hours_ago, two_hours_ago))
+
+    # a new task stores the same file, but its row is not inserted yet when the compaction runs
+    assert blobs.put(source) == digest
+
+    stats = ddb.compact(blobs=blobs, grace=3600)
+    assert stats['files'] == 0
+    assert blobs.exists(digest)
+
+
+def test_checkpoint_store(tmp_path):
+    with CheckpointStore(tmp_path / 'checkpoints.db') as store:
+        assert store.get('PT0001', 'duckdb') == {}
+
+        store.put(CheckpointRecord(cpe='PT0001', sinks='duckdb', year=2024, month=1, state='failed', error='boom'))
+        store.put(CheckpointRecord(cpe='PT0001', sinks='duckdb', year=2024, month=2, state='loaded'))
+        store.put(CheckpointRecord(cpe='PT0001', sinks='duckdb', year=2024, month=1, state='loaded', attempts=2))
+        store.put(CheckpointRecord(cpe='PT0001', sinks='duckdb,influxdb', year=2024, month=3, state='loaded'))
+
+    # reopened, as a resumed backfill does
+    with CheckpointStore(tmp_path / 'checkpoints.db') as store:
+        checkpoints = store.get('PT0001', 'duckdb')
+
+    assert sorted(checkpoints) == [(2024, 1), (2024, 2)]
+    assert (checkpoints[(2024, 1)].state, checkpoints[(2024, 1)].attempts, checkpoints[(2024, 1)].error) == \
+           ('loaded', 2, None)
+    assert checkpoints[(2024, 2)].updated is not None
+
+
+
+def test_checkpoint_store_waits_for_other_processes(tmp_path):
+    path = tmp_path / 'checkpoints.db'
+    CheckpointStore(path).put(CheckpointRecord(cpe='PT0001', sinks='duckdb', year=2024, month=1, state='loaded'))
+
+    # another process (e.g. a worker running a sync) holds the file for a moment
+    holder = subprocess.Popen([sys.executable, '-c', f"import duckdb, sys, time\n"
+                                                     f"conn = duckdb.connect({path.as_posix()!r})\n"
+                                                     f"print('locked', flush=True)\n"
+                                                     f"time.sleep(float(sys.argv[1]))", '1'],
+                              stdout=subprocess.PIPE, text=True)
+    assert holder.stdout.readline().strip() == 'locked'
+
+    with pytest.raises(RuntimeError):
+        CheckpointStore(path, lock_timeout=0.1)
+
+    started = time.monotonic()
+    assert list(CheckpointStore(path).get('PT0001', 'duckdb')) == [(2024, 1)]
+    assert time.monotonic() - started > 0.2
+    holder.wait()
+
+
+def test_checkpoint_store_watermarks(tmp_path):
+    with CheckpointStore(tmp_path / 'checkpoints.db') as store:
+        assert store.get_watermark('PT0001', 'duckdb') is None
+
+        store.put_watermark('PT0001', 'duckdb', datetime(2024, 3, 1, 1, tzinfo=timezone(timedelta(hours=1))))
+        store.put_watermark('PT0001', 'duckdb,influxdb', datetime(2024, 1, 1, tzinfo=timezone.utc))
+
+        assert store.get_watermark('PT0001', 'duckdb') == datetime(2024, 3, 1, tzinfo=timezone.utc)
@@ -0,0 +1,38 @@
+import pandas as pd
+
+from eredesscraper.bench import generate_export, percentile, run_bench
+from eredesscraper.utils import parse_readings_influx
+
+
+def test_generate_export(tmp_path):
+    path = generate_export(tmp_path / 'export.xlsx', cpe='PT0001', year=2024, month=2)
+    df = parse_readings_influx(path, cpe_code='PT0001')
+
+    # 29 days of 15-minute readings, from 00:15 of the first day up to 00:00 of the next month
+    assert len(df) == 29 * 96
+    assert df.index[0] == pd.Timestamp('2024-02-01 00:15', tz='UTC')
+    assert df.index[-1] == pd.Timestamp('2024-03-01 00:00', tz='UTC')
+    assert df['consumption'].between(0, 2).all() and (df['cpe'] == 'PT0001').all()
+
+    # the same seed generates the same readings
+    again = generate_export(tmp_path / 'again.xlsx', cpe='PT0001', year=2024, month=2)
+    assert parse_readings_influx(again, cpe_code='PT0001').equals(df)
+
+
+def test_percentile():
+    assert percentile([], 50) == 0.0
+    assert percentile(list(range(1, 101)), 50) == 50
+    assert percentile(list(range(1, 101)), 99) == 99
+    assert percentile([3, 1, 2], 100) == 3
+
+
+def test_run_bench(tmp_path):
+    report = run_bench(tmp_path, months=1, cpes=2)
+
+    assert report['files'] == 2 and report['rows'] == 2 * 31 * 96
+    assert list(report['stages']) == ['parse', 'delta', 'serialize', 'influxdb']
+    assert report['stages']['influxdb']['rows'] == report['rows']
+    assert 0 < report['stages']['delta']['rows'] < report['rows']
+    assert all(stage['rows_per_s'] > 0 and stage['latency_ms']['p50'] <= stage['latency_ms']['max']
+               for stage in report['stages'].values())
+    assert len(list(tmp_path.glob('*.xlsx'))) == 2
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from eredesscraper.agent import CaptchaError
+from eredesscraper.backend import DuckDB, DuckDBWriter
+from eredesscraper.breaker import CircuitBreaker, CircuitOpen, admit, breaker_failure
+from eredesscraper.models import Breaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = datetime(2024, 1, 1)
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def ddb(tmp_path):
+    ddb = DuckDB((tmp_path / 'ers.db').as_posix())
+    yield ddb
+    ddb.destroy()
+
+
+def test_circuit_breaker(ddb):
+    clock = Clock()
+    writer = DuckDBWriter(ddb).start()
+    breaker = CircuitBreaker(ddb, writer, Breaker(threshold=2, cooldown_minutes=10), clock=clock)
+
+    assert breaker_failure(CaptchaError('captcha')) == 'captcha'
+    assert breaker_failure(ValueError('no data')) is None
+
+    for _ in range(2):
+        assert breaker.admit('111111111') is False
+        breaker.record('111111111', 'captcha')
+
+    with pytest.raises(CircuitOpen) as e:
+        breaker.admit('111111111')
+    assert e.value.retry_after == 600
+    # other accounts are not paused
+    assert breaker.admit('222222222') is False
+
+    # half-open: a single probe, which fails and doubles the cool-down
+    clock.now += timedelta(minutes=10)
+    assert breaker.admit('111111111') is True
+    with pytest.raises(CircuitOpen):
+        breaker.admit('111111111')
+    breaker.record('111111111', 'captcha', probe=True)
+    assert breaker.state('111111111').retry_at == clock.now + timedelta(minutes=20)
+
+    writer.stop()
+
+    # the breaker is persisted
+    writer = DuckDBWriter(ddb).start()
+    breaker = CircuitBreaker(ddb, writer, Breaker(threshold=2, cooldown_minutes=10), clock=clock)
+    assert breaker.state('111111111').state == 'open'
+
+    clock.now += timedelta(minutes=20)
+    admission = admit('111111111', breaker)
+    assert admission.probe
+    admission.finish()
+
+    assert breaker.state('111111111').state == 'closed'
+    assert breaker.admit('111111111') is False
+
+    writer.stop()
+    assert ddb.get_breaker('111111111').state == 'closed'
@@ -0,0 +1,53 @@
+import os
+import time
+from datetime import date
+from pathlib import Path
+
+from eredesscraper.cache import ResultCache
+
+example = Path(__file__).parent / 'example.xlsx'
+
+
+def test_result_cache(tmp_path):
+    cache = ResultCache(tmp_path, ttl=60)
+    assert cache.get('PT0001', 2023, 5) is None
+
+    entry = cache.put('PT0001', 2023, 5, example)
+    assert cache.get('PT0001', 2023, 5).source.read_bytes() == example.read_bytes()
+
+    # the readings are parsed once, then loaded from the cache
+    batch = entry.batch()
+    assert (entry.path / 'readings.pkl').is_file()
+    assert cache.get('PT0001', 2023, 5).batch().frame.equals(batch.frame)
+
+
+def test_result_cache_ttl(tmp_path):
+    cache = ResultCache(tmp_path, ttl=0)
+    today = date.today()
+
+    cache.put('PT0001', 2023, 5, example)
+    cache.put('PT0001', today.year, today.month, example)
+    time.sleep(0.01)
+
+    # a closed month never expires, the current one does
+    assert cache.get('PT0001', 2023, 5) is not None
+    assert cache.get('PT0001', today.year, today.month) is None
+
+    assert cache.is_closed(2023, 12, today=date(2024, 1, 3))
+    assert not cache.is_closed(2023, 12, today=date(2024, 1, 2))
+
+
+def test_result_cache_eviction(tmp_path):
+    size = example.stat().st_size
+    cache = ResultCache(tmp_path, max_bytes=int(size * 2.5))
+
+    for month in range(1, 3):
+        cache.put('PT0001', 2023, month, example)
+    # the first month is used last, so the second one is evicted
+    os.utime(cache.entry_path('PT0001', 2023, 2) / 'meta.json', (0, 0))
+    cache.get('PT0001', 2023, 1)
+    cache.put('PT0001', 2023, 3, example)
+
+    assert cache.get('PT0001', 2023, 1) is not None
+    assert cache.get('PT0001', 2023, 2) is None
+    assert cache.get('PT0001', 2023, 3) is not None
@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from typer.testing import CliRunner
+
+from eredesscraper.cli import app
+
+# the dependencies only some commands need: none of them is imported to start the CLI
+heavy_modules = ("playwright", "playwright_stealth", "pandas", "influxdb_client", "duckdb", "fastapi", "uvicorn",
+                 "openpyxl", "pykwalify")
+
+# wall time budget of `import eredesscraper.cli`, in seconds (about 0.2 s here, 2 s before the imports were lazy)
+import_budget = 1.0
+
+
+def run_python(code: str, home: Path) -> subprocess.CompletedProcess:
+    env = {**os.environ, "HOME": str(home), "PYTHONPATH": str(Path(__file__).parent.parent)}
+    return subprocess.run([sys.executable, "-X", "importtime", "-c", code], env=env, capture_output=True, text=True,
+                          timeout=60)
+
+
+def test_cli_cold_start(tmp_path):
+    process = run_python("import sys\n"
+                         "from eredesscraper.cli import app\n"
+                         "try:\n"
+                         "    app(['version'])\n"
+                         "except SystemExit:\n"
+                         "    pass\n"
+                         f"print(sorted(set({heavy_modules!r}) & set(sys.modules)))", tmp_path)
+
+    assert process.returncode == 0, process.stderr
+    assert "Version: " in process.stdout
+    assert process.stdout.strip().splitlines()[-1] == "[]"
+
+    # `-X importtime` reports the cumulative import time of each module, in microseconds
+    cumulative = {line.split("|")[2].strip(): int(line.split("|")[1]) for line in process.stderr.splitlines()
+                  if line.startswith("import time:") and line.split("|")[1].strip().isdigit()}
+    assert cumulative["eredesscraper.cli"] / 1e6 < import_budget
+
+    # importing and running a command leaves the file system alone
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_cli_help():
+    result = CliRunner().invoke(app, ["--help"])
+
+    assert result.exit_code == 0
+    assert "E-REDES Scraper" in result.output and "Hompage" in result.output
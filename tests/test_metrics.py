@@ -0,0 +1,29 @@
+from eredesscraper.metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_registry_render():
+    registry = Registry()
+    requests = registry.register(Counter('requests', 'Requests', ('route',)))
+    depth = registry.register(Gauge('depth', 'Depth'))
+    latency = registry.register(Histogram('latency_seconds', 'Latency', buckets=(0.1, 1)))
+
+    requests.inc(route='/run')
+    requests.inc(2, route='/run')
+    depth.set_function(lambda: 7)
+    for value in (0.05, 0.5, 5):
+        latency.observe(value)
+
+    lines = registry.render().splitlines()
+
+    assert '# TYPE requests counter' in lines
+    assert 'requests_total{route="/run"} 3' in lines
+    assert 'depth 7' in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1.0"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert 'latency_seconds_count 3' in lines
+    assert lines[-1] == '# EOF'
+
+    # a failing collector is skipped
+    depth.set_function(lambda: 1 / 0)
+    assert 'depth' not in [line.split(' ')[0] for line in registry.render().splitlines()]
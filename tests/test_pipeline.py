@@ -0,0 +1,63 @@
+import threading
+import time
+
+from eredesscraper.pipeline import Pipeline
+
+
+def test_pipeline_order_and_errors():
+    def double(item):
+        if item == 3:
+            raise ValueError("boom")
+        return item * 2
+
+    out = []
+    with Pipeline([("double", double), ("collect", out.append)]) as pipeline:
+        pipeline.feed(range(6))
+
+    assert out == [0, 2, 4, 8, 10]
+    assert [str(e) for e in pipeline.errors] == ["boom"]
+
+    report = pipeline.report()
+    assert list(report) == ["feed", "double", "collect"]
+    assert [stage["items"] for stage in report.values()] == [6, 6, 5]
+
+
+def test_pipeline_overlaps_and_bounds():
+    intervals = {"feed": [], "work": []}
+    done = threading.Event()
+
+    def produce():
+        for i in range(4):
+            started = time.perf_counter()
+            time.sleep(0.05)
+            intervals["feed"].append((started, time.perf_counter()))
+            yield i
+
+    def work(item):
+        started = time.perf_counter()
+        time.sleep(0.05)
+        intervals["work"].append((started, time.perf_counter()))
+
+    with Pipeline([("work", work)], maxsize=1) as pipeline:
+        pipeline.feed(produce())
+
+    # item N is worked on while item N+1 is produced
+    assert all(w_start < f_end and f_start < w_end
+               for (w_start, w_end), (f_start, f_end) in zip(intervals["work"], intervals["feed"][1:]))
+
+    report = pipeline.report()
+    assert report["feed"]["utilization"] > 0.5 and report["work"]["utilization"] > 0.5
+
+    # a stage blocked on a full queue holds back the stage before it
+    release = threading.Event()
+    pipeline = Pipeline([("blocked", lambda item: release.wait())], maxsize=1).start()
+    feeder = threading.Thread(target=lambda: (pipeline.feed(range(4)), done.set()))
+    feeder.start()
+    try:
+        time.sleep(0.1)
+        assert not done.is_set() and pipeline.report()["feed"]["items"] == 2
+    finally:
+        release.set()
+        feeder.join()
+    pipeline.close()
+    assert pipeline.report()["blocked"]["items"] == 4
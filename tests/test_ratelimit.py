@@ -0,0 +1,85 @@
+import pytest
+
+from eredesscraper.models import Limits
+from eredesscraper.ratelimit import RateLimited, RateLimiter, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket():
+    clock = Clock()
+    bucket = TokenBucket(rate=0.5, burst=2, clock=clock)
+
+    for _ in range(2):
+        assert bucket.wait() == 0
+        bucket.take()
+    assert bucket.wait() == 2
+
+    clock.now = 1
+    assert bucket.wait() == 1
+    clock.now = 10
+    assert bucket.tokens <= 2 and bucket.wait() == 0
+
+
+def test_rate_limiter():
+    clock = Clock()
+    limiter = RateLimiter(Limits(rate_per_minute=2, burst=2, max_concurrent=1, global_max_concurrent=2), clock=clock)
+
+    permit = limiter.acquire('111111111')
+    with pytest.raises(RateLimited):
+        limiter.acquire('111111111')
+
+    # accounts are limited separately, up to the global limit
+    other = limiter.acquire('222222222')
+    with pytest.raises(RateLimited):
+        limiter.acquire('333333333')
+    assert limiter.running() == 2
+
+    permit.release()
+    permit.release()
+    assert limiter.running('111111111') == 0
+
+    # the second token of the burst, then the rate applies
+    limiter.acquire('111111111').release()
+    with pytest.raises(RateLimited) as e:
+        limiter.acquire('111111111')
+    assert e.value.retry_after == 30
+
+    clock.now = 30
+    limiter.acquire('111111111').release(refund=True)
+    limiter.acquire('111111111').release()
+    other.release()
+    assert limiter.running() == 0
+
+
+def test_check_queue():
+    limiter = RateLimiter(Limits(rate_per_minute=2, max_queued=3))
+
+    limiter.check_queue(2)
+    with pytest.raises(RateLimited) as e:
+        limiter.check_queue(4)
+    assert e.value.retry_after == 60
+
+
+def test_rate_limiter_update():
+    clock = Clock()
+    limiter = RateLimiter(Limits(rate_per_minute=2, burst=2, max_concurrent=1), clock=clock)
+
+    limiter.acquire('111111111').release()
+    limiter.acquire('111111111').release()
+    with pytest.raises(RateLimited):
+        limiter.acquire('111111111')
+
+    # the new rate applies to the tokens already taken
+    limiter.update(Limits(rate_per_minute=60, burst=1, max_concurrent=2, global_max_concurrent=1))
+    clock.now = 1
+    permit = limiter.acquire('111111111')
+    with pytest.raises(RateLimited):
+        limiter.acquire('222222222')
+    permit.release()
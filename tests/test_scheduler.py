@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from eredesscraper.models import ScheduleEntry
+from eredesscraper.scheduler import CronExpression, Scheduler, jitter_offset
+
+
+def test_cron_expression():
+    assert CronExpression('*/15 * * * *').next(datetime(2024, 1, 1, 10, 7)) == datetime(2024, 1, 1, 10, 15)
+    assert CronExpression('30 2 * * *').next(datetime(2024, 1, 1, 2, 30)) == datetime(2024, 1, 2, 2, 30)
+    assert CronExpression('0 6 * * mon-fri').next(datetime(2024, 1, 5, 7)) == datetime(2024, 1, 8, 6)
+    assert CronExpression('0 0 1 jan,jul *').next(datetime(2024, 2, 1)) == datetime(2024, 7, 1)
+    assert CronExpression('@monthly').next(datetime(2024, 12, 15)) == datetime(2025, 1, 1)
+    assert CronExpression('0 0 29 2 *').next(datetime(2024, 3, 1)) == datetime(2028, 2, 29)
+    # the day of month or the day of week
+    assert CronExpression('0 0 15 * 0').next(datetime(2024, 1, 1)) == datetime(2024, 1, 7)
+
+    for expression in ('* * *', '60 * * * *', '0 0 30 2 *'):
+        with pytest.raises(ValueError):
+            CronExpression(expression).next(datetime(2024, 1, 1))
+
+
+def test_jitter_offset():
+    entry = ScheduleEntry(cron='0 * * * *', jitter_minutes=30)
+    offsets = {jitter_offset(entry, f'PT{i:04d}', 0) for i in range(20)}
+
+    assert all(timedelta(0) <= offset < timedelta(minutes=30) for offset in offsets)
+    assert len(offsets) > 1
+    assert jitter_offset(entry, 'PT0001', 0) == jitter_offset(entry, 'PT0001', 0)
+    assert jitter_offset(ScheduleEntry(cron='0 * * * *'), 'PT0001', 0) == timedelta(0)
+
+
+def test_scheduler():
+    now = [datetime(2024, 1, 1, 9, 59)]
+    queued, active = [], set()
+
+    def enqueue(entry):
+        queued.append(entry)
+        active.add(f'task-{len(queued)}')
+        return f'task-{len(queued)}'
+
+    scheduler = Scheduler([ScheduleEntry(cron='0 * * * *', db=['influxdb'])], cpe='PT0001', enqueue=enqueue,
+                          is_active=active.__contains__, clock=lambda: now[0])
+
+    assert scheduler.run_pending() == []
+
+    now[0] = datetime(2024, 1, 1, 10, 0)
+    assert scheduler.run_pending() == ['task-1']
+    assert scheduler.due(0) == datetime(2024, 1, 1, 11, 0)
+
+    # skipped while the previous run is in progress
+    now[0] = datetime(2024, 1, 1, 11, 0)
+    assert scheduler.run_pending() == []
+
+    active.clear()
+    now[0] = datetime(2024, 1, 1, 14, 30)
+    assert scheduler.run_pending() == ['task-2']
+    assert scheduler.due(0) == datetime(2024, 1, 1, 15, 0)
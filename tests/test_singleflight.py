@@ -0,0 +1,69 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+from eredesscraper.models import RunWorkflowRequest, TaskstatusRecord
+from eredesscraper.singleflight import SingleFlight, flight_key
+
+
+def test_flight_key():
+    today = date(2024, 3, 1)
+
+    def key(cpe='PT0001', **request):
+        return flight_key(RunWorkflowRequest(**request), cpe=cpe, today=today)
+
+    assert key(workflow='current', db=['influxdb', 'duckdb']) == \
+           key(workflow='select', month=3, year=2024, db=['duckdb', 'influxdb'])
+    assert key(workflow='previous') == key(workflow='select', month=2, year=2024)
+    assert key(workflow='current') != key(workflow='current', cpe='PT0002')
+    assert key(workflow='current') != key(workflow='current', delta=True)
+    assert key(workflow='current') != key(workflow='current', db=['influxdb'])
+    assert key(workflow='backfill', start='2023-01') == key(workflow='backfill', start='2023-01', end='2024-03')
+    assert key(workflow='backfill', start='2023-01') != key(workflow='backfill', start='2023-02')
+    assert key(workflow='backfill', start='2024-03', end='2024-03') != key(workflow='current')
+    assert key(workflow='sync', db=['duckdb']) != key(workflow='sync', db=['influxdb'])
+    assert key(workflow='sync', month=3, year=2024) == key(workflow='sync')
+
+
+def test_single_flight():
+    flights = SingleFlight()
+    started = []
+
+    def start(task_id):
+        started.append(task_id)
+        time.sleep(0.2)
+
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda i: flights.attach('key', f'task-{i}', start), range(4)))
+
+    assert len(started) == 1
+    assert [leader for _, leader in results].count(True) == 1
+    assert {flight.task_id for flight, _ in results} == {started[0]}
+
+    flight = results[0][0]
+    flights.resolve(TaskstatusRecord(task_id='00000000-0000-0000-0000-000000000000', status='completed', file=None,
+                                     created=None, updated=None))
+    assert not flight.future.done()
+
+    # a new request attaches to a task found in the state database
+    assert flights.attach('other', 'task-9', start, find=lambda: 'queued-task')[0].task_id == 'queued-task'
+    assert len(flights) == 2
+
+
+def test_single_flight_resolve():
+    flights = SingleFlight()
+    task_id = '7f1c0a4e-7a53-4a51-9f39-0a4e59d7b3c1'
+    flight, leader = flights.attach('key', task_id, lambda _: None)
+    assert leader
+
+    record = TaskstatusRecord(task_id=task_id, status='running', file=None, created=None, updated=datetime.now())
+    flights.resolve(record)
+    assert not flight.future.done()
+
+    done = threading.Timer(0.1, flights.resolve, [record.model_copy(update={'status': 'completed'})])
+    done.start()
+    assert flight.future.result(timeout=5).status == 'completed'
+
+    # the next request starts a new task
+    assert flights.attach('key', 'new-task', lambda _: None)[1]
@@ -0,0 +1,136 @@
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+import pytest
+from pytz import UTC
+
+from eredesscraper.sinks import *
+
+cpe_code = 'PT00############04TW'
+
+
+@pytest.fixture(scope='module')
+def batch():
+    return ReadingsBatch.from_file(Path(__file__).parent / 'example.xlsx', cpe_code=cpe_code)
+
+
+def test_readings_batch_is_immutable(batch):
+    with pytest.raises(AttributeError):
+        batch.cpe = 'other'
+
+    frame = batch.frame
+    frame['consumption'] = 0.0
+    assert batch.frame['consumption'].sum() == 989.348
+
+
+def test_available_sinks():
+    sinks = available_sinks()
+    for name in ('influxdb', 'duckdb', 'parquet', 'postgres'):
+        assert name in sinks
+        assert issubclass(sinks[name], Sink)
+
+
+def test_duckdb_sink(batch, tmp_path):
+    config = {'duckdb': {'path': (tmp_path / 'readings.db').as_posix()}}
+
+    results = write_sinks(batch, ['duckdb'], config=config, quiet=True)
+    assert results[0].ok
+    assert results[0].points == len(batch)
+
+    # everything is already loaded, so a delta load is a no-op
+    results = write_sinks(batch, ['duckdb'], config=config, delta=True, quiet=True)
+    assert results[0].ok
+    assert results[0].points == 0
+
+
+def test_parquet_sink(batch, tmp_path):
+    config = {'parquet': {'path': tmp_path.as_posix()}}
+
+    results = write_sinks(batch, ['parquet'], config=config, quiet=True)
+    assert results[0].ok
+    assert [p.relative_to(tmp_path).as_posix() for p in tmp_path.rglob('*.parquet')] == \
+        [f"cpe={cpe_code}/month=2023-12/data.parquet"]
+
+    sink = ParquetSink.from_config(config)
+    sink.connect()
+    assert sink.last_insert(cpe_code) == batch.frame.index.max()
+    sink.close()
+
+
+def test_parquet_sink_reload(batch, tmp_path):
+    config = {'parquet': {'path': tmp_path.as_posix()}}
+    frame = batch.frame
+    dataset = (tmp_path / f"cpe={cpe_code}" / '*' / '*.parquet').as_posix()
+
+    # a month still growing, loaded again in full, then a delta with a corrected reading
+    write_sinks(ReadingsBatch(frame.iloc[:10], cpe=cpe_code), ['parquet'], config=config, quiet=True)
+    write_sinks(ReadingsBatch(frame.iloc[:20], cpe=cpe_code), ['parquet'], config=config, quiet=True)
+    delta = frame.iloc[19:25].copy()
+    delta.iloc[0, delta.columns.get_loc('consumption')] = 1.5
+    write_sinks(ReadingsBatch(delta, cpe=cpe_code), ['parquet'], config=config, quiet=True)
+
+    rows, distinct, corrected = duckdb.execute(
+        f"SELECT count(*), count(DISTINCT date_time), max(consumption) "
+        f"FROM read_parquet('{dataset}', hive_partitioning = false)").fetchone()
+    assert rows == distinct == 25
+    assert corrected == 1.5
+    assert not list(tmp_path.rglob('*.tmp'))
+
+
+
+class MemorySink(Sink):
+    """Keeps the raw points and the rollups in memory, the rollups overwritten by window start like in InfluxDB."""
+    name = "memory"
+
+    def __init__(self):
+        super().__init__(quiet=True, rollups=True)
+        self.points = pd.DataFrame()
+        self.stored_rollups = {}
+
+    def load_frame(self, df):
+        self.points = pd.concat([self.points, df])
+        self.points = self.points[~self.points.index.duplicated(keep='last')].sort_index()
+
+    def load_rollups(self, rollups):
+        for name, rollup in rollups.items():
+            for window, row in rollup.iterrows():
+                self.stored_rollups[name, window] = row['consumption_count']
+
+    def stored_points(self, cpe_code, start, stop):
+        return self.points[(self.points.index >= start) & (self.points.index < stop)]
+
+
+def test_rollups_of_consecutive_months():
+    def export(start, end):
+        index = pd.date_range(start, end, freq='15min', tz=UTC, name='date_time')
+        return ReadingsBatch(pd.DataFrame({'consumption': 0.25, 'cpe': cpe_code}, index=index), cpe=cpe_code)
+
+    # each export runs from 00:15 of the first day to 00:00 of the next month
+    january = export('2023-01-01 00:15', '2023-02-01 00:00')
+    february = export('2023-02-01 00:15', '2023-03-01 00:00')
+
+    expected = {(name, window): row['consumption_count']
+                for name, rollup in compute_rollups(pd.concat([january.frame, february.frame])).items()
+                for window, row in rollup.iterrows()}
+
+    for order in ((january, february), (february, january)):
+        sink = MemorySink()
+        for batch in order:
+            sink.write(batch)
+
+        assert sink.stored_rollups == expected
+        assert sink.stored_rollups['1h', pd.Timestamp('2023-02-01', tz=UTC)] == 4
+        assert sink.stored_rollups['1d', pd.Timestamp('2023-02-01', tz=UTC)] == 96
+        assert sink.stored_rollups['1mo', pd.Timestamp('2023-02-01', tz=UTC)] == 28 * 96
+
+
+def test_write_sinks_isolates_errors(batch, tmp_path):
+    config = {'duckdb': {'path': (tmp_path / 'readings.db').as_posix()}}
+
+    results = write_sinks(batch, ['influxdb', 'duckdb', 'unknown'], config=config, quiet=True)
+
+    assert [r.sink for r in results] == ['influxdb', 'duckdb', 'unknown']
+    assert not results[0].ok
+    assert results[1].ok
+    assert results[2].error == 'not supported'
@@ -0,0 +1,103 @@
+import json
+from uuid import uuid4
+
+import pytest
+
+from eredesscraper import sinks, tracing
+from eredesscraper.models import Tracing
+from eredesscraper.pipeline import Pipeline
+
+
+@pytest.fixture
+def spans_path(tmp_path, monkeypatch):
+    path = tmp_path / "spans.jsonl"
+    monkeypatch.setattr(tracing, 'tracer', tracing.Tracer(Tracing(sample_rate=1, jsonl=str(path))))
+    return path
+
+
+def read_spans(path) -> dict:
+    return {span["name"]: span for span in map(json.loads, path.read_text().splitlines())}
+
+
+def test_tracing_nested_spans(spans_path, monkeypatch):
+    class Sink(sinks.Sink):
+        @classmethod
+        def from_config(cls, config, quiet=False):
+            return cls()
+
+        def write(self, batch, delta=False):
+            if batch == "broken":
+                raise ValueError("boom")
+            return 3
+
+    monkeypatch.setattr(sinks, 'available_sinks', lambda: {"good": Sink, "bad": Sink})
+
+    @tracing.traced("parse")
+    def parse(item):
+        return item
+
+    task_id = uuid4()
+    with tracing.start_trace("switchboard", task_id=task_id, **{"ers.workflow": "current"}):
+        with Pipeline([("parse", parse), ("sinks", lambda item: sinks.write_sinks(item, ["good"], {}))]) as pipeline:
+            pipeline.feed(["readings"])
+        with tracing.span("sinks"):
+            sinks.write_sinks("broken", ["bad"], {}, quiet=True)
+
+    spans = [json.loads(line) for line in spans_path.read_text().splitlines()]
+    assert {span["traceId"] for span in spans} == {task_id.hex}
+
+    by_name = read_spans(spans_path)
+    root = by_name["switchboard"]
+    assert root["parentSpanId"] == "" and root["attributes"]["ers.workflow"] == "current"
+    # the spans of the pipeline threads and of the sink pool are children of the span they were started in
+    assert by_name["parse"]["parentSpanId"] == root["spanId"]
+    assert by_name["sinks"]["parentSpanId"] == root["spanId"]
+
+    loads = [span for span in spans if span["name"] == "sink.load"]
+    good, bad = sorted(loads, key=lambda span: span["attributes"]["ers.sink"], reverse=True)
+    assert good["parentSpanId"] == root["spanId"] and good["attributes"]["ers.points"] == 3
+    assert good["status"] == {"code": "STATUS_CODE_OK"}
+    assert bad["parentSpanId"] == by_name["sinks"]["spanId"]
+    assert bad["status"] == {"code": "STATUS_CODE_ERROR", "message": "boom"}
+    assert int(root["startTimeUnixNano"]) <= int(good["startTimeUnixNano"]) <= int(root["endTimeUnixNano"])
+
+
+def test_tracing_sampling(tmp_path, monkeypatch):
+    path = tmp_path / "spans.jsonl"
+    tracer = tracing.Tracer(Tracing(sample_rate=0.25, jsonl=str(path)))
+    monkeypatch.setattr(tracing, 'tracer', tracer)
+
+    ids = [uuid4() for _ in range(2000)]
+    sampled = [task_id for task_id in ids if tracer.sampled(tracing.trace_id_of(task_id))]
+    # the decision only depends on the trace ID
+    assert sampled == [task_id for task_id in ids if tracer.sampled(tracing.trace_id_of(task_id))]
+    assert 0.2 < len(sampled) / len(ids) < 0.3
+
+    skipped = next(task_id for task_id in ids if task_id not in sampled)
+    with tracing.start_trace("switchboard", task_id=skipped) as root:
+        with tracing.span("parse") as span:
+            tracing.add_span("agent.login", 0.5)
+    assert root is tracing.NOOP and span is tracing.NOOP
+    assert not path.exists()
+
+    with tracing.start_trace("switchboard", task_id=sampled[0]):
+        tracing.add_span("agent.login", 0.5)
+    login = read_spans(path)["agent.login"]
+    assert int(login["endTimeUnixNano"]) - int(login["startTimeUnixNano"]) == 500_000_000
+
+    # disabled by default, and outside of a trace
+    tracer.configure(None)
+    assert not tracer.sampled(tracing.trace_id_of(sampled[0]))
+    with tracing.span("parse") as span:
+        assert span is tracing.NOOP
+
+
+def test_tracing_failed_trace(spans_path):
+    with pytest.raises(RuntimeError):
+        with tracing.start_trace("switchboard", task_id=uuid4()):
+            tracing.add_span("agent.login", 0.5)
+            raise RuntimeError("captcha")
+
+    spans = read_spans(spans_path)
+    assert spans["switchboard"]["status"] == {"code": "STATUS_CODE_ERROR", "message": "captcha"}
+    assert spans["agent.login"]["parentSpanId"] == spans["switchboard"]["spanId"]
@@ -18,6 +18,26 @@ def test_parse_readings_influx():
     assert df['consumption'].sum() == 989.348
 
 
+def test_compute_rollups():
+    file_path = Path(__file__).parent / 'example.xlsx'
+    cpe_code = 'PT00############04TW'
+    df = parse_readings_influx(file_path, cpe_code)
+
+    rollups = compute_rollups(df)
+    assert set(rollups) == {'1h', '1d', '1mo'}
+    for rollup in rollups.values():
+        assert rollup['consumption_sum'].sum() == pytest.approx(989.348)
+        assert rollup['consumption_count'].sum() == len(df)
+        assert (rollup['cpe'] == cpe_code).all()
+
+    # only the windows touched since the given timestamp are recomputed
+    since = df.index[-1]
+    rollups = compute_rollups(df, since=since)
+    assert len(rollups['1h']) == 1
+    assert len(rollups['1d']) == 1
+    assert rollups['1mo']['consumption_count'].sum() == len(df[df.index >= since.normalize().replace(day=1)])
+
+
 def test_flatten_config():
     d = {'a': 1, 'b': {'x': 2, 'y': 3}, 'c': 4}
     flat_d = flatten_config(d)
@@ -42,6 +62,24 @@ def test_parse_config(config_path):
     assert isinstance(config, dict)
 
 
+def test_parse_config_cache(config_path, tmp_path):
+    path = tmp_path / 'config.yml'
+    save_config(parse_config(config_path), path)
+
+    with patch('eredesscraper.utils.Core', wraps=Core) as core:
+        config = parse_config(path)
+        config['eredes']['cpe'] = 'changed'
+        # served from the cache, without the changes of the previous caller
+        assert parse_config(path)['eredes']['cpe'] != 'changed'
+        assert core.call_count == 1
+
+        save_config({**config, 'eredes': {**config['eredes'], 'cpe': 'PT0002'}}, path)
+        assert parse_config(path)['eredes']['cpe'] == 'PT0002'
+        assert core.call_count == 2
+
+    assert [p.name for p in tmp_path.iterdir()] == ['config.yml']
+
+
 def test_infer_type():
     assert infer_type('1') == 1
     assert infer_type('1.0') == 1.0
@@ -126,5 +164,24 @@ def test_get_screen_resolution(mock_monitor):
         assert resolution == (1920, 1080), "Expected resolution did not match"
 
 
+def test_workflow_period():
+    assert workflow_period('current', today=date(2024, 1, 15)) == (2024, 1)
+    assert workflow_period('previous', today=date(2024, 1, 15)) == (2023, 12)
+    assert workflow_period('select', month=5, year=2023, today=date(2024, 1, 15)) == (2023, 5)
+
+
+def test_batch_months():
+    today = date(2024, 2, 15)
+
+    assert batch_months(['2023-12', '2023-11', '2023-12'], today=today) == [(2023, 11), (2023, 12)]
+    assert batch_months(start='2023-11', today=today) == [(2023, 11), (2023, 12), (2024, 1), (2024, 2)]
+    assert batch_months(start='2023-01', end='2023-03', today=today) == [(2023, 1), (2023, 2), (2023, 3)]
+
+    for kwargs in ({}, {'months': ['2023-13']}, {'start': '2024-03'}, {'start': '2023-05', 'end': '2023-04'},
+                   {'months': ['2023-01'], 'start': '2023-01'}):
+        with pytest.raises(ValueError):
+            batch_months(**kwargs, today=today)
+
+
 if __name__ == '__main__':
     pytest.main()
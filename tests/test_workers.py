@@ -0,0 +1,84 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+
+from eredesscraper.backend import DuckDB, DuckDBWriter
+from eredesscraper.blobstore import BlobStore
+from eredesscraper.models import JobRecord, TaskstatusRecord, WorkflowRequestRecord
+from eredesscraper.workers import WorkerPool
+
+
+@pytest.fixture
+def ddb(tmp_path):
+    ddb = DuckDB((tmp_path / 'ers.db').as_posix())
+    yield ddb
+    ddb.destroy()
+
+
+def queue_task(ddb, workflow='current'):
+    task_id = uuid4()
+    ddb.insert_workflow_request(WorkflowRequestRecord(task_id=task_id, workflow=workflow, db=[], month=None,
+                                                      year=None, delta=False, download=True))
+    ddb.insert_taskstatus(TaskstatusRecord(task_id=task_id, status='queued', file=None, created=datetime.now(),
+                                           updated=None))
+    ddb.insert_job(JobRecord(task_id=task_id))
+    return task_id
+
+
+def wait_for(ddb, task_ids, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        statuses = {str(task_id): ddb.get_taskstatus(str(task_id)).fetchone()[1] for task_id in task_ids}
+        if all(status not in ('queued', 'running') for status in statuses.values()):
+            return statuses
+        time.sleep(0.05)
+    raise TimeoutError(statuses)
+
+
+def run_job(config_path, job):
+    if job.workflow == 'select':
+        raise ValueError('Specify both month and year')
+    source = config_path.parent / f'{job.task_id}.xlsx'
+    source.write_bytes(job.task_id.bytes)
+    return 'completed', source, {}
+
+
+def test_worker_pool(ddb, tmp_path):
+    # tasks queued before the server started are run
+    task_ids = [queue_task(ddb) for _ in range(4)] + [queue_task(ddb, workflow='select')]
+
+    writer = DuckDBWriter(ddb).start()
+    blobs = BlobStore(tmp_path / 'files')
+    pool = WorkerPool(ddb, writer, blobs, tmp_path / 'config.yml', processes=2, executor=ThreadPoolExecutor(2),
+                      run=run_job).start()
+
+    statuses = wait_for(ddb, task_ids)
+    pool.stop()
+    writer.stop()
+
+    assert list(statuses.values()) == ['completed'] * 4 + ['failed: Specify both month and year']
+    assert blobs.exists(ddb.get_taskstatus(str(task_ids[0])).fetchone()[5])
+    assert ddb.query("SELECT count(*) FROM jobs").fetchone()[0] == 0
+
+
+def test_worker_pool_requeues_expired_leases(ddb, tmp_path):
+    task_ids = [queue_task(ddb) for _ in range(2)]
+
+    # leased by a worker that died
+    ddb.claim_job('dead', lease_seconds=-1)
+    ddb.query("UPDATE jobs SET attempts = 3 WHERE task_id = ?", [task_ids[1]])
+    ddb.claim_job('dead', lease_seconds=-1)
+
+    writer = DuckDBWriter(ddb).start()
+    pool = WorkerPool(ddb, writer, BlobStore(tmp_path / 'files'), tmp_path / 'config.yml',
+                      executor=ThreadPoolExecutor(2), run=run_job).start()
+
+    statuses = wait_for(ddb, task_ids)
+    pool.stop()
+    writer.stop()
+
+    assert statuses[str(task_ids[0])] == 'completed'
+    assert statuses[str(task_ids[1])].startswith('failed: the task was abandoned')
@@ -0,0 +1,191 @@
+import json
+import pstats
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from uuid import uuid4
+
+import pytest
+
+from eredesscraper import workflows
+from eredesscraper.agent import CaptchaError
+from eredesscraper.backend import CheckpointStore
+from eredesscraper.models import BatchChild, ERSSession
+from eredesscraper.sinks import SinkResult
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    """
+    Replaces the batch runs with a fake: the months listed in ``failing`` fail, and a captcha stops the run at the
+    month set in ``captcha``.
+    """
+    runs = []
+    fake = {"failing": set(), "captcha": None}
+
+    def batch_switchboard(config_path, children, db, on_result, **kwargs):
+        runs.append([(child.year, child.month) for child in children])
+        results = []
+
+        for child in children:
+            if (child.year, child.month) == fake["captcha"]:
+                raise CaptchaError("captcha")
+
+            failed = (child.year, child.month) in fake["failing"]
+            result = ERSSession(session_id=child.task_id, workflow="select", databases=db, source_data=None,
+                                status="completed with sink errors" if failed else "completed",
+                                timestamp=datetime.now(),
+                                sinks=[SinkResult(sink="duckdb", points=10, elapsed=0.1,
+                                                  error="boom" if failed else None)])
+            on_result(child, result)
+            results.append(result)
+
+        return results
+
+    monkeypatch.setattr(workflows, 'batch_switchboard', batch_switchboard)
+    return runs, fake
+
+
+def test_backfill_resumes(config_path, tmp_path, batches):
+    runs, fake = batches
+    checkpoints = tmp_path / 'checkpoints.db'
+
+    def backfill():
+        return workflows.backfill(config_path=config_path, start='2023-10', end='2024-01', db=['duckdb'], quiet=True,
+                                  checkpoints=checkpoints)
+
+    # the run crashes at 2023-12, after loading 2023-10 and failing 2023-11
+    fake.update(failing={(2023, 11)}, captcha=(2023, 12))
+    with pytest.raises(CaptchaError):
+        backfill()
+
+    fake.update(failing=set(), captcha=None)
+    result = backfill()
+    assert result.status == 'completed' and result.workflow == 'backfill'
+    assert len(result.sinks) == 3
+
+    # nothing is left to load: no browser is started
+    assert backfill().status == 'completed'
+    assert runs == [[(2023, 10), (2023, 11), (2023, 12), (2024, 1)], [(2023, 11), (2023, 12), (2024, 1)]]
+
+    with CheckpointStore(checkpoints) as store:
+        done = store.get(workflows.parse_config(config_path)['eredes']['cpe'], 'duckdb')
+
+    assert {period: record.state for period, record in done.items()} == \
+           {(2023, 10): 'loaded', (2023, 11): 'loaded', (2023, 12): 'loaded', (2024, 1): 'loaded'}
+    assert done[(2023, 11)].attempts == 2 and done[(2023, 10)].attempts == 1
+
+
+def test_backfill_current_month(config_path, tmp_path, batches):
+    runs, _ = batches
+    month = f"{datetime.now():%Y-%m}"
+
+    for _ in range(2):
+        workflows.backfill(config_path=config_path, start=month, db=['duckdb'], quiet=True,
+                           checkpoints=tmp_path / 'checkpoints.db')
+
+    # the current month is loaded again: its readings are still growing
+    assert len(runs) == 2 and len(runs[1]) == 1
+
+
+def test_batch_switchboard_pipeline(config_path, tmp_path, monkeypatch):
+    events = []
+
+    class Scraper:
+        def __init__(self, **kwargs):
+            self.timings = {}
+            self.tmp = tmp_path
+
+        def download_many(self, periods):
+            for key, cpe, month, year in periods:
+                events.append(("download", month))
+                time.sleep(0.05)
+                yield key, ValueError("no readings") if month == 2 else tmp_path / f"{month}.xlsx"
+
+    def parse_source(cpe, source, entry=None):
+        events.append(("parse", int(Path(source).stem)))
+        time.sleep(0.05)
+        return source
+
+    def load_source(month, batch, session_id, db, timings, **kwargs):
+        assert batch == tmp_path / f"{month}.xlsx" and "parse" in timings
+        return ERSSession(session_id=session_id, workflow="select", databases=db, source_data=None,
+                          status="completed", timestamp=datetime.now())
+
+    monkeypatch.setattr(workflows, 'EredesScraper', Scraper)
+    monkeypatch.setattr(workflows, 'parse_source', parse_source)
+    monkeypatch.setattr(workflows, 'load_source', load_source)
+
+    children = [BatchChild(task_id=uuid4(), cpe='PT0001', month=month, year=2023) for month in range(1, 5)]
+    loaded, stages = [], {}
+    results = workflows.batch_switchboard(config_path=config_path, children=children, db=['duckdb'], quiet=True,
+                                          keep=True, cache=False, stages=stages,
+                                          on_result=lambda child, result: loaded.append(child.month))
+
+    assert [r.status for r in results] == ['completed', 'failed: no readings', 'completed', 'completed']
+    assert loaded == [1, 2, 3, 4]
+    # month 1 was parsed before month 3 was downloaded
+    assert events.index(("parse", 1)) < events.index(("download", 3))
+    assert {name: stage["items"] for name, stage in stages.items()} == {'download': 4, 'parse': 4, 'sinks': 4}
+
+
+def test_sync(config_path, tmp_path, monkeypatch):
+    runs = []
+    failing = set()
+    sink_marks = [None]
+
+    def batch_switchboard(config_path, children, db, delta, **kwargs):
+        assert delta
+        runs.append([(child.year, child.month) for child in children])
+        return [ERSSession(session_id=child.task_id, workflow="select", databases=db, source_data=None,
+                           status="failed: boom" if (child.year, child.month) in failing else "completed",
+                           timestamp=datetime.now(),
+                           watermark=datetime(child.year, child.month, 10, tzinfo=timezone.utc))
+                for child in children]
+
+    monkeypatch.setattr(workflows, 'batch_switchboard', batch_switchboard)
+    monkeypatch.setattr(workflows, 'sink_watermark', lambda *args, **kwargs: sink_marks[0])
+
+    def sync(today):
+        return workflows.sync(config_path=config_path, db=['duckdb'], quiet=True,
+                              checkpoints=tmp_path / 'checkpoints.db', today=today)
+
+    # nothing to start from: the current month only
+    result = sync(datetime(2024, 3, 12))
+    assert result.status == 'completed' and result.watermark == datetime(2024, 3, 10, tzinfo=timezone.utc)
+
+    # the databases cannot tell: the local watermark is used, and it does not move past a failed month
+    failing.add((2024, 4))
+    result = sync(datetime(2024, 5, 2))
+    assert result.status == 'completed with 1 failed months'
+    assert result.watermark == datetime(2024, 3, 10, tzinfo=timezone.utc)
+
+    # the databases hold every reading of March: the sync starts in April
+    sink_marks[0] = datetime(2024, 4, 1, tzinfo=timezone.utc)
+    failing.clear()
+    assert sync(datetime(2024, 5, 2)).watermark == datetime(2024, 5, 10, tzinfo=timezone.utc)
+
+    assert runs == [[(2024, 3)], [(2024, 3), (2024, 4), (2024, 5)], [(2024, 4), (2024, 5)]]
+
+
+def test_switchboard_profile(config_path, tmp_path, monkeypatch):
+    def _switchboard(uuid, **kwargs):
+        readings = [list(range(1000)) for _ in range(200)]
+        return ERSSession(session_id=uuid, workflow='current', databases=[], source_data=None, status='completed',
+                          timestamp=datetime.now(), timings={'readings': len(readings)})
+
+    monkeypatch.setattr(workflows, '_switchboard', _switchboard)
+
+    task_id = uuid4()
+    result = workflows.switchboard(config_path=config_path, name='current', quiet=True, output=tmp_path,
+                                   uuid=task_id, profile=True)
+
+    assert result.profile == tmp_path / str(task_id) / 'profile.pstats'
+    assert any(name == '_switchboard' for _, _, name in pstats.Stats(str(result.profile)).stats)
+    summary = json.loads(result.profile.with_name('profile.json').read_text())
+    # the readings allocated by the run
+    assert summary['peak_memory_bytes'] > 200 * 1000 * 28
+    assert summary['functions'] and summary['profile'] == 'profile.pstats'
+
+    assert workflows.switchboard(config_path=config_path, name='current', quiet=True, output=tmp_path,
+                                 uuid=uuid4()).profile is None